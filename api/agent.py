@@ -1,23 +1,28 @@
-from langchain_community.chat_models import ChatOpenAI
 from langsmith import traceable
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from langchain.tools import Tool
-from typing import TypedDict, Literal, List, Optional, Dict, Any
-from pymongo import MongoClient
+from langchain.schema import HumanMessage, SystemMessage
+from langchain.tools import StructuredTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from typing import TypedDict, NotRequired, Literal, List, Optional, Dict, Any, Awaitable
 from bson import ObjectId
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, create_model
+import asyncio
 import os
 import re
 from functools import partial
 
+from api.cache import TTLCache
+from api.db import sessions_db, agents_db, connectors_db, async_agents_db, async_connectors_db
+from api.history import build_history_messages
+from api.llm import get_chat_model
+from api.metrics import register_source
+from api.response_cache import CachedResponseModel, invalidate_agent_responses
+from api.router import route_agent
+from api.semantic_cache import SemanticCacheModel, purge_agent_answers
+from api.tool_loop import ToolLoop
 from api.tools.web import search_web
-from api.tools.google_sheet import read_google_sheet
+from api.tools.google_sheet import read_google_sheet, read_google_sheet_ranges, query_google_sheet
 from api.tools.google_drive import read_google_drive
 
-sessions_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).nexa.sessions
-agents_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).nexa.agents
-connectors_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).nexa.connectors
-
 Tools = Literal[
     "search_web",
 ]
@@ -61,22 +66,29 @@ class PyObjectId(ObjectId):
             serialization=core_schema.plain_serializer_function_ser_schema(str),
         )
 
+class QueryLimits(BaseModel):
+    max_rows: Optional[int] = Field(default=None, gt=0)
+    max_columns: Optional[int] = Field(default=None, gt=0)
+
 class Connector(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True, populate_by_name=True)
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     name: str = Field(...)
     connector_type: Connectors = Field(..., alias="connector_type")
     settings: Dict[str, Any]
+    query_limits: Optional[QueryLimits] = None
     org: PyObjectId
 
 class ConnectorCreate(BaseModel):
     name: str = Field(...)
     connector_type: Connectors
     settings: Dict[str, Any]
+    query_limits: Optional[QueryLimits] = None
 
 class ConnectorUpdate(BaseModel):
     name: Optional[str] = None
     settings: Optional[Dict[str, Any]] = None
+    query_limits: Optional[QueryLimits] = None
 
 class Agent(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True, populate_by_name=True)
@@ -88,6 +100,9 @@ class Agent(BaseModel):
     temperature: float = Field(default=0.7, ge=0.0, le=2.0)
     tools: list[Tools]
     connector_ids: List[PyObjectId] = Field(default_factory=list)
+    history_token_budget: Optional[int] = Field(default=None, gt=0)
+    response_cache: bool = False
+    semantic_cache: bool = False
     created_at: str
     updated_at: str
 
@@ -98,6 +113,9 @@ class AgentCreate(BaseModel):
     temperature: float = Field(default=0.7, ge=0.0, le=2.0)
     tools: List[Tools] = []
     connector_ids: List[PyObjectId] = Field(default_factory=list)
+    history_token_budget: Optional[int] = Field(default=None, gt=0)
+    response_cache: bool = False
+    semantic_cache: bool = False
 
 class AgentUpdate(BaseModel):
     name: Optional[str] = None
@@ -106,12 +124,16 @@ class AgentUpdate(BaseModel):
     temperature: Optional[float] = Field(default=None, ge=0.0, le=2.0)
     tools: Optional[List[Tools]] = None
     connector_ids: Optional[List[PyObjectId]] = None
+    history_token_budget: Optional[int] = Field(default=None, gt=0)
+    response_cache: Optional[bool] = None
+    semantic_cache: Optional[bool] = None
 
 class ChatHistoryEntry(TypedDict):
     user: str
     assistant: str
     agent_id: str | None
     agent_name: str
+    tokens: NotRequired[int]
 
 class AgentState(TypedDict, total=False):
     question: str
@@ -120,122 +142,219 @@ class AgentState(TypedDict, total=False):
     agent_name: str
     answer: str
 
-@traceable
-async def get_agent_components(
-    question: str,
-    organization_id: ObjectId,
-    chat_history: list | None = None,
-    agent_id: str | None = None,
-) -> tuple:
-    question = question.strip()
-    chat_history = chat_history or []
-    selected_agent = None
+AGENT_BUNDLE_TTL = float(os.environ.get("AGENT_BUNDLE_TTL", 300))
+AGENT_BUNDLE_CACHE_SIZE = int(os.environ.get("AGENT_BUNDLE_CACHE_SIZE", 1000))
 
-    if agent_id:
-        selected_agent = agents_db.find_one(
-            {"_id": ObjectId(agent_id), "org": organization_id}
-        )
+class AgentBundle:
+    """Everything needed to answer with one agent version, built once and reused across requests."""
+
+    def __init__(self, version: str, agent_id: str | None, agent_name: str, llm, tools: list, system_prompt: str, connector_ids: list, history_token_budget: int | None = None):
+        self.version = version
+        self.agent_id = agent_id
+        self.agent_name = agent_name
+        self.llm = llm
+        self.tools = tools
+        self.system_prompt = system_prompt
+        self.connector_ids = connector_ids
+        self.history_token_budget = history_token_budget
+
+agent_bundles = TTLCache(maxsize=AGENT_BUNDLE_CACHE_SIZE, ttl=AGENT_BUNDLE_TTL, name="agent_bundles")
+register_source("agent_bundles", agent_bundles.stats)
+
+_connector_agents: dict = {}
+
+def _agent_version(agent: dict) -> str:
+    return str(agent.get("updated_at"))
+
+def invalidate_agent_bundle(agent_id) -> None:
+    agent_bundles.invalidate(str(agent_id))
+    invalidate_agent_responses(agent_id)
+    purge_agent_answers(agent_id)
+
+def invalidate_connector_bundles(connector_id) -> None:
+    for agent_id in _connector_agents.pop(str(connector_id), set()):
+        agent_bundles.invalidate(agent_id)
+        invalidate_agent_responses(agent_id)
+        purge_agent_answers(agent_id)
+
+async def compile_agent(agent: dict) -> AgentBundle:
+    active_tools = [
+        tool for tool in [
+            search_web if "search_web" in agent.get("tools", []) else None,
+        ] if tool is not None
+    ]
+
+    connector_ids = agent.get("connector_ids", [])
+    if connector_ids:
+        agent_connectors = await async_connectors_db.find({"_id": {"$in": connector_ids}}).to_list()
     else:
-        agents = list(agents_db.find({"org": organization_id}))
-        if agents:
-            agent_descriptions = "\n".join(
-                [f"- **{agent['name']}**: {agent['description']}" for agent in agents]
-            )
-            router_prompt = [
-                SystemMessage(
-                    content=(
-                        "You are an expert at routing a user's request to the correct agent. "
-                        "Based on the user's question, select the best agent from the following list. "
-                        "You must output **only the name** of the agent you choose. "
-                        "If no agent seems suitable for the request, you must output 'Generalist'."
-                        f"\n\nAvailable Agents:\n{agent_descriptions}"
-                    )
-                ),
-                HumanMessage(content=question),
-            ]
-            router_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-            selected_agent_name_response = await router_llm.ainvoke(router_prompt)
-            selected_agent_name = selected_agent_name_response.content.strip()
-            selected_agent = next(
-                (agent for agent in agents if agent["name"] == selected_agent_name),
-                None,
-            )
+        agent_connectors = []
+    
+    tool_function_map = {
+        "google_sheet": [read_google_sheet, read_google_sheet_ranges, query_google_sheet],
+        "google_drive": [read_google_drive]
+    }
 
-    if selected_agent:
-        active_tools = [
-            tool for tool in [
-                search_web if "search_web" in selected_agent.get("tools", []) else None,
-            ] if tool is not None
-        ]
-
-        connector_ids = selected_agent.get("connector_ids", [])
-        if connector_ids:
-            agent_connectors = list(connectors_db.find({"_id": {"$in": connector_ids}}))
-        else:
-            agent_connectors = []
-        
-        tool_function_map = {
-            "google_sheet": read_google_sheet,
-            "google_drive": read_google_drive
-        }
-
-        for connector in agent_connectors:
-            connector_name = connector.get("name")
-            connector_type = connector.get("connector_type")
-
-            if not connector_name or connector_type not in tool_function_map:
-                continue
-
-            base_function = tool_function_map[connector_type]
-            
+    for connector in agent_connectors:
+        connector_name = connector.get("name")
+        connector_type = connector.get("connector_type")
+
+        if not connector_name or connector_type not in tool_function_map:
+            continue
+
+        for base_function in tool_function_map[connector_type]:
             tool_name = _clean_tool_name(connector_name, base_function.name)
             
             tool_description = (
                 f"Use this tool to access the '{connector_name}' {connector_type.replace('_', ' ')}. "
                 f"It is a specialized version of the '{base_function.name}' tool.\n"
-                f"{base_function.__doc__}"
+                f"{base_function.description}"
             )
 
-            configured_func = partial(base_function, settings=connector["settings"])
+            bound_arguments = {"settings": connector["settings"]}
+            if "limits" in base_function.args_schema.model_fields:
+                bound_arguments["limits"] = connector.get("query_limits") or {}
+            configured_func = partial(base_function.func, **bound_arguments)
 
-            new_tool = Tool(
+            # The model only fills in the call arguments; connector configuration is bound above.
+            args_schema = create_model(
+                f"{tool_name}_args",
+                **{
+                    field_name: (field.annotation, field)
+                    for field_name, field in base_function.args_schema.model_fields.items()
+                    if field_name not in bound_arguments
+                }
+            )
+            new_tool = StructuredTool(
                 name=tool_name,
                 func=configured_func,
-                description=tool_description
+                description=tool_description,
+                args_schema=args_schema
             )
             active_tools.append(new_tool)
-        
-        agent_llm = ChatOpenAI(
-            model=selected_agent["model"],
-            temperature=selected_agent.get("temperature", 0.7),
-            tools=active_tools,
-            tool_choice="auto" if active_tools else None,
+    
+    if active_tools:
+        agent_llm = ToolLoop(
+            get_chat_model(
+                agent["model"],
+                temperature=agent.get("temperature", 0.7),
+                streaming=True,
+                max_retries=3,
+                tools=[convert_to_openai_tool(tool) for tool in active_tools],
+                tool_choice="auto"
+            ),
+            active_tools,
+        )
+    else:
+        agent_llm = get_chat_model(
+            agent["model"],
+            temperature=agent.get("temperature", 0.7),
             streaming=True,
             max_retries=3
         )
-        system_prompt = selected_agent["description"]
-        final_agent_id = selected_agent["_id"]
-        final_agent_name = selected_agent["name"]
+
+    if agent.get("semantic_cache"):
+        agent_llm = SemanticCacheModel(agent_llm, agent.get("org"), str(agent["_id"]), _agent_version(agent))
+
+    # Only deterministic agents, or agents that opted in, may replay an earlier answer.
+    if agent.get("temperature", 0.7) == 0 or agent.get("response_cache"):
+        agent_llm = CachedResponseModel(agent_llm, str(agent["_id"]), _agent_version(agent))
+
+    return AgentBundle(
+        version=_agent_version(agent),
+        agent_id=str(agent["_id"]),
+        agent_name=agent["name"],
+        llm=agent_llm,
+        tools=active_tools,
+        system_prompt=agent["description"],
+        connector_ids=[str(connector["_id"]) for connector in agent_connectors],
+        history_token_budget=agent.get("history_token_budget"),
+    )
+
+async def get_agent_bundle(agent: dict) -> AgentBundle:
+    agent_id = str(agent["_id"])
+    bundle = agent_bundles.get(agent_id)
+    if bundle is not None and bundle.version == _agent_version(agent):
+        return bundle
+
+    bundle = await compile_agent(agent)
+    agent_bundles.set(agent_id, bundle)
+    for connector_id in bundle.connector_ids:
+        _connector_agents.setdefault(connector_id, set()).add(agent_id)
+    return bundle
+
+_generalist_bundle: AgentBundle | None = None
+
+def get_generalist_bundle() -> AgentBundle:
+    global _generalist_bundle
+    if _generalist_bundle is None:
+        _generalist_bundle = AgentBundle(
+            version="generalist",
+            agent_id=None,
+            agent_name="Generalist",
+            llm=get_chat_model("gpt-4o-mini", temperature=0.7, max_retries=3),
+            tools=[],
+            system_prompt="You are a helpful general-purpose assistant.",
+            connector_ids=[],
+        )
+    return _generalist_bundle
+
+async def select_bundle(question: str, organization_id: ObjectId, agent_id: str | None = None) -> AgentBundle:
+    if agent_id:
+        selected_agent = await async_agents_db.find_one(
+            {"_id": ObjectId(agent_id), "org": organization_id}
+        )
     else:
-        agent_llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.7,
-            max_retries=3
+        agents = await async_agents_db.find({"org": organization_id}).to_list()
+        selected_agent = await route_agent(question, organization_id, agents)
+
+    if selected_agent:
+        return await get_agent_bundle(selected_agent)
+    return get_generalist_bundle()
+
+def without_answer_caches(llm):
+    """The agent's model without the layers that replay earlier answers."""
+    while isinstance(llm, (CachedResponseModel, SemanticCacheModel)):
+        llm = llm.llm
+    return llm
+
+@traceable
+async def get_agent_components(
+    question: str,
+    organization_id: ObjectId,
+    chat_history: list | None = None,
+    agent_id: str | None = None,
+    history_summary: dict | None = None,
+    session: Awaitable | None = None,
+    use_cache: bool = True,
+) -> tuple:
+    """
+    Selects the agent for a question and builds its prompt.
+
+    `session` may be an awaitable resolving to the session document; it is then
+    loaded while the agent is being selected and its history is used in place of
+    `chat_history` and `history_summary`. With `use_cache` False the model never
+    replays a cached answer, for requests that ask for a new one (regenerate, edit).
+    """
+    question = question.strip()
+    if session is not None:
+        bundle, session = await asyncio.gather(
+            select_bundle(question, organization_id, agent_id),
+            session,
         )
-        system_prompt = "You are a helpful general-purpose assistant."
-        final_agent_id = None
-        final_agent_name = "Generalist"
-
-    messages = [SystemMessage(content=system_prompt)]
-    for entry in chat_history:
-        messages.append(HumanMessage(content=entry["user"]))
-        messages.append(AIMessage(content=entry["assistant"]))
+        if session:
+            chat_history = session.get("chat_history", [])
+            history_summary = session.get("history_summary")
+    else:
+        bundle = await select_bundle(question, organization_id, agent_id)
+
+    messages = [SystemMessage(content=bundle.system_prompt)]
+    messages.extend(build_history_messages(chat_history or [], history_summary, bundle.history_token_budget))
     messages.append(HumanMessage(content=question))
 
     return (
-        agent_llm,
+        bundle.llm if use_cache else without_answer_caches(bundle.llm),
         messages,
-        final_agent_name,
-        str(final_agent_id) if final_agent_id else None,
+        bundle.agent_name,
+        bundle.agent_id,
     )
-
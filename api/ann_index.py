@@ -0,0 +1,461 @@
+import fcntl
+import json
+import os
+import shutil
+import struct
+import threading
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from bson import ObjectId
+
+from api.vector_index import VectorIndex, normalize_rows, top_k_indices
+
+# Below this many vectors an IVF index searches exactly; exact search is fast enough there.
+KNOWLEDGE_ANN_MIN_TRAIN_VECTORS = int(os.environ.get("KNOWLEDGE_ANN_MIN_TRAIN_VECTORS", 20000))
+KNOWLEDGE_ANN_NPROBE = int(os.environ.get("KNOWLEDGE_ANN_NPROBE", 16))
+KNOWLEDGE_ANN_TRAIN_ITERATIONS = int(os.environ.get("KNOWLEDGE_ANN_TRAIN_ITERATIONS", 10))
+# k-means is trained on at most this many vectors per list, sampled at random.
+KNOWLEDGE_ANN_TRAIN_SAMPLE = int(os.environ.get("KNOWLEDGE_ANN_TRAIN_SAMPLE", 64))
+# Centroids are retrained once the index has grown this many times past the size it was trained at.
+KNOWLEDGE_ANN_RETRAIN_GROWTH = float(os.environ.get("KNOWLEDGE_ANN_RETRAIN_GROWTH", 4))
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int | None = None, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: unit-length centroids that maximize cosine similarity to their members."""
+    iterations = KNOWLEDGE_ANN_TRAIN_ITERATIONS if iterations is None else iterations
+    rng = np.random.default_rng(seed)
+    if len(vectors) > nlist * KNOWLEDGE_ANN_TRAIN_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), nlist * KNOWLEDGE_ANN_TRAIN_SAMPLE, replace=False)]
+    nlist = min(nlist, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        filled = np.flatnonzero(counts)
+        sums = np.add.reduceat(vectors[order], np.concatenate(([0], np.cumsum(counts)[:-1]))[filled], axis=0)
+        centroids[filled] = normalize_rows(sums)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        assignments[start:start + batch] = np.argmax(vectors[start:start + batch] @ centroids.T, axis=1)
+    return assignments
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted-file approximate index: vectors are grouped under their nearest of
+    nlist k-means centroids, and a query scores exactly only the vectors of its
+    nprobe nearest groups.
+
+    Until KNOWLEDGE_ANN_MIN_TRAIN_VECTORS vectors are added it searches exactly. Inserts and
+    removals after training go straight into their groups; the centroids are
+    retrained once the index outgrows its training size by KNOWLEDGE_ANN_RETRAIN_GROWTH.
+    """
+
+    def __init__(self, dim: int, capacity: int = 0, nlist: int | None = None, nprobe: int | None = None,
+                 min_train: int | None = None):
+        super().__init__(dim, capacity)
+        self.nlist = nlist
+        self.nprobe = KNOWLEDGE_ANN_NPROBE if nprobe is None else nprobe
+        self.min_train = KNOWLEDGE_ANN_MIN_TRAIN_VECTORS if min_train is None else min_train
+        self.centroids = None
+        self.lists = np.zeros(len(self.matrix), dtype=np.int32)
+        self.trained_count = 0
+        self._buckets: list = []
+        self._bucket_arrays: dict = {}
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self) -> None:
+        with self._lock:
+            vectors = self.vectors
+            nlist = self.nlist or max(1, int(np.sqrt(len(vectors))))
+            self.centroids = train_centroids(vectors, nlist)
+            self.trained_count = len(vectors)
+            self._assign_all()
+
+    def _assign_all(self) -> None:
+        self.lists = np.zeros(len(self.matrix), dtype=np.int32)
+        self.lists[:len(self.ids)] = assign_lists(self.vectors, self.centroids)
+        self._buckets = [set() for _ in range(len(self.centroids))]
+        for row, group in enumerate(self.lists[:len(self.ids)].tolist()):
+            self._buckets[group].add(row)
+        self._bucket_arrays = {}
+
+    def _move(self, row: int, group: int | None) -> None:
+        # Takes a row out of its group and, unless group is None, puts it into group.
+        self._buckets[self.lists[row]].discard(row)
+        self._bucket_arrays.pop(int(self.lists[row]), None)
+        if group is not None:
+            self.lists[row] = group
+            self._buckets[group].add(row)
+            self._bucket_arrays.pop(group, None)
+
+    def add(self, ids: list, vectors) -> None:
+        with self._lock:
+            known = {item_id for item_id in ids if item_id in self.rows}
+            super().add(ids, vectors)
+            if len(self.lists) < len(self.matrix):
+                grown = np.zeros(len(self.matrix), dtype=np.int32)
+                grown[:len(self.lists)] = self.lists
+                self.lists = grown
+            if not self.trained:
+                if len(self.ids) >= self.min_train:
+                    self.train()
+                return
+            if len(self.ids) > self.trained_count * KNOWLEDGE_ANN_RETRAIN_GROWTH:
+                self.train()
+                return
+            rows = np.array([self.rows[item_id] for item_id in ids], dtype=np.int64)
+            groups = assign_lists(self.matrix[rows], self.centroids)
+            for item_id, row, group in zip(ids, rows.tolist(), groups.tolist()):
+                if item_id in known:
+                    self._move(row, group)
+                else:
+                    self.lists[row] = group
+                    self._buckets[group].add(row)
+                    self._bucket_arrays.pop(group, None)
+
+    def remove(self, ids: list) -> int:
+        with self._lock:
+            if not self.trained:
+                return super().remove(ids)
+            removed = 0
+            for item_id in ids:
+                row = self.rows.get(item_id)
+                if row is None:
+                    continue
+                last = len(self.ids) - 1
+                self._move(row, None)
+                if row != last:
+                    group = int(self.lists[last])
+                    self._move(last, None)
+                    self._move(row, group)
+                removed += super().remove([item_id])
+            return removed
+
+    def _bucket(self, group: int) -> np.ndarray:
+        rows = self._bucket_arrays.get(group)
+        if rows is None:
+            rows = np.fromiter(self._buckets[group], dtype=np.int64, count=len(self._buckets[group]))
+            self._bucket_arrays[group] = rows
+        return rows
+
+    def search(self, query, k: int = 5, nprobe: int | None = None) -> list:
+        return self.search_batch(np.asarray(query).reshape(1, -1), k, nprobe)[0]
+
+    def search_batch(self, queries, k: int = 5, nprobe: int | None = None) -> list:
+        """Searches the nprobe groups nearest each query (all vectors until the index is trained)."""
+        if not self.trained:
+            return super().search_batch(queries, k)
+        queries = normalize_rows(queries).reshape(-1, self.dim)
+        nprobe = self.nprobe if nprobe is None else nprobe
+        results = []
+        with self._lock:
+            probes = top_k_indices(queries @ self.centroids.T, nprobe)
+            for query, groups in zip(queries, probes):
+                rows = np.concatenate([self._bucket(group) for group in groups.tolist()])
+                scores = self.matrix[rows] @ query
+                best = top_k_indices(scores, k)
+                results.append([(self.ids[rows[i]], float(scores[i])) for i in best.tolist()])
+        return results
+
+def new_index(kind: str, dim: int, capacity: int = 0) -> VectorIndex:
+    """"flat" for exact search, "ivf" for an IVFIndex (exact until it is large enough to train)."""
+    if kind == "flat":
+        return VectorIndex(dim, capacity)
+    if kind == "ivf":
+        return IVFIndex(dim, capacity)
+    raise ValueError(f"Unknown vector index type '{kind}'.")
+
+# --- Persistence ---
+# An index is saved as .npy files in a fresh directory next to a CURRENT file
+# naming it; replacing CURRENT is atomic, so readers never see a half-written index.
+# Writers take a lock on the directory, so concurrent saves from several workers
+# replace CURRENT one after the other and every superseded version is removed.
+#
+# Changes made after a save are appended to the version's change log rather than
+# written as a new version, and replayed when it is loaded; the caller decides
+# when the log has grown enough to be worth saving a new version instead.
+
+CHANGE_LOG = "changes.log"
+# Record header: kind (b"a" added rows, b"r" removed ids, b"m" meta update) and its count
+# (rows, ids, or bytes of JSON); ids are 12 raw bytes each, rows little-endian float32.
+_RECORD = struct.Struct("<cI")
+_ROW_DTYPE = np.dtype("<f4")
+
+@contextmanager
+def _directory_lock(directory: str):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "LOCK"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _remove_versions(directory: str, keep: str | None = None) -> None:
+    # Processes still mapping a removed version keep reading it after the unlink.
+    for name in os.listdir(directory):
+        if name.startswith("v-") and name != keep:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+def _encode_ids(ids: list) -> np.ndarray:
+    if not all(isinstance(item_id, ObjectId) for item_id in ids):
+        raise ValueError("Only indexes keyed by ObjectId can be saved.")
+    # Raw bytes rather than "S12": numpy strips trailing NUL bytes from fixed-width strings.
+    return np.frombuffer(b"".join(item_id.binary for item_id in ids), dtype=np.uint8).reshape(-1, 12)
+
+def save_index(index: VectorIndex, directory: str, meta: dict | None = None) -> str:
+    """Writes index under directory and makes it the current version; returns the version's path."""
+    with _directory_lock(directory):
+        version = os.path.join(directory, f"v-{uuid.uuid4().hex}")
+        _write_version(index, directory, version, meta)
+        # Also versions left behind by a save that died before replacing CURRENT.
+        _remove_versions(directory, keep=os.path.basename(version))
+    return version
+
+def _write_version(index: VectorIndex, directory: str, version: str, meta: dict | None) -> None:
+    os.makedirs(version)
+    try:
+        with index._lock:
+            np.save(os.path.join(version, "vectors.npy"), index.vectors)
+            np.save(os.path.join(version, "ids.npy"), _encode_ids(index.ids))
+            info = {"type": "flat", "dim": index.dim, "count": len(index), **(meta or {})}
+            if isinstance(index, IVFIndex):
+                info.update(type="ivf", nlist=index.nlist, nprobe=index.nprobe, min_train=index.min_train,
+                            trained_count=index.trained_count)
+                if index.trained:
+                    np.save(os.path.join(version, "centroids.npy"), index.centroids)
+                    np.save(os.path.join(version, "lists.npy"), index.lists[:len(index)])
+        with open(os.path.join(version, "meta.json"), "w") as f:
+            json.dump(info, f)
+        pointer = os.path.join(directory, f".CURRENT-{uuid.uuid4().hex}")
+        with open(pointer, "w") as f:
+            f.write(os.path.basename(version))
+        os.replace(pointer, os.path.join(directory, "CURRENT"))
+    except BaseException:
+        shutil.rmtree(version, ignore_errors=True)
+        raise
+    index.version, index.meta, index.changes = os.path.basename(version), info, 0
+
+def current_version(directory: str):
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return os.path.join(directory, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+def _load_version(version: str, mmap: bool):
+    with open(os.path.join(version, "meta.json")) as f:
+        meta = json.load(f)
+    vectors = np.load(os.path.join(version, "vectors.npy"), mmap_mode="r" if mmap else None)
+    ids = [ObjectId(row.tobytes()) for row in np.load(os.path.join(version, "ids.npy"))]
+    if meta["type"] == "ivf":
+        index = IVFIndex(meta["dim"], 0, meta.get("nlist"), meta.get("nprobe"), meta.get("min_train"))
+    else:
+        index = VectorIndex(meta["dim"])
+    # Saved rows are already normalized, so they become the matrix as they are.
+    if len(ids):
+        index.matrix = vectors
+    index.ids = ids
+    index.rows = {item_id: row for row, item_id in enumerate(ids)}
+    index.version = os.path.basename(version)
+    index.meta = meta
+    if isinstance(index, IVFIndex):
+        index.lists = np.zeros(len(index.matrix), dtype=np.int32)
+        if os.path.exists(os.path.join(version, "centroids.npy")):
+            index.centroids = np.load(os.path.join(version, "centroids.npy"))
+            index.trained_count = meta.get("trained_count", len(ids))
+            index.lists[:len(ids)] = np.load(os.path.join(version, "lists.npy"))
+            index._buckets = [set() for _ in range(len(index.centroids))]
+            for row, group in enumerate(index.lists[:len(ids)].tolist()):
+                index._buckets[group].add(row)
+    return index
+
+def _copy_index(index: VectorIndex) -> VectorIndex:
+    # A private in-memory copy of index, trained groups included.
+    with index._lock:
+        if isinstance(index, IVFIndex):
+            copy = IVFIndex(index.dim, 0, index.nlist, index.nprobe, index.min_train)
+            copy.centroids = index.centroids
+            copy.trained_count = index.trained_count
+            copy.lists = np.array(index.lists[:len(index)])
+            copy._buckets = [set(rows) for rows in index._buckets]
+        else:
+            copy = VectorIndex(index.dim)
+        copy.matrix = np.array(index.vectors)
+        copy.ids = list(index.ids)
+        copy.rows = dict(index.rows)
+        copy.version, copy.meta = index.version, dict(index.meta)
+    return copy
+
+class DeltaIndex:
+    """
+    A saved index mapped read-only plus the changes made since: added rows go to
+    a small in-memory VectorIndex and removed ids are hidden from results, so an
+    insert never copies the mapped vectors into memory.
+    """
+
+    def __init__(self, base: VectorIndex):
+        self.base = base
+        self.dim = base.dim
+        self.delta = VectorIndex(base.dim)
+        self.removed: set = set()
+        self.version = base.version
+        self.meta = base.meta
+        self.changes = 0
+        self._lock = threading.RLock()
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self.base.matrix
+
+    def __len__(self) -> int:
+        return len(self.base) - len(self.removed) + len(self.delta)
+
+    def __contains__(self, item_id) -> bool:
+        return item_id in self.delta or (item_id in self.base and item_id not in self.removed)
+
+    @property
+    def ids(self) -> list:
+        with self._lock:
+            return [item_id for item_id in self.base.ids if item_id not in self.removed] + list(self.delta.ids)
+
+    def add(self, ids: list, vectors) -> None:
+        with self._lock:
+            # A replaced row is hidden in the base and lives on in the delta.
+            self.removed.update(item_id for item_id in ids if item_id in self.base)
+            self.delta.add(ids, vectors)
+
+    def remove(self, ids: list) -> int:
+        with self._lock:
+            hidden = {item_id for item_id in ids if item_id in self.base and item_id not in self.removed}
+            self.removed |= hidden
+            return self.delta.remove([item_id for item_id in ids if item_id not in hidden]) + len(hidden)
+
+    def search(self, query, k: int = 5, **options) -> list:
+        return self.search_batch(np.asarray(query).reshape(1, -1), k, **options)[0]
+
+    def search_batch(self, queries, k: int = 5, **options) -> list:
+        with self._lock:
+            removed = set(self.removed)
+            saved = self.base.search_batch(queries, k + len(removed), **options)
+            recent = self.delta.search_batch(queries, k)
+        return [
+            sorted([hit for hit in hits if hit[0] not in removed] + new, key=lambda hit: -hit[1])[:k]
+            for hits, new in zip(saved, recent)
+        ]
+
+    def materialize(self) -> VectorIndex:
+        """A plain in-memory index with the changes applied, e.g. to save as a new version."""
+        with self._lock:
+            index = _copy_index(self.base)
+            index.remove(list(self.removed))
+            if len(self.delta):
+                index.add(list(self.delta.ids), self.delta.vectors)
+            index.meta = dict(self.meta)
+        return index
+
+def _encode_changes(dim: int, added_ids: list, added_vectors, removed_ids: list, meta: dict | None) -> bytes:
+    records = []
+    if removed_ids:
+        records.append(_RECORD.pack(b"r", len(removed_ids)) + _encode_ids(removed_ids).tobytes())
+    if added_ids:
+        rows = normalize_rows(added_vectors).reshape(-1, dim).astype(_ROW_DTYPE)
+        records.append(_RECORD.pack(b"a", len(added_ids)) + _encode_ids(added_ids).tobytes() + rows.tobytes())
+    if meta:
+        body = json.dumps(meta).encode("utf-8")
+        records.append(_RECORD.pack(b"m", len(body)) + body)
+    return b"".join(records)
+
+def _replay_changes(index, version: str) -> None:
+    try:
+        with open(os.path.join(version, CHANGE_LOG), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    offset = 0
+    while offset + _RECORD.size <= len(data):
+        kind, count = _RECORD.unpack_from(data, offset)
+        start = offset + _RECORD.size
+        size = {b"a": count * (12 + index.dim * _ROW_DTYPE.itemsize), b"r": count * 12}.get(kind, count)
+        if start + size > len(data):
+            # A record still being appended.
+            break
+        payload = data[start:start + size]
+        offset = start + size
+        if kind == b"m":
+            index.meta.update(json.loads(payload))
+            continue
+        ids = [ObjectId(payload[i * 12:(i + 1) * 12]) for i in range(count)]
+        if kind == b"a":
+            index.add(ids, np.frombuffer(payload, dtype=_ROW_DTYPE, offset=count * 12).reshape(count, index.dim))
+        else:
+            index.remove(ids)
+        index.changes += count
+
+def log_changes(index, directory: str, added_ids: list = (), added_vectors=None, removed_ids: list = (),
+                meta: dict | None = None) -> bool:
+    """
+    Appends changes already made to index to the change log of the saved version
+    it was loaded from, and merges meta into its meta. Returns False, writing
+    nothing, when that version is no longer the current one.
+    """
+    added_ids, removed_ids = list(added_ids), list(removed_ids)
+    records = _encode_changes(index.dim, added_ids, added_vectors, removed_ids, meta)
+    with _directory_lock(directory):
+        version = current_version(directory)
+        if version is None or os.path.basename(version) != index.version:
+            return False
+        with open(os.path.join(version, CHANGE_LOG), "ab") as f:
+            f.write(records)
+    index.changes += len(added_ids) + len(removed_ids)
+    index.meta.update(meta or {})
+    return True
+
+def _load_with_changes(version: str, mmap: bool):
+    index = _load_version(version, mmap)
+    if mmap:
+        index = DeltaIndex(index)
+    _replay_changes(index, version)
+    return index
+
+def load_index(directory: str, mmap: bool = False):
+    """
+    The current saved index under directory with its logged changes applied, or
+    None when there is none.
+
+    With mmap the vectors stay in the saved file, mapped read-only: every process
+    loading the same version shares one copy in the page cache, and the result
+    is a DeltaIndex that keeps later changes next to it in memory.
+    """
+    for attempt in range(3):
+        version = current_version(directory)
+        if version is None:
+            return None
+        try:
+            return _load_with_changes(version, mmap)
+        except FileNotFoundError:
+            # Replaced and removed by a concurrent save_index; read CURRENT again.
+            if attempt == 2:
+                raise
+
+def discard_index(directory: str) -> None:
+    """Drops the saved index under directory, so the next load rebuilds it."""
+    if not os.path.isdir(directory):
+        return
+    with _directory_lock(directory):
+        try:
+            os.remove(os.path.join(directory, "CURRENT"))
+        except FileNotFoundError:
+            pass
+        _remove_versions(directory)
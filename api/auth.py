@@ -4,8 +4,14 @@ from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from typing import Optional
 from fastapi import HTTPException
-from pymongo import MongoClient
+from bson import ObjectId
 import os
+import time
+
+from api.cache import TTLCache
+from api.db import users_db, prospective_users_db, orgs_db, revocations_db
+from api.metrics import register_source
+from api.revocation import RevocationList
 
 def generate_random_string(length: int = 12) -> str:
     alphabet = string.ascii_letters + string.digits
@@ -14,21 +20,66 @@ def generate_random_string(length: int = 12) -> str:
 SECRET_KEY = os.environ.get("AUTH_SECRET_KEY", generate_random_string(32))
 ALGORITHM = os.environ.get("AUTH_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("AUTH_TOKEN_EXPIRE", 1440))
+TOKEN_MODE = os.environ.get("AUTH_TOKEN_MODE", "strict").lower()
+REVOCATION_REFRESH_SECONDS = float(os.environ.get("AUTH_REVOCATION_REFRESH", 30))
+
+USER_CACHE_TTL = float(os.environ.get("AUTH_USER_CACHE_TTL", 60))
+USER_CACHE_SIZE = int(os.environ.get("AUTH_USER_CACHE_SIZE", 10000))
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, name="user_cache")
+register_source("user_cache", user_cache.stats)
+
+def get_cached_user(username: str) -> Optional[dict]:
+    user = user_cache.get(username)
+    if user is None:
+        user = users_db.find_one({"username": username})
+        if user:
+            user_cache.set(username, user)
+    return dict(user) if user else None
 
-users_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).nexa.users
-prospective_users_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).nexa.prospective_users
-orgs_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).nexa.organizations
+def invalidate_user(username: str) -> None:
+    # Only this worker's entry: other workers keep their copy for up to USER_CACHE_TTL seconds.
+    user_cache.invalidate(username)
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+revocation_list = RevocationList(
+    revocations_db,
+    retention_seconds=max(ACCESS_TOKEN_EXPIRE_MINUTES, 15) * 60,
+    refresh_interval=REVOCATION_REFRESH_SECONDS,
+)
+register_source("token_revocations", revocation_list.stats)
+
+def revoke_user_tokens(user: dict) -> None:
+    invalidate_user(user["username"])
+    revocation_list.revoke(str(user["_id"]))
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, user: Optional[dict] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": time.time()})
+    if user:
+        organization = user.get("organization")
+        to_encode.update({
+            "_id": str(user["_id"]),
+            "organization": str(organization) if organization else None,
+            "permission": user.get("permission"),
+        })
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def _user_from_claims(payload: dict) -> dict:
+    organization = payload.get("organization")
+    if organization and ObjectId.is_valid(organization):
+        organization = ObjectId(organization)
+    return {
+        "_id": ObjectId(payload["_id"]),
+        "username": payload["sub"],
+        "organization": organization,
+        "permission": payload.get("permission"),
+    }
+
 def verify_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -36,7 +87,12 @@ def verify_token(token: str):
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
-        user = users_db.find_one({"username": username})
+        if TOKEN_MODE == "stateless" and "_id" in payload and "iat" in payload:
+            if revocation_list.is_revoked(payload["_id"], payload["iat"]):
+                raise HTTPException(status_code=401, detail="Token has been revoked")
+            return _user_from_claims(payload)
+
+        user = get_cached_user(username)
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
 
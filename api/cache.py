@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import threading
+import time
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiry and hit/miss counters.
+
+    With a weigher (e.g. approximate size in bytes), least recently used entries
+    are also evicted while the total weight exceeds maxweight.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        name: str = "cache",
+        maxweight: Optional[float] = None,
+        weigher: Optional[Callable[[Any], float]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.maxweight = maxweight
+        self.weigher = weigher
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._weights: dict = {}
+        self._lock = threading.Lock()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _pop(self, key: Hashable) -> Any:
+        item = self._data.pop(key, _MISSING)
+        if self.weigher is not None and item is not _MISSING:
+            self.weight -= self._weights.pop(key)
+        return item
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= now:
+                self._pop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        weight = self.weigher(value) if self.weigher is not None else 0
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (expires_at, value)
+            if self.weigher is not None:
+                self._weights[key] = weight
+                self.weight += weight
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self._data) > self.maxsize or (
+            self.maxweight is not None and self.weight > self.maxweight and len(self._data) > 1
+        ):
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """The value of a live entry without counting a lookup or refreshing its recency."""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] <= time.monotonic():
+                return default
+            return item[1]
+
+    def reweigh(self, key: Hashable) -> None:
+        """Recomputes the weight of an entry whose value grew in place, evicting as set() does."""
+        if self.weigher is None:
+            return
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return
+            weight = self.weigher(item[1])
+            self.weight += weight - self._weights[key]
+            self._weights[key] = weight
+            self._evict()
+
+    def invalidate(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._pop(key) is not _MISSING
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+        if self.weigher is not None:
+            stats.update(weight=self.weight, maxweight=self.maxweight)
+        return stats
@@ -0,0 +1,186 @@
+from pymongo import MongoClient, ReadPreference
+from pymongo import monitoring
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+import asyncio
+import os
+import threading
+
+from api.metrics import register_source
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primary")
+
+# Only options that are explicitly set are passed to the client, so anything
+# given in MONGO_URI itself still applies.
+_CLIENT_OPTIONS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+}
+
+def client_options() -> dict:
+    return {
+        option: int(os.environ[env_name])
+        for option, env_name in _CLIENT_OPTIONS.items()
+        if os.environ.get(env_name)
+    }
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primarypreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondarypreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so pool sizing can be checked at runtime."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkout_failed = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.pools_cleared = 0
+
+    def _bump(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump(pools_cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump(created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump(closed=1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump(checkout_failed=1)
+
+    def connection_checked_out(self, event):
+        self._bump(checked_out=1, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._bump(in_use=-1)
+
+    def stats(self) -> dict:
+        return {
+            "max_pool_size": client.options.pool_options.max_pool_size,
+            "min_pool_size": client.options.pool_options.min_pool_size,
+            "read_preference": MONGO_READ_PREFERENCE,
+            "open_connections": self.created - self.closed,
+            "connections_created": self.created,
+            "connections_closed": self.closed,
+            "checkouts": self.checked_out,
+            "checkout_failures": self.checkout_failed,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "pools_cleared": self.pools_cleared,
+        }
+
+pool_stats = PoolStats()
+register_source("mongo_pool", pool_stats.stats)
+
+client = MongoClient(MONGO_URI, event_listeners=[pool_stats], **client_options())
+
+database = client.get_database(
+    "nexa",
+    read_preference=_READ_PREFERENCES.get(MONGO_READ_PREFERENCE.lower(), ReadPreference.PRIMARY),
+)
+
+users_db = database.users
+prospective_users_db = database.prospective_users
+orgs_db = database.organizations
+revocations_db = database.revocations
+sessions_db = database.sessions
+agents_db = database.agents
+connectors_db = database.connectors
+knowledge_db = database.users
+
+# --- Async Access ---
+# pymongo is blocking, so async handlers go through these wrappers which run
+# each operation on a dedicated thread pool (the same model Motor uses) and
+# keep the event loop free while the query is in flight.
+MONGO_ASYNC_WORKERS = int(os.environ.get("MONGO_ASYNC_WORKERS", 32))
+
+_executor = ThreadPoolExecutor(max_workers=MONGO_ASYNC_WORKERS, thread_name_prefix="mongo")
+
+async def run_async(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+class AsyncCursor:
+    def __init__(self, collection, args, kwargs):
+        self._collection = collection
+        self._args = args
+        self._kwargs = kwargs
+
+    async def to_list(self, length: Optional[int] = None) -> list:
+        def fetch():
+            cursor = self._collection.find(*self._args, **self._kwargs)
+            if length is not None:
+                cursor = cursor.limit(length)
+            return list(cursor)
+        return await run_async(fetch)
+
+class AsyncCollection:
+    def __init__(self, collection):
+        self.delegate = collection
+
+    @property
+    def name(self) -> str:
+        return self.delegate.name
+
+    def find(self, *args, **kwargs) -> AsyncCursor:
+        return AsyncCursor(self.delegate, args, kwargs)
+
+    async def find_one(self, *args, **kwargs):
+        return await run_async(self.delegate.find_one, *args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs) -> int:
+        return await run_async(self.delegate.count_documents, *args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs):
+        return await run_async(self.delegate.insert_one, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await run_async(self.delegate.update_one, *args, **kwargs)
+
+    async def update_many(self, *args, **kwargs):
+        return await run_async(self.delegate.update_many, *args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return await run_async(self.delegate.delete_one, *args, **kwargs)
+
+async_users_db = AsyncCollection(users_db)
+async_sessions_db = AsyncCollection(sessions_db)
+async_agents_db = AsyncCollection(agents_db)
+async_connectors_db = AsyncCollection(connectors_db)
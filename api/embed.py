@@ -1,24 +1,74 @@
 from langchain.embeddings import OpenAIEmbeddings
 from langchain_text_splitters import CharacterTextSplitter
 
-from bson import ObjectId
-from pymongo import MongoClient
+from bson import Binary, ObjectId
 
 from datetime import datetime
+import logging
 import os
+import tempfile
 import numpy as np
 
-knowledge_db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/")).nexa.users
+from api.ann_index import DeltaIndex, current_version, discard_index, load_index, log_changes, new_index, save_index
+from api.cache import TTLCache
+from api.db import knowledge_db
+from api.metrics import register_source, timer
+from api.vector_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_INDEX_CACHE_SIZE = int(os.environ.get("KNOWLEDGE_INDEX_CACHE_SIZE", 100))
+KNOWLEDGE_INDEX_TTL = float(os.environ.get("KNOWLEDGE_INDEX_TTL", 3600))
+# "ivf" (approximate once an agent has enough chunks, see api/ann_index.py) or "flat" (always exact)
+KNOWLEDGE_INDEX_TYPE = os.environ.get("KNOWLEDGE_INDEX_TYPE", "ivf")
+# Saved indexes, one directory per agent, on a persistent volume shared by the workers;
+# empty to keep indexes in memory only
+KNOWLEDGE_INDEX_DIR = os.environ.get("KNOWLEDGE_INDEX_DIR")
+if KNOWLEDGE_INDEX_DIR is None:
+    KNOWLEDGE_INDEX_DIR = os.path.join(tempfile.gettempdir(), "nexa-knowledge-index")
+    logger.warning(
+        f"KNOWLEDGE_INDEX_DIR is not set; saving knowledge indexes under {KNOWLEDGE_INDEX_DIR}, which is "
+        "not shared between containers, may be held in memory (tmpfs) and is lost on reboot."
+    )
+# Search saved indexes through a read-only memory map, so every worker shares one copy of the vectors
+KNOWLEDGE_INDEX_MMAP = os.environ.get("KNOWLEDGE_INDEX_MMAP", "true").lower() == "true"
+# Inserts and deletes are appended to the saved index's change log until they add up to this
+# share of the index; then the whole index is saved again as a new version
+KNOWLEDGE_INDEX_COMPACT_RATIO = float(os.environ.get("KNOWLEDGE_INDEX_COMPACT_RATIO", 0.25))
 
 embedding = OpenAIEmbeddings()
 
+# Vectors are stored as packed little-endian float32, a quarter of BSON's array of doubles.
+VECTOR_DTYPE = np.dtype("<f4")
+
+def split_chunks(plot: str, chunk_size: int = 1000, overlap: int = 200) -> list:
+    """[{"text", "start", "end"}] character spans of the chunks embed() embeds."""
+    text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap, add_start_index=True)
+    return [
+        {"text": document.page_content, "start": document.metadata["start_index"],
+         "end": document.metadata["start_index"] + len(document.page_content)}
+        for document in text_splitter.create_documents([plot])
+    ]
+
+def embed_chunks(plot: str, chunk_size: int = 1000, overlap: int = 200) -> list:
+    """split_chunks with each chunk's embedding under "vector"."""
+    chunks = split_chunks(plot, chunk_size, overlap)
+    embeddings = embedding.embed_documents([chunk["text"] for chunk in chunks])
+    for chunk, vector in zip(chunks, embeddings):
+        chunk["vector"] = vector
+    return chunks
+
 def embed(plot: str, chunk_size: int = 1000, overlap: int = 200) -> list:
-    text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
-    chunks = text_splitter.split_text(plot)
+    return [chunk["vector"] for chunk in embed_chunks(plot, chunk_size, overlap)]
+
+def normalize(vectors) -> np.ndarray:
+    return normalize_rows(vectors)
 
-    embeddings = embedding.embed_documents(chunks)
-    
-    return embeddings
+async def aembed_texts(texts: list) -> np.ndarray:
+    return normalize(await embedding.aembed_documents(texts))
+
+async def aembed_query(text: str) -> np.ndarray:
+    return normalize(await embedding.aembed_query(text))
 
 def similarity(vec1, vec2):
     vec1 = np.array(vec1)
@@ -34,22 +84,260 @@ def similarity(vec1, vec2):
     similarity = dot_product / (norm1 * norm2)
     return similarity
 
-def save_embedding(embeddings: list, user_id: ObjectId, agent_id: ObjectId) -> None:
-    knowledge_db.embeddings.insert_one({
-        "user_id": user_id,
-        "agent_id": agent_id,
-        "embeddings": embeddings,
-        "created_at": datetime.utcnow()
-    })
+def pack_vector(vector) -> Binary:
+    return Binary(np.asarray(vector, dtype=VECTOR_DTYPE).tobytes())
+
+def unpack_vector(data: bytes) -> np.ndarray:
+    # A read-only view over the BSON bytes; nothing is copied.
+    return np.frombuffer(data, dtype=VECTOR_DTYPE)
+
+def chunk_documents(embeddings: list, user_id: ObjectId, agent_id: ObjectId, chunks: list | None = None, source_id: ObjectId | None = None) -> list:
+    """One knowledge document per chunk; chunks optionally carries each chunk's "text", "start" and "end"."""
+    source_id = source_id or ObjectId()
+    created_at = datetime.utcnow()
+    documents = []
+    for position, vector in enumerate(embeddings):
+        chunk = chunks[position] if chunks else {}
+        documents.append({
+            "user_id": user_id,
+            "agent_id": agent_id,
+            "source_id": source_id,
+            "chunk": position,
+            "text": chunk.get("text"),
+            "start": chunk.get("start"),
+            "end": chunk.get("end"),
+            "dim": len(vector),
+            "vector": pack_vector(vector),
+            "created_at": created_at,
+        })
+    return documents
+
+def save_embedding(embeddings: list, user_id: ObjectId, agent_id: ObjectId, chunks: list | None = None) -> ObjectId | None:
+    """Stores the chunk vectors of one source text and returns the source id grouping them; None when there are none."""
+    documents = chunk_documents(embeddings, user_id, agent_id, chunks)
+    if not documents:
+        return None
+    knowledge_db.embeddings.insert_many(documents, ordered=False)
+    index = cached_knowledge_index(user_id, agent_id)
+    if index is not None:
+        ids, vectors = [document["_id"] for document in documents], np.asarray(embeddings, dtype=np.float32)
+        index.add(ids, vectors)
+        newest = max(filter(None, ((index.meta.get("watermark") or {}).get("created_at"), _stamp(documents[0]["created_at"]))))
+        watermark = {"count": len(index), "created_at": newest}
+        _cache_updated_index(user_id, agent_id, record_knowledge_changes(user_id, agent_id, index, watermark, ids, vectors))
+    return documents[0]["source_id"]
+
+def save_chunks(chunks: list, user_id: ObjectId, agent_id: ObjectId) -> ObjectId | None:
+    """Stores the output of embed_chunks."""
+    return save_embedding([chunk["vector"] for chunk in chunks], user_id, agent_id, chunks)
+
+def _iter_vectors(documents):
+    # Yields (id, vector) from chunk documents; documents not yet migrated hold a
+    # list of vectors and yield (document id, position) ids.
+    for document in documents:
+        if "vector" in document:
+            yield document["_id"], unpack_vector(document["vector"])
+        else:
+            for position, vector in enumerate(document.get("embeddings") or []):
+                yield (document["_id"], position), np.asarray(vector, dtype=np.float32)
+
+_VECTOR_FIELDS = {"vector": 1, "embeddings": 1}
+
+def delete_knowledge_source(user_id: ObjectId, agent_id: ObjectId, source_id: ObjectId) -> int:
+    """
+    Deletes the chunks of one source text and drops them from the agent's index:
+    the cached one when this worker has it, otherwise the saved one is discarded
+    rather than loaded only to be edited.
+    """
+    index = cached_knowledge_index(user_id, agent_id)
+    query = {"user_id": user_id, "agent_id": agent_id, "source_id": source_id}
+    ids = [document["_id"] for document in knowledge_db.embeddings.find(query, {"_id": 1})]
+    if not ids:
+        return 0
+    deleted = knowledge_db.embeddings.delete_many({**query, "_id": {"$in": ids}}).deleted_count
+    if index is not None:
+        index.remove(ids)
+        watermark = {**(index.meta.get("watermark") or {}), "count": len(index)}
+        _cache_updated_index(user_id, agent_id, record_knowledge_changes(user_id, agent_id, index, watermark, removed_ids=ids))
+    elif KNOWLEDGE_INDEX_DIR:
+        discard_index(knowledge_index_dir(user_id, agent_id))
+    return deleted
 
 def get_embeddings(user_id: ObjectId, agent_id: ObjectId) -> list:
-    result = knowledge_db.embeddings.find_one({
-        "user_id": user_id,
-        "agent_id": agent_id
-    })
+    """The chunk vectors of the agent's first stored source text, as lists of floats."""
+    result = knowledge_db.embeddings.find_one({"user_id": user_id, "agent_id": agent_id})
+    if not result:
+        return []
+    if "vector" not in result:
+        return result.get("embeddings") or []
+    chunks = knowledge_db.embeddings.find({"source_id": result["source_id"]}, {"vector": 1}).sort("chunk", 1)
+    return [unpack_vector(document["vector"]).tolist() for document in chunks]
+
+def get_embedding_matrix(user_id: ObjectId, agent_id: ObjectId) -> np.ndarray:
+    """Every chunk vector of an agent as one (chunks, dim) float32 matrix."""
+    vectors = [vector for _, vector in _iter_vectors(
+        knowledge_db.embeddings.find({"user_id": user_id, "agent_id": agent_id}, _VECTOR_FIELDS)
+    )]
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack(vectors)
+
+def get_chunks(ids: list) -> dict:
+    """Chunk id -> {"text", "start", "end", "source_id", "chunk"} for search results."""
+    documents = knowledge_db.embeddings.find(
+        {"_id": {"$in": [item_id for item_id in ids if isinstance(item_id, ObjectId)]}},
+        {"text": 1, "start": 1, "end": 1, "source_id": 1, "chunk": 1},
+    )
+    return {document.pop("_id"): document for document in documents}
+
+# (user id, agent id) -> VectorIndex over every stored chunk vector of that agent
+knowledge_indexes = TTLCache(maxsize=KNOWLEDGE_INDEX_CACHE_SIZE, ttl=KNOWLEDGE_INDEX_TTL, name="knowledge_indexes")
+register_source("knowledge_indexes", knowledge_indexes.stats)
+
+def invalidate_knowledge_index(user_id: ObjectId, agent_id: ObjectId) -> None:
+    knowledge_indexes.invalidate((str(user_id), str(agent_id)))
+
+def _cache_updated_index(user_id: ObjectId, agent_id: ObjectId, index) -> None:
+    if index is None:
+        invalidate_knowledge_index(user_id, agent_id)
+    else:
+        knowledge_indexes.set((str(user_id), str(agent_id)), index)
+
+def knowledge_index_dir(user_id: ObjectId, agent_id: ObjectId) -> str:
+    return os.path.join(KNOWLEDGE_INDEX_DIR, str(user_id), str(agent_id))
+
+def _stamp(created_at):
+    # Mongo keeps datetimes to the millisecond.
+    return created_at.isoformat(timespec="milliseconds") if created_at else None
+
+def _watermark(query: dict) -> dict:
+    """Chunk count and newest created_at of an agent, which any insert or delete changes."""
+    newest = next(iter(knowledge_db.embeddings.find(query, {"created_at": 1}).sort("created_at", -1).limit(1)), {})
+    return {"count": knowledge_db.embeddings.count_documents(query), "created_at": _stamp(newest.get("created_at"))}
+
+def persist_knowledge_index(user_id: ObjectId, agent_id: ObjectId, index, watermark: dict):
+    """
+    Saves index as the agent's current version and returns the index to use from
+    now on: with KNOWLEDGE_INDEX_MMAP, the saved version mapped read-only rather
+    than this process's private copy. watermark is the _watermark of the chunks
+    the index holds; read it before the chunks so it never claims more than that.
+    """
+    # Indexes still holding unmigrated chunks are keyed by (document id, position) and are not saved.
+    if not KNOWLEDGE_INDEX_DIR or not all(isinstance(item_id, ObjectId) for item_id in index.ids):
+        return index
+    directory = knowledge_index_dir(user_id, agent_id)
+    if isinstance(index, DeltaIndex):
+        index = index.materialize()
+    try:
+        save_index(index, directory, {"watermark": watermark})
+        if KNOWLEDGE_INDEX_MMAP:
+            return load_index(directory, mmap=True) or index
+    except OSError as e:
+        logger.warning(f"Could not save the knowledge index of agent {agent_id}: {e}")
+    return index
+
+def record_knowledge_changes(user_id: ObjectId, agent_id: ObjectId, index, watermark: dict,
+                             added_ids: list = (), added_vectors=None, removed_ids: list = ()):
+    """
+    Persists changes already made to a saved index and returns the index to use
+    from now on. They are appended to the saved version's change log, so a write
+    costs the changed rows rather than the whole matrix, until the logged changes
+    reach KNOWLEDGE_INDEX_COMPACT_RATIO of the index and it is saved again in full.
+    None when another worker saved a newer version in the meantime.
+    """
+    logged = index.changes + len(added_ids) + len(removed_ids)
+    if not KNOWLEDGE_INDEX_DIR or index.version is None or logged > KNOWLEDGE_INDEX_COMPACT_RATIO * max(len(index), 1):
+        return persist_knowledge_index(user_id, agent_id, index, watermark)
+    try:
+        if log_changes(index, knowledge_index_dir(user_id, agent_id), added_ids, added_vectors, removed_ids,
+                       {"watermark": watermark}):
+            return index
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not log changes to the knowledge index of agent {agent_id}: {e}")
+    return None
+
+def _reconcile(index, query: dict) -> tuple:
+    # Brings index to the chunk ids Mongo holds now, whatever order they were inserted
+    # or deleted in; returns the (added ids, their vectors, removed ids).
+    stored = [document["_id"] for document in knowledge_db.embeddings.find(query, {"_id": 1})]
+    present = set(stored)
+    gone = [item_id for item_id in index.ids if item_id not in present]
+    missing = [item_id for item_id in stored if item_id not in index]
+    if gone:
+        index.remove(gone)
+    ids, vectors = [], []
+    if missing:
+        for item_id, vector in _iter_vectors(knowledge_db.embeddings.find({**query, "_id": {"$in": missing}}, _VECTOR_FIELDS)):
+            ids.append(item_id)
+            vectors.append(vector)
+        if ids:
+            index.add(ids, np.stack(vectors))
+    return ids, np.stack(vectors) if vectors else None, gone
+
+def _load_saved_index(user_id: ObjectId, agent_id: ObjectId, query: dict):
+    # The saved index, brought up to date with Mongo when the agent's chunks have
+    # changed since it was written; None when there is none.
+    if not KNOWLEDGE_INDEX_DIR:
+        return None
+    index = load_index(knowledge_index_dir(user_id, agent_id), mmap=KNOWLEDGE_INDEX_MMAP)
+    if index is None or index.meta.get("type") != KNOWLEDGE_INDEX_TYPE:
+        return None
+    watermark = _watermark(query)
+    if watermark == index.meta.get("watermark") and watermark["count"] == len(index):
+        return index
+    added_ids, added_vectors, removed_ids = _reconcile(index, query)
+    return record_knowledge_changes(user_id, agent_id, index, watermark, added_ids, added_vectors, removed_ids)
+
+def load_knowledge_index(user_id: ObjectId, agent_id: ObjectId):
+    """Index of an agent's chunk vectors keyed by chunk id; None when it has none."""
+    query = {"user_id": user_id, "agent_id": agent_id}
+    with timer("knowledge.index_load_ms"):
+        try:
+            index = _load_saved_index(user_id, agent_id, query)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load the saved knowledge index of agent {agent_id}: {e}")
+            index = None
+        if index is not None:
+            return index if len(index) else None
+        watermark = _watermark(query)
+        ids, vectors = [], []
+        for item_id, vector in _iter_vectors(knowledge_db.embeddings.find(query, _VECTOR_FIELDS)):
+            ids.append(item_id)
+            vectors.append(vector)
+        if not vectors:
+            return None
+        index = new_index(KNOWLEDGE_INDEX_TYPE, len(vectors[0]), capacity=len(vectors))
+        index.add(ids, np.stack(vectors))
+    return persist_knowledge_index(user_id, agent_id, index, watermark)
+
+def cached_knowledge_index(user_id: ObjectId, agent_id: ObjectId):
+    """The cached index of an agent unless another worker has saved a newer version since."""
+    key = (str(user_id), str(agent_id))
+    index = knowledge_indexes.get(key)
+    if index is None or index.version is None or not KNOWLEDGE_INDEX_DIR:
+        return index
+    version = current_version(knowledge_index_dir(user_id, agent_id))
+    # A newer version, or none at all when a delete discarded the saved index.
+    if version is None or os.path.basename(version) != index.version:
+        knowledge_indexes.invalidate(key)
+        return None
+    return index
+
+def get_knowledge_index(user_id: ObjectId, agent_id: ObjectId):
+    index = cached_knowledge_index(user_id, agent_id)
+    if index is None:
+        index = load_knowledge_index(user_id, agent_id)
+        if index is not None:
+            knowledge_indexes.set((str(user_id), str(agent_id)), index)
+    return index
 
-    if result:
-        return result["embeddings"]
-    
-    return []
+def search_embeddings(user_id: ObjectId, agent_id: ObjectId, query, k: int = 5) -> list:
+    """[(chunk id, similarity)] of the k chunks closest to a query vector; see get_chunks for their text."""
+    return search_embeddings_batch(user_id, agent_id, [query], k)[0]
 
+def search_embeddings_batch(user_id: ObjectId, agent_id: ObjectId, queries, k: int = 5) -> list:
+    index = get_knowledge_index(user_id, agent_id)
+    if index is None:
+        return [[] for _ in queries]
+    with timer("knowledge.search_ms"):
+        return index.search_batch(queries, k)
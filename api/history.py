@@ -0,0 +1,142 @@
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+from typing import Optional
+import hashlib
+import logging
+import os
+
+from api.cache import TTLCache
+from api.db import sessions_db
+from api.llm import get_chat_model
+from api.metrics import register_source, observe
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 6000))
+HISTORY_KEEP_TURNS = int(os.environ.get("HISTORY_KEEP_TURNS", 6))
+HISTORY_SUMMARY_BATCH = int(os.environ.get("HISTORY_SUMMARY_BATCH", 4))
+HISTORY_SUMMARY_MODEL = os.environ.get("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+
+_token_counts = TTLCache(maxsize=50000, ttl=3600, name="history_token_counts")
+register_source("history_token_counts", _token_counts.stats)
+
+_encoding = None
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, estimating token counts from length: {e}")
+            _encoding = False
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if not encoding:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def entry_tokens(entry: dict) -> int:
+    """Token count of one history turn, read from the entry when it was stored with one."""
+    if "tokens" in entry:
+        return entry["tokens"]
+    key = hashlib.blake2b(f"{entry.get('user', '')}\x00{entry.get('assistant', '')}".encode("utf-8"), digest_size=16).digest()
+    tokens = _token_counts.get(key)
+    if tokens is None:
+        tokens = count_tokens(entry.get("user", "")) + count_tokens(entry.get("assistant", ""))
+        _token_counts.set(key, tokens)
+    return tokens
+
+def build_history_messages(
+    chat_history: list,
+    summary: Optional[dict] = None,
+    token_budget: Optional[int] = None,
+) -> list:
+    """
+    Turns stored chat history into prompt messages within a token budget.
+
+    Turns the session's rolling summary does not cover yet are replayed verbatim,
+    newest first, until the budget is reached; only the budget caps them, since
+    the summary may lag behind by more than HISTORY_KEEP_TURNS until the
+    background summarization catches up. Older turns are represented by the
+    summary when it still matches this history.
+    """
+    token_budget = HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+
+    covered = 0
+    summary_text = None
+    if summary and 0 < summary.get("turns", 0) <= len(chat_history):
+        covered = summary["turns"]
+        summary_text = summary.get("text")
+
+    used = count_tokens(summary_text) if summary_text else 0
+    recent = []
+    for entry in reversed(chat_history[covered:]):
+        tokens = entry_tokens(entry)
+        if recent and used + tokens > token_budget:
+            break
+        used += tokens
+        recent.append(entry)
+    recent.reverse()
+    observe("history.prompt_tokens", used)
+
+    messages = []
+    if summary_text:
+        messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary_text}"))
+    for entry in recent:
+        messages.append(HumanMessage(content=entry["user"]))
+        messages.append(AIMessage(content=entry["assistant"]))
+    return messages
+
+def summarize_session_history(session_id: str, keep_turns: Optional[int] = None) -> None:
+    """Folds turns that no longer fit the verbatim window into the session's rolling summary."""
+    keep_turns = HISTORY_KEEP_TURNS if keep_turns is None else keep_turns
+    session = sessions_db.find_one({"session_id": session_id}, {"chat_history": 1, "history_summary": 1})
+    if not session:
+        return
+
+    chat_history = session.get("chat_history", [])
+    summary = session.get("history_summary") or {}
+    expected_turns = summary.get("turns")
+    covered = summary.get("turns", 0)
+    if covered > len(chat_history):
+        covered, summary = 0, {}
+
+    fold_until = len(chat_history) - keep_turns
+    if fold_until - covered < HISTORY_SUMMARY_BATCH:
+        return
+
+    transcript = "\n\n".join(
+        f"User: {entry['user']}\nAssistant: {entry['assistant']}"
+        for entry in chat_history[covered:fold_until]
+    )
+    prompt = [
+        SystemMessage(
+            content=(
+                "You maintain a running summary of a conversation between a user and an assistant. "
+                "Merge the previous summary with the new turns into one concise summary that keeps "
+                "facts, decisions, names, numbers and open questions needed to continue the conversation."
+            )
+        ),
+        HumanMessage(content=f"Previous summary:\n{summary.get('text') or '(none)'}\n\nNew turns:\n{transcript}"),
+    ]
+    try:
+        result = get_chat_model(HISTORY_SUMMARY_MODEL, temperature=0).invoke(prompt)
+    except Exception as e:
+        logger.warning(f"Failed to summarize history of session {session_id}: {e}")
+        return
+
+    sessions_db.update_one(
+        {"session_id": session_id, "history_summary.turns": expected_turns},
+        {"$set": {"history_summary": {"text": result.content, "turns": fold_until}}},
+    )
+
+def invalidate_summary_from(session_id: str, message_num: int) -> None:
+    sessions_db.update_one(
+        {"session_id": session_id, "history_summary.turns": {"$gt": message_num}},
+        {"$unset": {"history_summary": ""}},
+    )
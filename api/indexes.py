@@ -0,0 +1,129 @@
+"""
+Declarative index registry and query-plan diagnostics.
+
+    python -m api.indexes ensure    # create every registered index
+    python -m api.indexes explain   # explain each hot query shape, flag collection scans
+"""
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+from bson import ObjectId
+import logging
+import sys
+
+from api.db import database
+
+logger = logging.getLogger(__name__)
+
+# collection name -> list of (keys, options)
+INDEXES = {
+    "users": [
+        ([("username", ASCENDING)], {"unique": True}),
+        ([("invite_code", ASCENDING)], {"unique": True, "partialFilterExpression": {"invite_code": {"$type": "string"}}}),
+        ([("reset_token", ASCENDING)], {"partialFilterExpression": {"reset_token": {"$type": "string"}}}),
+        ([("organization", ASCENDING), ("permission", ASCENDING)], {}),
+        ([("permission", ASCENDING)], {}),
+    ],
+    "prospective_users": [
+        ([("username", ASCENDING)], {"unique": True}),
+    ],
+    "organizations": [
+        ([("name", ASCENDING)], {"unique": True}),
+        ([("owner", ASCENDING)], {}),
+    ],
+    "sessions": [
+        ([("session_id", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("session_id", ASCENDING)], {}),
+    ],
+    "agents": [
+        ([("org", ASCENDING)], {}),
+    ],
+    "connectors": [
+        ([("org", ASCENDING), ("name", ASCENDING)], {"unique": True}),
+    ],
+    "revocations": [
+        ([("user_id", ASCENDING), ("revoked_at", DESCENDING)], {}),
+        ([("revoked_at", ASCENDING)], {}),
+    ],
+    "users.embeddings": [
+        ([("user_id", ASCENDING), ("agent_id", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("user_id", ASCENDING), ("agent_id", ASCENDING), ("created_at", ASCENDING)], {}),
+        ([("source_id", ASCENDING), ("chunk", ASCENDING)], {"unique": True, "partialFilterExpression": {"source_id": {"$exists": True}}}),
+    ],
+}
+
+# (collection name, sample filter) for every query the API issues on a hot path
+QUERY_SHAPES = [
+    ("users", {"username": "u"}),
+    ("users", {"invite_code": "c"}),
+    ("users", {"username": "u", "reset_token": "t"}),
+    ("users", {"organization": ObjectId()}),
+    ("users", {"organization": ObjectId(), "permission": "orgadmin"}),
+    ("users", {"permission": "sysadmin"}),
+    ("prospective_users", {"username": "u"}),
+    ("organizations", {"name": "o"}),
+    ("organizations", {"owner": ObjectId()}),
+    ("sessions", {"session_id": "s"}),
+    ("sessions", {"session_id": "s", "user_id": "u"}),
+    ("sessions", {"user_id": "u"}),
+    ("agents", {"org": ObjectId()}),
+    ("agents", {"_id": ObjectId(), "org": ObjectId()}),
+    ("connectors", {"org": ObjectId()}),
+    ("connectors", {"org": ObjectId(), "name": "c"}),
+    ("connectors", {"_id": {"$in": [ObjectId()]}}),
+    ("revocations", {"user_id": "u", "revoked_at": {"$gte": 0}}),
+    ("revocations", {"revoked_at": {"$gte": 0}}),
+    ("users.embeddings", {"user_id": ObjectId(), "agent_id": ObjectId()}),
+    ("users.embeddings", {"user_id": ObjectId(), "agent_id": ObjectId(), "_id": {"$in": [ObjectId()]}}),
+    ("users.embeddings", {"user_id": ObjectId(), "agent_id": ObjectId(), "source_id": ObjectId()}),
+]
+
+def ensure_indexes() -> list:
+    created = []
+    for collection_name, specs in INDEXES.items():
+        collection = database[collection_name]
+        for keys, options in specs:
+            try:
+                created.append(f"{collection_name}.{collection.create_index(keys, **options)}")
+            except PyMongoError as e:
+                logger.warning(f"Could not create index {keys} on '{collection_name}': {e}")
+    return created
+
+def _plan_stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+def explain_query_shapes() -> list:
+    report = []
+    for collection_name, query in QUERY_SHAPES:
+        explanation = database[collection_name].find(query).explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        stages = [stage for stage in _plan_stages(winning_plan) if stage]
+        report.append({
+            "collection": collection_name,
+            "filter": sorted(query.keys()),
+            "stages": stages,
+            "collection_scan": "COLLSCAN" in stages,
+        })
+    return report
+
+def main(argv: list) -> int:
+    command = argv[1] if len(argv) > 1 else "explain"
+    if command == "ensure":
+        for name in ensure_indexes():
+            print(f"ensured {name}")
+        return 0
+    if command == "explain":
+        report = explain_query_shapes()
+        for entry in report:
+            flag = "COLLSCAN" if entry["collection_scan"] else "ok"
+            print(f"[{flag:>8}] {entry['collection']} {entry['filter']} -> {' <- '.join(entry['stages'])}")
+        return 1 if any(entry["collection_scan"] for entry in report) else 0
+    print(__doc__)
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,214 @@
+from langchain_community.chat_models import ChatOpenAI
+from typing import Optional
+import asyncio
+import logging
+import os
+import threading
+
+import httpx
+import openai
+
+from api.metrics import register_source
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 120))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 600))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 5))
+LLM_WARMUP_CONNECTIONS = int(os.environ.get("LLM_WARMUP_CONNECTIONS", 2))
+
+class PoolUsage:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def started(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finished(self, failed: bool = False) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.errors += int(failed)
+
+class _TrackedAsyncStream(httpx.AsyncByteStream):
+    def __init__(self, stream, usage: PoolUsage):
+        self._stream = stream
+        self._usage = usage
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._usage.finished()
+        await self._stream.aclose()
+
+class _TrackedSyncStream(httpx.SyncByteStream):
+    def __init__(self, stream, usage: PoolUsage):
+        self._stream = stream
+        self._usage = usage
+        self._closed = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._usage.finished()
+        self._stream.close()
+
+class TrackedAsyncTransport(httpx.AsyncHTTPTransport):
+    """Counts requests whose response body is still open, i.e. connections in use."""
+
+    def __init__(self, usage: PoolUsage, **kwargs):
+        super().__init__(**kwargs)
+        self.usage = usage
+
+    async def handle_async_request(self, request):
+        self.usage.started()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            self.usage.finished(failed=True)
+            raise
+        response.stream = _TrackedAsyncStream(response.stream, self.usage)
+        return response
+
+class TrackedSyncTransport(httpx.HTTPTransport):
+    def __init__(self, usage: PoolUsage, **kwargs):
+        super().__init__(**kwargs)
+        self.usage = usage
+
+    def handle_request(self, request):
+        self.usage.started()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            self.usage.finished(failed=True)
+            raise
+        response.stream = _TrackedSyncStream(response.stream, self.usage)
+        return response
+
+_limits = httpx.Limits(
+    max_connections=LLM_MAX_CONNECTIONS,
+    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+)
+_timeout = httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+async_usage = PoolUsage()
+sync_usage = PoolUsage()
+_async_transport = TrackedAsyncTransport(async_usage, limits=_limits, http2=False)
+_sync_transport = TrackedSyncTransport(sync_usage, limits=_limits, http2=False)
+
+async_http_client = httpx.AsyncClient(transport=_async_transport, timeout=_timeout)
+sync_http_client = httpx.Client(transport=_sync_transport, timeout=_timeout)
+
+_openai_clients: dict = {}
+_chat_models: dict = {}
+_lock = threading.RLock()
+
+def _pool_connections(transport) -> dict:
+    connections = getattr(getattr(transport, "_pool", None), "connections", None)
+    if connections is None:
+        return {}
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {"open_connections": len(connections), "idle_connections": idle}
+
+def _usage_stats(usage: PoolUsage) -> dict:
+    return {
+        "requests": usage.requests,
+        "errors": usage.errors,
+        "in_flight": usage.in_flight,
+        "max_in_flight": usage.max_in_flight,
+        "utilization": usage.in_flight / LLM_MAX_CONNECTIONS,
+    }
+
+def pool_stats() -> dict:
+    return {
+        "max_connections": LLM_MAX_CONNECTIONS,
+        "max_keepalive_connections": LLM_MAX_KEEPALIVE_CONNECTIONS,
+        "async": {**_usage_stats(async_usage), **_pool_connections(_async_transport)},
+        "sync": {**_usage_stats(sync_usage), **_pool_connections(_sync_transport)},
+        "chat_models": len(_chat_models),
+    }
+
+register_source("llm_pool", pool_stats)
+
+def get_openai_clients(max_retries: int = 2) -> tuple:
+    clients = _openai_clients.get(max_retries)
+    if clients is None:
+        with _lock:
+            clients = _openai_clients.get(max_retries)
+            if clients is None:
+                clients = (
+                    openai.OpenAI(http_client=sync_http_client, max_retries=max_retries),
+                    openai.AsyncOpenAI(http_client=async_http_client, max_retries=max_retries),
+                )
+                _openai_clients[max_retries] = clients
+    return clients
+
+def _build_chat_model(model: str, temperature: float, streaming: bool, max_retries: int, **kwargs) -> ChatOpenAI:
+    sync_client, async_client = get_openai_clients(max_retries)
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        streaming=streaming,
+        max_retries=max_retries,
+        client=sync_client.chat.completions,
+        async_client=async_client.chat.completions,
+        **kwargs
+    )
+
+def get_chat_model(model: str, temperature: float = 0.7, streaming: bool = False, max_retries: int = 2, **kwargs) -> ChatOpenAI:
+    """
+    Returns a ChatOpenAI sharing the process-wide pooled HTTP clients.
+
+    Models without extra keyword arguments are cached per configuration; models
+    carrying request-specific arguments (e.g. tools) are built fresh but still
+    reuse the same connections.
+    """
+    if kwargs:
+        return _build_chat_model(model, temperature, streaming, max_retries, **kwargs)
+
+    key = (model, temperature, streaming, max_retries)
+    chat_model = _chat_models.get(key)
+    if chat_model is None:
+        with _lock:
+            chat_model = _chat_models.get(key)
+            if chat_model is None:
+                chat_model = _build_chat_model(model, temperature, streaming, max_retries)
+                _chat_models[key] = chat_model
+    return chat_model
+
+async def warm_up(connections: Optional[int] = None) -> int:
+    """Opens pooled connections to the OpenAI API ahead of the first user request."""
+    connections = LLM_WARMUP_CONNECTIONS if connections is None else connections
+    if connections <= 0 or not os.environ.get("OPENAI_API_KEY"):
+        return 0
+
+    _, async_client = get_openai_clients()
+    results = await asyncio.gather(
+        *(async_client.models.list() for _ in range(connections)),
+        return_exceptions=True,
+    )
+    failures = [result for result in results if isinstance(result, Exception)]
+    for failure in failures[:1]:
+        logger.warning(f"LLM connection warm-up failed: {failure}")
+    return connections - len(failures)
+
+async def close() -> None:
+    await async_http_client.aclose()
+    sync_http_client.close()
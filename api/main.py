@@ -9,7 +9,7 @@ from typing import List, Optional
 from pydantic import BaseModel, Field
 from bson import ObjectId
 
-from api.auth import create_access_token, verify_token, prospective_users_db, users_db, orgs_db
+from api.auth import create_access_token, verify_token, invalidate_user, revoke_user_tokens, revocation_list, TOKEN_MODE, prospective_users_db, users_db, orgs_db
 from api.mail import send_email
 
 import datetime
@@ -105,6 +105,39 @@ def create_initial_sysadmin():
 
 create_initial_sysadmin()
 
+from api.indexes import ensure_indexes, explain_query_shapes
+
+@app.on_event("startup")
+def create_indexes():
+    if os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true":
+        ensure_indexes()
+
+@app.on_event("startup")
+def start_revocation_list():
+    # Loaded before the first request, so stateless tokens are never checked against an empty filter.
+    if TOKEN_MODE == "stateless":
+        revocation_list.start()
+
+@app.on_event("shutdown")
+def stop_revocation_list():
+    revocation_list.stop()
+
+from api import llm as llm_clients
+
+@app.on_event("startup")
+async def warm_up_llm_clients():
+    await llm_clients.warm_up()
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    await llm_clients.close()
+
+from api.tools import web as web_tools
+
+@app.on_event("shutdown")
+async def close_web_search_client():
+    await web_tools.close()
+
 SERVER_URL = os.getenv("SERVER_URL", "http://localhost")
 UI_PORT = os.getenv("UI_PORT", "3000")
 API_PORT = os.getenv("API_PORT", "8000")
@@ -199,7 +232,7 @@ def signin(form_data: OAuth2PasswordRequestForm = Depends()):
     if user.get("status") == "pending":
         raise HTTPException(status_code=403, detail="User is pending approval")
     
-    access_token = create_access_token(data={"sub": user["username"]})
+    access_token = create_access_token(data={"sub": user["username"]}, user=user)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -269,6 +302,7 @@ def reset_password(form_data: ResetPasswordModel):
             }
         }
     )
+    revoke_user_tokens(user)
     
     return {"message": "Password reset successfully"}
 
@@ -317,6 +351,7 @@ def approve_signup(username: str, token: str = Depends(oauth2_scheme)):
         raise HTTPException(status_code=500, detail="User creation failed")
     
     prospective_users_db.delete_one({"username": username})
+    invalidate_user(username)
 
     return {"message": "User approved and created successfully", "_id": str(user_id)}
 
@@ -500,6 +535,7 @@ def invite_signin(
 
     if result.modified_count == 0:
         raise HTTPException(status_code=500, detail="Failed to register invited user")
+    invalidate_user(username)
 
     orgadmin = users_db.find_one({
         "organization": user["organization"],
@@ -583,24 +619,36 @@ def delete_user(username: str, token: str = Depends(oauth2_scheme)):
     if not (user.get("permission") == "sysadmin" or user["username"] == username):
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    if user.get("permission") != "sysadmin" and user.get("organization") != users_db.find_one({"username": username}).get("organization"):
+    target_user = users_db.find_one({"username": username})
+    if user.get("permission") != "sysadmin" and user.get("organization") != (target_user or {}).get("organization"):
         raise HTTPException(status_code=403, detail="Permission denied")
     
     result = users_db.delete_one({"username": username})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    revoke_user_tokens(target_user)
 
     return {"message": f"User '{username}' deleted successfully"}
 
 # --- Agent Routes ---
 from api.agent import get_agent_components, sessions_db, agents_db, connectors_db
+from api.db import async_sessions_db, async_agents_db
+from api.history import count_tokens, invalidate_summary_from, summarize_session_history
+from api.metrics import observe, timer
 from langchain.schema import HumanMessage
+from typing import Literal
+import asyncio
+import json
+import time
 import uuid
 
 class QueryRequest(BaseModel):
     query: str
     session_id: Optional[str] = None
     agent_id: Optional[str] = None
+    # text: plain answer stream, agent name in the X-Agent-Name header
+    # ndjson: one JSON event per line, starting with the selected agent
+    stream_format: Literal["text", "ndjson"] = "text"
 
 class QueryResponse(BaseModel):
     agent_name: str
@@ -612,7 +660,8 @@ def save_chat_history(session_id: str, user_id: str, chat_history: list, query:
         "user": query,
         "assistant": answer,
         "agent_id": agent_id,
-        "agent_name": agent_name
+        "agent_name": agent_name,
+        "tokens": count_tokens(query) + count_tokens(answer)
     }
     updated_chat_history = chat_history + [new_history_entry]
     sessions_db.update_one(
@@ -628,22 +677,39 @@ def update_chat_history_entry(session_id: str, message_num: int, new_query: str,
             "$set": {
                 f"chat_history.{message_num}.user": new_query,
                 f"chat_history.{message_num}.assistant": new_answer,
+                f"chat_history.{message_num}.tokens": count_tokens(new_query) + count_tokens(new_answer),
             }
         }
     )
+    invalidate_summary_from(session_id, message_num)
 
 def replace_chat_history_from_point(session_id: str, user_id: str, truncated_history: list, query: str, new_answer: str, agent_id: str, agent_name: str):
     new_entry = {
         "user": query, 
         "assistant": new_answer, 
         "agent_id": agent_id, 
-        "agent_name": agent_name
+        "agent_name": agent_name,
+        "tokens": count_tokens(query) + count_tokens(new_answer)
     }
     final_history = truncated_history + [new_entry]
     sessions_db.update_one(
         {"session_id": session_id},
         {"$set": {"chat_history": final_history, "user_id": user_id}}
     )
+    invalidate_summary_from(session_id, len(truncated_history))
+
+async def gather_or_cancel(*aws):
+    """Like asyncio.gather, but the remaining steps are cancelled as soon as one fails."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+def ndjson_event(event_type: str, **fields) -> str:
+    return json.dumps({"type": event_type, **fields}) + "\n"
 
 @app.post("/ask")
 async def ask(
@@ -651,6 +717,7 @@ async def ask(
     background_tasks: BackgroundTasks, 
     token: str = Depends(oauth2_scheme)
 ):
+    started = time.perf_counter()
     try:
         user = verify_token(token)
     except HTTPException as e:
@@ -662,51 +729,99 @@ async def ask(
     if not user.get("organization") and user.get("permission") != "sysadmin":
         raise HTTPException(status_code=403, detail="User is not associated with any organization.")
 
-    agent_id_to_use = None
-    if query.agent_id:
-        if not ObjectId.is_valid(query.agent_id):
-            raise HTTPException(status_code=400, detail="Invalid agent_id format.")
+    if query.agent_id and not ObjectId.is_valid(query.agent_id):
+        raise HTTPException(status_code=400, detail="Invalid agent_id format.")
+
+    session_id = query.session_id or str(uuid.uuid4())
+    org_id = user.get("organization") if user.get("organization") else None
+
+    async def check_agent():
+        if not query.agent_id:
+            return
         agent_query = {"_id": ObjectId(query.agent_id)}
         if user.get("permission") != "sysadmin":
             agent_query["org"] = user["organization"]
-        agent = agents_db.find_one(agent_query)
+        agent = await async_agents_db.find_one(agent_query)
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found or you do not have permission to use it.")
-        agent_id_to_use = query.agent_id
-
-    session_id = query.session_id or str(uuid.uuid4())
-    session = sessions_db.find_one({"session_id": session_id})
-
-    if session and session.get("user_id") != str(user["_id"]):
-        raise HTTPException(status_code=403, detail="Permission denied for this session.")
-
-    chat_history = session.get("chat_history", []) if session else []
-    org_id = user.get("organization") if user.get("organization") else None
-
-    llm, messages, agent_name, agent_id = await get_agent_components(
-        question=query.query,
-        organization_id=org_id,
-        chat_history=chat_history,
-        agent_id=agent_id_to_use
-    )
 
-    async def response_generator():
-        full_answer = ""
+    async def load_session():
+        if not query.session_id:
+            return None
+        session = await async_sessions_db.find_one({"session_id": session_id})
+        if session and session.get("user_id") != str(user["_id"]):
+            raise HTTPException(status_code=403, detail="Permission denied for this session.")
+        return session
+
+    async def prepare():
+        # The agent check, the session load and agent routing do not depend on each other.
+        with timer("ask.prepare_ms"):
+            session_task = asyncio.ensure_future(load_session())
+            _, session, components = await gather_or_cancel(
+                check_agent(),
+                session_task,
+                get_agent_components(
+                    question=query.query,
+                    organization_id=org_id,
+                    agent_id=query.agent_id,
+                    session=session_task
+                )
+            )
+        return session, components
+
+    async def answer_chunks(llm, messages):
+        first_token = True
         async for chunk in llm.astream(messages):
             content = chunk.content or ""
-            full_answer += content
+            if first_token and content:
+                observe("ask.ttft_ms", (time.perf_counter() - started) * 1000)
+                first_token = False
             yield content
-        
+
+    def save_answer(session, answer, agent_id, agent_name):
         background_tasks.add_task(
             save_chat_history,
             session_id=session_id,
             user_id=str(user["_id"]),
-            chat_history=chat_history,
+            chat_history=session.get("chat_history", []) if session else [],
             query=query.query,
-            answer=full_answer,
+            answer=answer,
             agent_id=agent_id,
             agent_name=agent_name
         )
+        background_tasks.add_task(summarize_session_history, session_id=session_id)
+
+    if query.stream_format == "ndjson":
+        # Headers go out before routing; the selected agent is the first event in the body.
+        async def event_generator():
+            try:
+                session, (llm, messages, agent_name, agent_id) = await prepare()
+            except HTTPException as e:
+                yield ndjson_event("error", status=e.status_code, detail=e.detail)
+                return
+            yield ndjson_event("agent", agent_name=agent_name, agent_id=agent_id, session_id=session_id)
+
+            full_answer = ""
+            async for content in answer_chunks(llm, messages):
+                if content:
+                    full_answer += content
+                    yield ndjson_event("token", content=content)
+            yield ndjson_event("done")
+            save_answer(session, full_answer, agent_id, agent_name)
+
+        return StreamingResponse(event_generator(), media_type="application/x-ndjson", headers={
+            "X-Session-Id": session_id,
+            "Access-Control-Expose-Headers": "X-Session-Id"
+        })
+
+    session, (llm, messages, agent_name, agent_id) = await prepare()
+
+    async def response_generator():
+        full_answer = ""
+        async for content in answer_chunks(llm, messages):
+            full_answer += content
+            yield content
+        save_answer(session, full_answer, agent_id, agent_name)
 
     return StreamingResponse(response_generator(), media_type="text/plain", headers={
         "X-Agent-Name": agent_name,
@@ -730,7 +845,7 @@ async def regenerate(
     if not user.get("organization") and user.get("permission") != "sysadmin":
         raise HTTPException(status_code=403, detail="User is not associated with any organization.")
     
-    session = sessions_db.find_one({"session_id": session_id})
+    session = await async_sessions_db.find_one({"session_id": session_id})
     if not session:
         raise HTTPException(status_code=404, detail="Session not found.")
     
@@ -749,7 +864,9 @@ async def regenerate(
         question=original_query,
         organization_id=org_id,
         chat_history=truncated_history,
-        agent_id=agent_id
+        agent_id=agent_id,
+        history_summary=session.get("history_summary"),
+        use_cache=False,
     )
 
     async def response_generator():
@@ -797,7 +914,7 @@ async def edit_message(
     if not user.get("organization") and user.get("permission") != "sysadmin":
         raise HTTPException(status_code=403, detail="User is not associated with any organization.")
     
-    session = sessions_db.find_one({"session_id": session_id})
+    session = await async_sessions_db.find_one({"session_id": session_id})
     if not session:
         raise HTTPException(status_code=404, detail="Session not found.")
     
@@ -815,7 +932,9 @@ async def edit_message(
         question=query,
         organization_id=org_id,
         chat_history=history_for_llm,
-        agent_id=agent_id
+        agent_id=agent_id,
+        history_summary=session.get("history_summary"),
+        use_cache=False,
     )
 
     async def response_generator():
@@ -841,8 +960,8 @@ async def edit_message(
 
 
 # --- Session Management Routes ---
-from langchain_community.chat_models import ChatOpenAI
 from langchain.schema import SystemMessage, HumanMessage, AIMessage
+from api.llm import get_chat_model
 
 @app.get("/sessions", response_model=List[dict])
 def list_sessions(token: str = Depends(oauth2_scheme)):
@@ -871,7 +990,7 @@ def get_session(session_id: str, token: str = Depends(oauth2_scheme)):
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    title_generator = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.3)
+    title_generator = get_chat_model("gpt-3.5-turbo", temperature=0.3)
 
     chat_history = session["chat_history"]
 
@@ -909,6 +1028,10 @@ def delete_session(session_id: str, token: str = Depends(oauth2_scheme)):
 
 # --- Agent Management Routes ---
 from api.agent import Agent, AgentCreate, AgentUpdate, Connector, ConnectorCreate, ConnectorUpdate
+from api.agent import invalidate_agent_bundle, invalidate_connector_bundles
+from api.router import refresh_org as refresh_agent_router
+from api.tools.google_client import evict_google_clients
+from pymongo import ReturnDocument
 
 @app.get("/agents", response_model=List[Agent])
 def list_agents(token: str = Depends(oauth2_scheme)):
@@ -921,7 +1044,7 @@ def list_agents(token: str = Depends(oauth2_scheme)):
 
 
 @app.post("/agents", response_model=Agent)
-def create_agent(agent: AgentCreate, token: str = Depends(oauth2_scheme)):
+def create_agent(agent: AgentCreate, background_tasks: BackgroundTasks, token: str = Depends(oauth2_scheme)):
     user = verify_token(token)
     org_id = ObjectId(user["organization"])
 
@@ -944,6 +1067,7 @@ def create_agent(agent: AgentCreate, token: str = Depends(oauth2_scheme)):
     created_agent = agents_db.find_one({"_id": result.inserted_id})
     if not created_agent:
         raise HTTPException(status_code=500, detail="Failed to create and retrieve the agent.")
+    background_tasks.add_task(refresh_agent_router, org_id)
         
     return Agent(**created_agent)
 
@@ -967,7 +1091,7 @@ def get_agent(agent_id: str, token: str = Depends(oauth2_scheme)):
 
 
 @app.put("/agents/{agent_id}", response_model=Agent)
-def update_agent(agent_id: str, agent_update: AgentUpdate, token: str = Depends(oauth2_scheme)):
+def update_agent(agent_id: str, agent_update: AgentUpdate, background_tasks: BackgroundTasks, token: str = Depends(oauth2_scheme)):
     user = verify_token(token)
     org_id = ObjectId(user["organization"])
     
@@ -1000,12 +1124,14 @@ def update_agent(agent_id: str, agent_update: AgentUpdate, token: str = Depends(
         {"$set": update_data}
     )
 
+    invalidate_agent_bundle(agent_id)
     updated_agent = agents_db.find_one({"_id": ObjectId(agent_id)})
+    background_tasks.add_task(refresh_agent_router, org_id)
     return Agent(**updated_agent)
 
 
 @app.delete("/agents/{agent_id}")
-def delete_agent(agent_id: str, token: str = Depends(oauth2_scheme)):
+def delete_agent(agent_id: str, background_tasks: BackgroundTasks, token: str = Depends(oauth2_scheme)):
     user = verify_token(token)
     
     if user.get("permission") != "orgadmin":
@@ -1021,6 +1147,8 @@ def delete_agent(agent_id: str, token: str = Depends(oauth2_scheme)):
 
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Agent not found or you do not have permission to delete it.")
+    invalidate_agent_bundle(agent_id)
+    background_tasks.add_task(refresh_agent_router, ObjectId(user["organization"]))
     
     return {"message": f"Agent '{agent_id}' deleted successfully."}
 
@@ -1086,13 +1214,16 @@ def update_connector(connector_id: str, connector_update: ConnectorUpdate, token
         if connectors_db.find_one({"_id": {"$ne": ObjectId(connector_id)}, "org": org_id, "name": update_data["name"]}):
             raise HTTPException(status_code=400, detail=f"A connector named '{update_data['name']}' already exists.")
 
-    result = connectors_db.update_one(
+    previous_connector = connectors_db.find_one_and_update(
         {"_id": ObjectId(connector_id), "org": org_id},
-        {"$set": update_data}
+        {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
     )
 
-    if result.matched_count == 0:
+    if previous_connector is None:
         raise HTTPException(status_code=404, detail="Connector not found.")
+    invalidate_connector_bundles(connector_id)
+    evict_google_clients(previous_connector.get("settings"))
 
     updated_connector = connectors_db.find_one({"_id": ObjectId(connector_id)})
     return Connector(**updated_connector)
@@ -1108,10 +1239,12 @@ def delete_connector(connector_id: str, token: str = Depends(oauth2_scheme)):
     if not ObjectId.is_valid(connector_id):
         raise HTTPException(status_code=400, detail="Invalid connector ID format.")
 
-    delete_result = connectors_db.delete_one({"_id": ObjectId(connector_id), "org": org_id})
+    deleted_connector = connectors_db.find_one_and_delete({"_id": ObjectId(connector_id), "org": org_id})
 
-    if delete_result.deleted_count == 0:
+    if deleted_connector is None:
         raise HTTPException(status_code=404, detail="Connector not found.")
+    invalidate_connector_bundles(connector_id)
+    evict_google_clients(deleted_connector.get("settings"))
 
     agents_db.update_many(
         {"org": org_id},
@@ -1119,3 +1252,24 @@ def delete_connector(connector_id: str, token: str = Depends(oauth2_scheme)):
     )
 
     return {"message": f"Connector '{connector_id}' deleted successfully."}
+
+# --- Diagnostics Routes ---
+from api.metrics import snapshot
+
+@app.get("/metrics", response_model=dict)
+def metrics(token: str = Depends(oauth2_scheme)):
+    user = verify_token(token)
+
+    if user.get("permission") != "sysadmin":
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    return snapshot()
+
+@app.get("/diagnostics/indexes", response_model=List[dict])
+def diagnose_indexes(token: str = Depends(oauth2_scheme)):
+    user = verify_token(token)
+
+    if user.get("permission") != "sysadmin":
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    return explain_query_shapes()
@@ -0,0 +1,62 @@
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict
+import threading
+import time
+
+_sources: Dict[str, Callable[[], dict]] = {}
+_summaries: Dict[str, "Summary"] = {}
+_lock = threading.Lock()
+
+class Summary:
+    """Running count/total/max of an observed value plus percentiles over a recent window."""
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._recent.append(value)
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent)
+        def percentile(p):
+            return recent[min(len(recent) - 1, int(len(recent) * p))] if recent else 0.0
+        return {
+            "count": self.count,
+            "mean": (self.total / self.count) if self.count else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": self.max,
+        }
+
+def register_source(name: str, source: Callable[[], dict]) -> None:
+    _sources[name] = source
+
+def observe(name: str, value: float) -> None:
+    summary = _summaries.get(name)
+    if summary is None:
+        with _lock:
+            summary = _summaries.setdefault(name, Summary())
+    summary.observe(value)
+
+@contextmanager
+def timer(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - start) * 1000)
+
+def snapshot() -> dict:
+    data = {name: source() for name, source in _sources.items()}
+    data["summaries"] = {name: summary.stats() for name, summary in sorted(_summaries.items())}
+    return data
@@ -0,0 +1,69 @@
+"""
+Rewrites knowledge documents that hold a list of embeddings (arrays of doubles)
+as one document per chunk with a packed float32 vector.
+
+    python -m api.migrate_embeddings            # migrate every legacy document
+    python -m api.migrate_embeddings --dry-run  # count what would be migrated
+
+Each legacy document becomes chunk documents whose source_id is the legacy
+document's _id, upserted by (source_id, chunk), and is deleted only after its
+chunks are written, so an interrupted run can simply be started again.
+"""
+from pymongo import UpdateOne
+import logging
+import sys
+
+from api.db import knowledge_db
+from api.embed import chunk_documents, invalidate_knowledge_index
+
+logger = logging.getLogger(__name__)
+
+LEGACY_FILTER = {"embeddings": {"$exists": True}, "vector": {"$exists": False}}
+
+def migrate_document(document: dict) -> int:
+    chunks = chunk_documents(
+        document.get("embeddings") or [],
+        document["user_id"],
+        document["agent_id"],
+        source_id=document["_id"],
+    )
+    if chunks:
+        knowledge_db.embeddings.bulk_write([
+            UpdateOne(
+                {"source_id": chunk["source_id"], "chunk": chunk["chunk"]},
+                {"$setOnInsert": {**chunk, "created_at": document.get("created_at", chunk["created_at"])}},
+                upsert=True,
+            )
+            for chunk in chunks
+        ], ordered=False)
+    knowledge_db.embeddings.delete_one({"_id": document["_id"]})
+    invalidate_knowledge_index(document["user_id"], document["agent_id"])
+    return len(chunks)
+
+def migrate(dry_run: bool = False) -> tuple:
+    """Returns (legacy documents, chunk documents written)."""
+    documents, chunks = 0, 0
+    for document in knowledge_db.embeddings.find(LEGACY_FILTER):
+        documents += 1
+        if dry_run:
+            chunks += len(document.get("embeddings") or [])
+            continue
+        try:
+            chunks += migrate_document(document)
+        except Exception as e:
+            logger.error(f"Could not migrate knowledge document {document['_id']}: {e}")
+            raise
+    return documents, chunks
+
+def main(argv: list) -> int:
+    dry_run = "--dry-run" in argv[1:]
+    if any(arg not in ("--dry-run",) for arg in argv[1:]):
+        print(__doc__)
+        return 2
+    documents, chunks = migrate(dry_run)
+    verb = "would write" if dry_run else "wrote"
+    print(f"{documents} legacy documents, {verb} {chunks} chunk documents")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,153 @@
+from langchain_core.messages import AIMessageChunk
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import re
+import time
+
+from api.cache import TTLCache
+from api.metrics import register_source
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 600))
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 2000))
+
+response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, name="responses")
+
+_in_flight: dict = {}
+# agent id -> (generation, monotonic time of the invalidation that started it)
+_generations: dict = {}
+_generation_counter = itertools.count(1)
+_stats = {"shared_streams": 0, "joined_streams": 0, "failed_streams": 0}
+
+register_source("response_cache", lambda: {**response_cache.stats(), **_stats, "in_flight": len(_in_flight)})
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_question(question: str) -> str:
+    return _WHITESPACE_RE.sub(" ", question).strip().lower().rstrip("?!. ")
+
+def invalidate_agent_responses(agent_id) -> None:
+    """Makes every cached answer of an agent unreachable, e.g. after its connectors changed."""
+    now = time.monotonic()
+    _prune_generations(now)
+    _generations[str(agent_id)] = (next(_generation_counter), now)
+
+def _prune_generations(now: float) -> None:
+    # Every answer cached before an invalidation has expired RESPONSE_CACHE_TTL
+    # after it, and stale answers are never cached after it (see _produce), so
+    # the agent can go back to generation 0. Generations are unique, so answers
+    # cached under the dropped one can never be reached again.
+    for agent_id, (_, invalidated_at) in list(_generations.items()):
+        if now - invalidated_at > RESPONSE_CACHE_TTL:
+            _generations.pop(agent_id, None)
+
+def current_generation(agent_id: str) -> int:
+    return _generations.get(agent_id, (0, 0))[0]
+
+def response_key(agent_id: str, version: str, messages: list) -> tuple:
+    history = hashlib.blake2b(digest_size=16)
+    for message in messages[:-1]:
+        history.update(f"{message.type}\x00{message.content}\x01".encode("utf-8"))
+    return (
+        agent_id,
+        version,
+        current_generation(agent_id),
+        history.hexdigest(),
+        normalize_question(messages[-1].content),
+    )
+
+class SharedStream:
+    """One upstream answer stream replayed to every request that asked the same question while it ran."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, content: str) -> None:
+        self.chunks.append(content)
+        self._notify()
+
+    def finish(self, error: Exception | None = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+async def _produce(key: tuple, stream: SharedStream, upstream) -> None:
+    # Runs detached from the request that started it, so a disconnecting client does
+    # not cut the answer short for the others waiting on it.
+    try:
+        async for chunk in upstream:
+            if chunk.content:
+                stream.publish(chunk.content)
+    except Exception as e:
+        _stats["failed_streams"] += 1
+        logger.warning(f"Shared response stream failed: {e}")
+        stream.finish(e)
+    else:
+        # An answer started before its agent was invalidated is not cached.
+        if key[2] == current_generation(key[0]):
+            response_cache.set(key, "".join(stream.chunks))
+        stream.finish()
+    finally:
+        _in_flight.pop(key, None)
+        # Cancelled (e.g. at shutdown): subscribers must not wait forever.
+        if not stream.done:
+            _stats["failed_streams"] += 1
+            stream.finish(RuntimeError("The shared response stream was cancelled."))
+
+class CachedResponseModel:
+    """
+    Wraps a deterministic agent's model: repeated questions are answered from
+    the cache, and identical questions asked concurrently share one generation.
+    """
+
+    def __init__(self, llm, agent_id: str, version: str):
+        self.llm = llm
+        self.agent_id = agent_id
+        self.version = version
+
+    @property
+    def tools(self) -> list:
+        return getattr(self.llm, "tools", [])
+
+    async def astream(self, messages: list):
+        key = response_key(self.agent_id, self.version, messages)
+        answer = response_cache.get(key)
+        if answer is not None:
+            yield AIMessageChunk(content=answer)
+            return
+
+        stream = _in_flight.get(key)
+        if stream is None:
+            stream = SharedStream()
+            _in_flight[key] = stream
+            _stats["shared_streams"] += 1
+            stream.task = asyncio.create_task(_produce(key, stream, self.llm.astream(messages)))
+        else:
+            _stats["joined_streams"] += 1
+
+        async for content in stream.subscribe():
+            yield AIMessageChunk(content=content)
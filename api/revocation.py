@@ -0,0 +1,129 @@
+from typing import Optional
+import hashlib
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """Compact probabilistic set: no false negatives, tunable false-positive rate."""
+
+    def __init__(self, capacity: int = 10000, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class RevocationList:
+    """
+    Tracks users whose previously issued tokens must be rejected.
+
+    Revocations live in Mongo so every worker sees them; each worker keeps a
+    Bloom filter of revoked user ids that is rebuilt in a background thread.
+    A filter miss is authoritative, a hit is confirmed against Mongo.
+    """
+
+    def __init__(self, collection, retention_seconds: float, refresh_interval: float = 30.0, error_rate: float = 0.01):
+        self.collection = collection
+        self.retention_seconds = retention_seconds
+        self.refresh_interval = refresh_interval
+        self.error_rate = error_rate
+        self._filter = BloomFilter(error_rate=error_rate)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.filter_hits = 0
+        self.filter_misses = 0
+        self.confirmed = 0
+        self.last_refresh: Optional[float] = None
+        # Users revoked while a refresh is reading Mongo, merged into the filter it builds
+        self._revoked_during_refresh: Optional[set] = None
+
+    def revoke(self, user_id: str) -> None:
+        self.collection.insert_one({"user_id": str(user_id), "revoked_at": time.time()})
+        with self._lock:
+            self._filter.add(str(user_id))
+            if self._revoked_during_refresh is not None:
+                self._revoked_during_refresh.add(str(user_id))
+
+    def is_revoked(self, user_id: str, issued_at: float) -> bool:
+        if str(user_id) not in self._filter:
+            self.filter_misses += 1
+            return False
+        self.filter_hits += 1
+        revoked = self.collection.find_one({
+            "user_id": str(user_id),
+            "revoked_at": {"$gte": issued_at}
+        }) is not None
+        if revoked:
+            self.confirmed += 1
+        return revoked
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._revoked_during_refresh = set()
+        try:
+            since = time.time() - self.retention_seconds
+            user_ids = self.collection.distinct("user_id", {"revoked_at": {"$gte": since}})
+            bloom = BloomFilter(capacity=max(len(user_ids) * 2, 1000), error_rate=self.error_rate)
+            for user_id in user_ids:
+                bloom.add(user_id)
+            with self._lock:
+                # A revocation written after the distinct() read must not be dropped with the old filter.
+                for user_id in self._revoked_during_refresh:
+                    bloom.add(user_id)
+                self._filter = bloom
+        finally:
+            with self._lock:
+                self._revoked_during_refresh = None
+        self.last_refresh = time.time()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Failed to refresh token revocation list: {e}")
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="revocation-refresh", daemon=True)
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning(f"Initial token revocation refresh failed: {e}")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "revoked_users": self._filter.count,
+            "filter_bits": self._filter.size,
+            "filter_hits": self.filter_hits,
+            "filter_misses": self.filter_misses,
+            "confirmed_revocations": self.confirmed,
+            "last_refresh": self.last_refresh,
+        }
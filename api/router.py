@@ -0,0 +1,215 @@
+from langchain.schema import HumanMessage, SystemMessage
+from collections import Counter
+from typing import Optional
+import asyncio
+import logging
+import math
+import os
+import re
+
+import numpy as np
+
+from api.llm import get_chat_model
+from api.metrics import register_source, observe, timer
+
+logger = logging.getLogger(__name__)
+
+ROUTER_MODE = os.environ.get("AGENT_ROUTER_MODE", "llm").lower()
+ROUTER_THRESHOLD = float(os.environ.get("AGENT_ROUTER_THRESHOLD", 0.5))
+ROUTER_FALLBACK = os.environ.get("AGENT_ROUTER_FALLBACK", "llm").lower()
+ROUTER_SHORTLIST_K = int(os.environ.get("AGENT_ROUTER_SHORTLIST_K", 8))
+ROUTER_PREFILTER = os.environ.get("AGENT_ROUTER_PREFILTER", "lexical").lower()
+
+class OrgAgentMatrix:
+    """Normalized description embeddings of every agent in one organization."""
+
+    def __init__(self, signature: tuple, agent_ids: list, matrix: np.ndarray):
+        self.signature = signature
+        self.agent_ids = agent_ids
+        self.matrix = matrix
+
+_org_matrices: dict = {}
+_org_vectors: dict = {}
+_org_locks: dict = {}
+_stats = {"embedding_routes": 0, "below_threshold": 0, "llm_routes": 0, "shortlisted_routes": 0, "matrix_builds": 0}
+
+register_source("agent_router", lambda: {
+    **_stats,
+    "mode": ROUTER_MODE,
+    "prefilter": ROUTER_PREFILTER,
+    "shortlist_k": ROUTER_SHORTLIST_K,
+    "cached_orgs": len(_org_matrices),
+})
+
+def _agent_signature(agents: list) -> tuple:
+    return tuple(sorted((str(agent["_id"]), str(agent.get("updated_at"))) for agent in agents))
+
+def _agent_text(agent: dict) -> str:
+    return f"{agent['name']}: {agent['description']}"
+
+def invalidate_org(organization_id) -> None:
+    _org_matrices.pop(str(organization_id), None)
+
+async def refresh_org(organization_id) -> None:
+    invalidate_org(organization_id)
+    if ROUTER_MODE != "embedding":
+        return
+    from api.db import async_agents_db
+
+    agents = await async_agents_db.find({"org": organization_id}).to_list()
+    if agents:
+        try:
+            await get_org_matrix(organization_id, agents)
+        except Exception as e:
+            logger.warning(f"Failed to rebuild agent router matrix for org {organization_id}: {e}")
+
+async def get_org_matrix(organization_id, agents: list) -> OrgAgentMatrix:
+    # Imported lazily: the embedding client needs OpenAI credentials at import time
+    # and is only required when embedding routing is enabled.
+    from api.embed import aembed_texts
+
+    key = str(organization_id)
+    signature = _agent_signature(agents)
+    cached = _org_matrices.get(key)
+    if cached and cached.signature == signature:
+        return cached
+
+    lock = _org_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        cached = _org_matrices.get(key)
+        if cached and cached.signature == signature:
+            return cached
+
+        versions = [(str(agent["_id"]), str(agent.get("updated_at"))) for agent in agents]
+        previous = _org_vectors.get(key, {})
+        vectors = {version: previous[version] for version in versions if version in previous}
+        missing = [agent for agent, version in zip(agents, versions) if version not in vectors]
+        if missing:
+            embedded = await aembed_texts([_agent_text(agent) for agent in missing])
+            for agent, vector in zip(missing, embedded):
+                vectors[(str(agent["_id"]), str(agent.get("updated_at")))] = vector
+        _org_vectors[key] = vectors
+
+        matrix = np.ascontiguousarray(np.stack([vectors[version] for version in versions]))
+        org_matrix = OrgAgentMatrix(signature, [version[0] for version in versions], matrix)
+        _org_matrices[key] = org_matrix
+        _stats["matrix_builds"] += 1
+        return org_matrix
+
+async def score_by_embedding(question: str, organization_id, agents: list) -> tuple:
+    from api.embed import aembed_query
+
+    org_matrix, query = await asyncio.gather(
+        get_org_matrix(organization_id, agents),
+        aembed_query(question),
+    )
+    by_id = {str(agent["_id"]): agent for agent in agents}
+    ordered = [by_id[agent_id] for agent_id in org_matrix.agent_ids]
+    return ordered, org_matrix.matrix @ query
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def _stem(token: str) -> str:
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def _tokenize(text: str) -> list:
+    return [_stem(token) for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+def lexical_scores(question: str, agents: list) -> np.ndarray:
+    """BM25 score of the question against each agent's name and description."""
+    documents = [_tokenize(_agent_text(agent)) for agent in agents]
+    query_terms = set(_tokenize(question))
+    if not query_terms:
+        return np.zeros(len(agents), dtype=np.float32)
+
+    doc_freq = Counter(term for document in documents for term in set(document) if term in query_terms)
+    avg_len = (sum(len(document) for document in documents) / len(documents)) or 1.0
+    k1, b = 1.5, 0.75
+    scores = np.zeros(len(agents), dtype=np.float32)
+    for i, document in enumerate(documents):
+        term_freq = Counter(document)
+        for term in query_terms:
+            tf = term_freq.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(documents) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            scores[i] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(document) / avg_len))
+    return scores
+
+def top_k(agents: list, scores: np.ndarray, k: int) -> list:
+    if len(agents) <= k:
+        return agents
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [agents[i] for i in best]
+
+async def shortlist_agents(question: str, organization_id, agents: list, scored: Optional[tuple] = None) -> list:
+    k = ROUTER_SHORTLIST_K
+    if k <= 0 or len(agents) <= k:
+        return agents
+
+    _stats["shortlisted_routes"] += 1
+    with timer("router.shortlist_ms"):
+        if scored is None and ROUTER_PREFILTER == "vector":
+            try:
+                scored = await score_by_embedding(question, organization_id, agents)
+            except Exception as e:
+                logger.warning(f"Vector prefilter failed, using lexical prefilter: {e}")
+        if scored is not None:
+            return top_k(*scored, k)
+        return top_k(agents, lexical_scores(question, agents), k)
+
+async def route_with_llm(question: str, agents: list) -> Optional[dict]:
+    _stats["llm_routes"] += 1
+    agent_descriptions = "\n".join(
+        [f"- **{agent['name']}**: {agent['description']}" for agent in agents]
+    )
+    router_prompt = [
+        SystemMessage(
+            content=(
+                "You are an expert at routing a user's request to the correct agent. "
+                "Based on the user's question, select the best agent from the following list. "
+                "You must output **only the name** of the agent you choose. "
+                "If no agent seems suitable for the request, you must output 'Generalist'."
+                f"\n\nAvailable Agents:\n{agent_descriptions}"
+            )
+        ),
+        HumanMessage(content=question),
+    ]
+    observe("router.prompt_agents", len(agents))
+    observe("router.prompt_chars", sum(len(message.content) for message in router_prompt))
+
+    router_llm = get_chat_model("gpt-4o-mini", temperature=0)
+    with timer("router.llm_ms"):
+        selected_agent_name_response = await router_llm.ainvoke(router_prompt)
+    selected_agent_name = selected_agent_name_response.content.strip()
+    return next(
+        (agent for agent in agents if agent["name"] == selected_agent_name),
+        None,
+    )
+
+async def route_agent(question: str, organization_id, agents: list) -> Optional[dict]:
+    if not agents:
+        return None
+
+    with timer("router.route_ms"):
+        scored = None
+        if ROUTER_MODE == "embedding":
+            try:
+                scored = await score_by_embedding(question, organization_id, agents)
+                best = int(np.argmax(scored[1]))
+                agent, score = scored[0][best], float(scored[1][best])
+            except Exception as e:
+                logger.warning(f"Embedding router failed, falling back to {ROUTER_FALLBACK}: {e}")
+                agent, score = None, float("-inf")
+            if agent is not None and score >= ROUTER_THRESHOLD:
+                _stats["embedding_routes"] += 1
+                return agent
+            _stats["below_threshold"] += 1
+            if ROUTER_FALLBACK != "llm":
+                return None
+
+        candidates = await shortlist_agents(question, organization_id, agents, scored)
+        return await route_with_llm(question, candidates)
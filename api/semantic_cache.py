@@ -0,0 +1,171 @@
+from langchain_core.messages import AIMessageChunk
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from api.metrics import register_source, observe, timer
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 500))
+SEMANTIC_CACHE_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", 3600))
+SEMANTIC_CACHE_MAX_AGENTS = int(os.environ.get("SEMANTIC_CACHE_MAX_AGENTS", 200))
+
+class AnswerStore:
+    """
+    Normalized question embeddings of one agent version with their answers.
+
+    Vectors live in one preallocated float32 matrix so a lookup is a single
+    matrix-vector product; when full, the least recently used row is replaced.
+    """
+
+    def __init__(self, version: str, capacity: int, dim: int):
+        self.version = version
+        self.capacity = capacity
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.answers = [None] * capacity
+        self.expires_at = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def search(self, query: np.ndarray, threshold: float):
+        with self._lock:
+            if not self.size:
+                return None, 0.0
+            now = time.monotonic()
+            scores = self.matrix[:self.size] @ query
+            scores[self.expires_at[:self.size] <= now] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None, float(scores[best])
+            self.last_used[best] = now
+            return self.answers[best], float(scores[best])
+
+    def add(self, query: np.ndarray, answer: str, ttl: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.size < self.capacity:
+                row = self.size
+                self.size += 1
+            else:
+                expired = np.flatnonzero(self.expires_at <= now)
+                row = int(expired[0]) if len(expired) else int(np.argmin(self.last_used))
+                self.evictions += 1
+            self.matrix[row] = query
+            self.answers[row] = answer
+            self.expires_at[row] = now + ttl
+            self.last_used[row] = now
+
+# (organization id, agent id) -> AnswerStore; an agent's answers are never visible to other orgs
+_stores: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "skipped": 0, "errors": 0}
+
+def stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": (_stats["hits"] / lookups) if lookups else 0.0,
+        "threshold": SEMANTIC_CACHE_THRESHOLD,
+        "agents": len(_stores),
+        "entries": sum(store.size for store in list(_stores.values())),
+        "evictions": sum(store.evictions for store in list(_stores.values())),
+    }
+
+register_source("semantic_cache", stats)
+
+def purge_agent_answers(agent_id) -> None:
+    agent_id = str(agent_id)
+    with _lock:
+        for key in [key for key in _stores if key[1] == agent_id]:
+            del _stores[key]
+
+def clear() -> None:
+    with _lock:
+        _stores.clear()
+
+def _get_store(key: tuple, version: str, dim: int, create: bool):
+    with _lock:
+        store = _stores.get(key)
+        if store is not None and store.version != version:
+            store = None
+            del _stores[key]
+        if store is not None:
+            _stores.move_to_end(key)
+        elif create:
+            # Least recently used agent first.
+            while len(_stores) >= SEMANTIC_CACHE_MAX_AGENTS:
+                _stores.popitem(last=False)
+            store = AnswerStore(version, SEMANTIC_CACHE_SIZE, dim)
+            _stores[key] = store
+        return store
+
+def _is_current(key: tuple, store: AnswerStore) -> bool:
+    with _lock:
+        return _stores.get(key) is store
+
+class SemanticCacheModel:
+    """
+    Wraps an agent's model: a first-turn question close enough to one the agent
+    already answered gets that answer back without calling the model.
+
+    Questions asked with conversation history are passed straight through, since
+    an earlier answer only fits when the question stands on its own.
+    """
+
+    def __init__(self, llm, organization_id, agent_id: str, version: str, threshold: float | None = None):
+        self.llm = llm
+        self.key = (str(organization_id), agent_id)
+        self.version = version
+        self.threshold = SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+
+    @property
+    def tools(self) -> list:
+        return getattr(self.llm, "tools", [])
+
+    async def astream(self, messages: list):
+        # Imported lazily: the embedding client needs OpenAI credentials at import time.
+        from api.embed import aembed_query
+
+        if len(messages) != 2 or SEMANTIC_CACHE_SIZE <= 0:
+            _stats["skipped"] += 1
+            async for chunk in self.llm.astream(messages):
+                yield chunk
+            return
+
+        query = None
+        try:
+            with timer("semantic_cache.embed_ms"):
+                query = await aembed_query(messages[-1].content)
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.warning(f"Semantic cache lookup failed, answering with the model: {e}")
+
+        store = None
+        if query is not None:
+            store = _get_store(self.key, self.version, len(query), create=True)
+            answer, score = store.search(query, self.threshold)
+            observe("semantic_cache.best_score", score)
+            if answer is not None:
+                _stats["hits"] += 1
+                yield AIMessageChunk(content=answer)
+                return
+            _stats["misses"] += 1
+
+        parts = []
+        async for chunk in self.llm.astream(messages):
+            parts.append(chunk.content or "")
+            yield chunk
+
+        # The store is the agent's generation: an answer started before the agent's
+        # answers were purged (or its version changed) must not land in the new store.
+        if store is not None and parts and _is_current(self.key, store):
+            store.add(query, "".join(parts), SEMANTIC_CACHE_TTL)
+            _stats["stores"] += 1
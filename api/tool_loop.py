@@ -0,0 +1,132 @@
+from langchain.schema import AIMessage
+from langchain_core.messages import AIMessageChunk, ToolMessage
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from api.metrics import register_source, observe
+
+logger = logging.getLogger(__name__)
+
+AGENT_TOOL_WORKERS = int(os.environ.get("AGENT_TOOL_WORKERS", 16))
+AGENT_TOOL_TIMEOUT = float(os.environ.get("AGENT_TOOL_TIMEOUT", 30))
+AGENT_MAX_TOOL_ROUNDS = int(os.environ.get("AGENT_MAX_TOOL_ROUNDS", 5))
+
+# Blocking tools (Google APIs) run here so the event loop keeps streaming; async tools are awaited directly.
+_executor = ThreadPoolExecutor(max_workers=AGENT_TOOL_WORKERS, thread_name_prefix="agent-tool")
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "errors": 0, "timeouts": 0, "cancelled": 0, "in_flight": 0, "rounds": 0}
+
+register_source("agent_tools", lambda: {**_stats, "workers": AGENT_TOOL_WORKERS, "timeout": AGENT_TOOL_TIMEOUT})
+
+def _count(key: str, delta: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += delta
+
+async def run_tool(tool, arguments: dict, timeout: Optional[float] = None) -> str:
+    """
+    Runs one tool call on the tool pool and returns its output as text.
+
+    Failures and timeouts are returned as error text for the model to read. A call
+    that has not started yet when it times out or is cancelled never runs; one that
+    is already running finishes in its worker thread and its result is discarded.
+    """
+    timeout = AGENT_TOOL_TIMEOUT if timeout is None else timeout
+    loop = asyncio.get_running_loop()
+    _count("calls")
+    _count("in_flight")
+    start = time.perf_counter()
+    try:
+        if getattr(tool, "coroutine", None) is not None:
+            call = tool.ainvoke(arguments)
+        else:
+            call = loop.run_in_executor(_executor, tool.invoke, arguments)
+        result = await asyncio.wait_for(call, timeout)
+        return result if isinstance(result, str) else str(result)
+    except asyncio.TimeoutError:
+        _count("timeouts")
+        logger.warning(f"Tool '{tool.name}' timed out after {timeout}s")
+        return f"Error: The tool '{tool.name}' did not respond within {timeout:g} seconds."
+    except asyncio.CancelledError:
+        _count("cancelled")
+        raise
+    except Exception as e:
+        _count("errors")
+        logger.warning(f"Tool '{tool.name}' failed: {e}")
+        return f"Error: The tool '{tool.name}' failed: {e}"
+    finally:
+        _count("in_flight", -1)
+        observe(f"tool.{tool.name}_ms", (time.perf_counter() - start) * 1000)
+
+async def execute_tool_calls(tools_by_name: dict, tool_calls: list, timeout: Optional[float] = None) -> list:
+    """Runs every tool call of one model turn concurrently; the turn costs its slowest call."""
+    async def run(call: dict) -> ToolMessage:
+        tool = tools_by_name.get(call["name"])
+        if tool is None:
+            content = f"Error: Unknown tool '{call['name']}'."
+        else:
+            content = await run_tool(tool, call["args"], timeout)
+        return ToolMessage(content=content, tool_call_id=call["id"], name=call["name"])
+
+    start = time.perf_counter()
+    try:
+        return await asyncio.gather(*(run(call) for call in tool_calls))
+    finally:
+        observe("tool.round_ms", (time.perf_counter() - start) * 1000)
+        observe("tool.round_calls", len(tool_calls))
+
+def _tool_call_message(message) -> AIMessage:
+    # Re-encoded from the parsed calls: streamed chunks carry merge indexes OpenAI does not expect back.
+    return AIMessage(
+        content=message.content,
+        additional_kwargs={"tool_calls": [
+            {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": json.dumps(call["args"])}}
+            for call in message.tool_calls
+        ]},
+    )
+
+class ToolLoop:
+    """
+    A chat model bound to tools that answers with the same `astream` interface as
+    the model itself.
+
+    Each model turn is streamed; when it ends with tool calls, those run
+    concurrently and their results are fed back until the model answers in text
+    or AGENT_MAX_TOOL_ROUNDS is reached.
+    """
+
+    def __init__(self, llm, tools: list, max_rounds: Optional[int] = None, timeout: Optional[float] = None):
+        self.llm = llm
+        self.tools = tools
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.max_rounds = AGENT_MAX_TOOL_ROUNDS if max_rounds is None else max_rounds
+        self.timeout = timeout
+
+    async def astream(self, messages: list):
+        messages = list(messages)
+        for round_num in range(self.max_rounds + 1):
+            response = None
+            async for chunk in self.llm.astream(messages):
+                response = chunk if response is None else response + chunk
+                if chunk.content:
+                    yield chunk
+
+            if response is None or not response.tool_calls:
+                return
+            if round_num == self.max_rounds:
+                logger.warning(f"Stopped tool loop after {self.max_rounds} rounds without a final answer")
+                return
+
+            _count("rounds")
+            results = await execute_tool_calls(self.tools_by_name, response.tool_calls, self.timeout)
+            if all(getattr(self.tools_by_name.get(call["name"]), "return_direct", False) for call in response.tool_calls):
+                for result in results:
+                    yield AIMessageChunk(content=result.content)
+                return
+            messages.append(_tool_call_message(response))
+            messages.extend(results)
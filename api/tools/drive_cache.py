@@ -0,0 +1,281 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from googleapiclient.http import MediaIoBaseDownload
+
+from api.metrics import register_source, timer
+
+logger = logging.getLogger(__name__)
+
+DRIVE_CACHE_DIR = os.environ.get("DRIVE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nexa-drive-cache"))
+DRIVE_CACHE_MAX_BYTES = int(os.environ.get("DRIVE_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+DRIVE_CACHE_MMAP_THRESHOLD = int(os.environ.get("DRIVE_CACHE_MMAP_THRESHOLD", 1024 * 1024))
+DRIVE_DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DRIVE_DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+DRIVE_BACKGROUND_DOWNLOADS = int(os.environ.get("DRIVE_BACKGROUND_DOWNLOADS", 4))
+
+METADATA_FIELDS = "id,name,mimeType,size,md5Checksum,modifiedTime"
+
+def content_key(file_id: str, metadata: dict) -> str:
+    """
+    Blob name for one version of a file: its md5Checksum when Drive reports one, so
+    identical content is stored once, otherwise the file ID and modifiedTime.
+    """
+    if metadata.get("md5Checksum"):
+        return f"md5-{metadata['md5Checksum']}"
+    version = f"{file_id}:{metadata.get('modifiedTime')}".encode("utf-8")
+    return f"ver-{hashlib.sha256(version).hexdigest()}"
+
+class DriveFileCache:
+    """
+    Size-bounded directory of downloaded Drive files, evicted least recently used first.
+
+    Every worker shares the directory, so the directory is the only state: a blob
+    is cached when its file exists, a hit touches the file's mtime to mark it
+    recently used, and after each commit the oldest blobs are removed until the
+    whole directory fits in max_bytes. Blobs are written to a temporary file and
+    renamed into place.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _blobs(self) -> list:
+        # [(mtime, name, size)] of committed blobs, least recently used first.
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return []
+        blobs = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    blobs.append((stat.st_mtime_ns, entry.name, stat.st_size))
+            except FileNotFoundError:
+                # Evicted by another worker while scanning.
+                continue
+        return sorted(blobs)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for _, _, size in self._blobs())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        # An explicit nanosecond time: the filesystem's own timestamps are too coarse
+        # to order blobs used within a few milliseconds of each other.
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+
+    def get(self, key: str):
+        path = self.path(key)
+        try:
+            self._touch(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def reserve(self) -> tuple:
+        """Opens a temporary file in the cache directory to download into; returns (file, path)."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".download-")
+        return os.fdopen(fd, "wb"), temp_path
+
+    def commit(self, key: str, temp_path: str) -> str:
+        """Moves a finished download into place under key and returns its path."""
+        self._touch(temp_path)
+        os.replace(temp_path, self.path(key))
+        self._evict(keep=key)
+        return self.path(key)
+
+    def _evict(self, keep: str) -> None:
+        blobs = self._blobs()
+        total = sum(size for _, _, size in blobs)
+        for _, name, size in blobs:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            total -= size
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                # Another worker evicted it first.
+                continue
+            with self._lock:
+                self.evictions += 1
+
+    def put(self, key: str, write) -> str:
+        """Stores a blob written by write(file) and returns its path."""
+        f, temp_path = self.reserve()
+        try:
+            with f:
+                write(f)
+            return self.commit(key, temp_path)
+        except BaseException:
+            discard(temp_path)
+            raise
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        blobs = self._blobs()
+        return {
+            "directory": self.directory,
+            "files": len(blobs),
+            "bytes": sum(size for _, _, size in blobs),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+drive_cache = DriveFileCache(DRIVE_CACHE_DIR, DRIVE_CACHE_MAX_BYTES)
+register_source("drive_cache", drive_cache.stats)
+
+def get_file_metadata(client, file_id: str) -> dict:
+    with timer("drive.metadata_ms"):
+        return client.execute(
+            client.service.files().get(fileId=file_id, fields=METADATA_FIELDS, supportsAllDrives=True)
+        )
+
+class _ChunkSink:
+    """File-like target for MediaIoBaseDownload that also keeps the chunks written since the last take()."""
+
+    def __init__(self, f):
+        self.f = f
+        self.chunks = []
+
+    def write(self, data: bytes) -> None:
+        self.f.write(data)
+        self.chunks.append(data)
+
+    def take(self) -> list:
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+# Downloads finished after their reader stopped early, by cache key
+_downloads = ThreadPoolExecutor(max_workers=DRIVE_BACKGROUND_DOWNLOADS, thread_name_prefix="drive-download")
+_pending: dict = {}
+_pending_lock = threading.Lock()
+
+def discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _finish_download(client, request, downloader, sink: _ChunkSink, key: str, temp_path: str) -> None:
+    # Runs on a background thread, which needs its own httplib2 connection.
+    try:
+        request.http = client.http()
+        with sink.f:
+            done = False
+            while not done:
+                with timer("drive.download_chunk_ms"):
+                    _, done = downloader.next_chunk()
+                sink.take()
+        drive_cache.commit(key, temp_path)
+    except Exception as e:
+        logger.warning(f"Could not finish caching Drive download {key}: {e}")
+        discard(temp_path)
+    finally:
+        with _pending_lock:
+            _pending.pop(key, None)
+
+def _wait_for_pending(key: str) -> None:
+    with _pending_lock:
+        future = _pending.get(key)
+    if future is not None:
+        future.result()
+
+def iter_drive_file(client, file_id: str, chunk_size: int | None = None):
+    """
+    Yields the current version of a Drive file as chunks of bytes.
+
+    Only the metadata request is made when that version is already cached. Otherwise
+    the file is downloaded chunk by chunk, each chunk written to the cache and
+    yielded as it arrives. When the caller stops reading early, the rest is
+    downloaded in the background so the next read is still a cache hit.
+    """
+    chunk_size = chunk_size or DRIVE_DOWNLOAD_CHUNK_SIZE
+    metadata = get_file_metadata(client, file_id)
+    key = content_key(file_id, metadata)
+    _wait_for_pending(key)
+    path = drive_cache.get(key)
+    if path is not None:
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # Evicted by another worker since the lookup; download it again.
+            f = None
+        if f is not None:
+            with f, _read_or_map(f) as data:
+                for start in range(0, len(data), chunk_size):
+                    yield data[start:start + chunk_size]
+            return
+
+    request = client.service.files().get_media(fileId=file_id, supportsAllDrives=True)
+    request.http = client.http()
+    f, temp_path = drive_cache.reserve()
+    sink = _ChunkSink(f)
+    downloader = MediaIoBaseDownload(sink, request, chunksize=chunk_size)
+    done = False
+    try:
+        while not done:
+            with timer("drive.download_chunk_ms"):
+                _, done = downloader.next_chunk()
+            for chunk in sink.take():
+                yield chunk
+    except GeneratorExit:
+        # Files larger than the whole cache would only evict everything else.
+        if not done and int(metadata.get("size") or 0) <= drive_cache.max_bytes:
+            with _pending_lock:
+                _pending[key] = _downloads.submit(_finish_download, client, request, downloader, sink, key, temp_path)
+            return
+        if not done:
+            f.close()
+            discard(temp_path)
+            return
+    except BaseException:
+        f.close()
+        discard(temp_path)
+        raise
+    f.close()
+    drive_cache.commit(key, temp_path)
+
+@contextmanager
+def open_cached_file(path: str):
+    """Yields the file's bytes; large files are memory-mapped instead of read into memory."""
+    with open(path, "rb") as f, _read_or_map(f) as data:
+        yield data
+
+@contextmanager
+def _read_or_map(f):
+    size = os.fstat(f.fileno()).st_size
+    if size < DRIVE_CACHE_MMAP_THRESHOLD or size == 0:
+        yield f.read()
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
@@ -0,0 +1,147 @@
+from collections import deque
+import codecs
+import os
+import re
+
+# Most text a single read returns to the model; reads stop once it is reached, so a
+# call holds at most this much text plus one download chunk.
+DRIVE_READ_MAX_CHARS = int(os.environ.get("DRIVE_READ_MAX_CHARS", 100_000))
+DRIVE_GREP_MAX_MATCHES = int(os.environ.get("DRIVE_GREP_MAX_MATCHES", 200))
+
+class ReadResult:
+    def __init__(self, text: str, truncated: bool, note: str = ""):
+        self.text = text
+        self.truncated = truncated
+        self.note = note
+
+def iter_text(chunks):
+    """Decodes UTF-8 byte chunks incrementally; a character split across chunks is joined up."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def iter_lines(chunks, max_line: int | None = None):
+    """
+    Yields the lines of the decoded text without line endings. A line longer than
+    max_line is yielded in pieces, so one huge line cannot be buffered whole.
+    """
+    max_line = max_line or DRIVE_READ_MAX_CHARS
+    pending = ""
+    for text in iter_text(chunks):
+        lines = (pending + text).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.removesuffix("\r")
+        while len(pending) > max_line:
+            yield pending[:max_line]
+            pending = pending[max_line:]
+    if pending:
+        yield pending.removesuffix("\r")
+
+def read_bytes(chunks, offset: int = 0, length: int | None = None, max_chars: int | None = None) -> ReadResult:
+    """
+    Text of the bytes [offset, offset + length). Partial characters at either edge
+    of the window are dropped instead of failing to decode.
+    """
+    max_chars = max_chars or DRIVE_READ_MAX_CHARS
+    # UTF-8 needs at most 4 bytes per character, so this bounds the bytes kept.
+    length = min(length if length is not None else max_chars, max_chars * 4)
+    end = offset + length
+    position = 0
+    window = bytearray()
+    more = False
+    chunks = iter(chunks)
+    for chunk in chunks:
+        chunk_start, position = position, position + len(chunk)
+        if position <= offset:
+            continue
+        window += chunk[max(0, offset - chunk_start):max(0, end - chunk_start)]
+        if position >= end:
+            more = position > end or next(chunks, None) is not None
+            break
+
+    start = 0
+    while start < min(3, len(window)) and window[start] & 0xC0 == 0x80:
+        start += 1
+    text = codecs.getincrementaldecoder("utf-8")().decode(bytes(window[start:]), final=False)
+    more = more or len(text) > max_chars
+    if not window:
+        return ReadResult("", False, f"The file is shorter than {offset + 1} bytes.")
+    last = offset + len(window) - 1
+    note = f"Showing bytes {offset}-{last}; more bytes follow." if more else f"Showing bytes {offset}-{last} (end of file)."
+    return ReadResult(text[:max_chars], more, note)
+
+def read_lines(chunks, start_line: int = 1, num_lines: int | None = None, max_chars: int | None = None) -> ReadResult:
+    """Lines start_line to start_line + num_lines - 1 (1-based), stopping early at max_chars."""
+    max_chars = max_chars or DRIVE_READ_MAX_CHARS
+    start_line = max(1, start_line)
+    lines, size = [], 0
+    last = start_line - 1
+    for number, line in enumerate(iter_lines(chunks, max_chars), 1):
+        if number < start_line:
+            continue
+        if (num_lines is not None and number >= start_line + num_lines) or (lines and size + len(line) + 1 > max_chars):
+            return ReadResult("\n".join(lines), True, f"Showing lines {start_line}-{last}; more lines follow.")
+        lines.append(line)
+        size += len(line) + 1
+        last = number
+    if last < start_line:
+        return ReadResult("", False, f"The file has fewer than {start_line} lines.")
+    return ReadResult("\n".join(lines), False, f"Showing lines {start_line}-{last} (end of file).")
+
+def compile_query(query: str) -> re.Pattern:
+    """Case-insensitive regular expression, or a plain substring when query is not a valid one."""
+    try:
+        return re.compile(query, re.IGNORECASE)
+    except re.error:
+        return re.compile(re.escape(query), re.IGNORECASE)
+
+def grep_lines(chunks, query: str, context_lines: int = 0, max_matches: int | None = None, max_chars: int | None = None) -> ReadResult:
+    """
+    Lines matching query with context_lines of context around each, numbered like
+    grep -n: 'N: ' for matches, 'N- ' for context and '--' between separate groups.
+    """
+    max_chars = max_chars or DRIVE_READ_MAX_CHARS
+    max_matches = max_matches or DRIVE_GREP_MAX_MATCHES
+    pattern = compile_query(query)
+    context_lines = max(0, context_lines)
+    before = deque(maxlen=context_lines)
+    output, size = [], 0
+    matches, after, last_printed = 0, 0, 0
+
+    def emit(number: int, line: str, marker: str) -> bool:
+        nonlocal size, last_printed
+        entry = f"{number}{marker} {line}"
+        if size + len(entry) + 1 > max_chars:
+            return False
+        if last_printed and number > last_printed + 1:
+            output.append("--")
+        output.append(entry)
+        size += len(entry) + 1
+        last_printed = number
+        return True
+
+    for number, line in enumerate(iter_lines(chunks, max_chars), 1):
+        if pattern.search(line):
+            if matches >= max_matches:
+                return ReadResult("\n".join(output), True, f"Stopped after {matches} matches.")
+            for context_number, context_line in before:
+                if not emit(context_number, context_line, "-"):
+                    return ReadResult("\n".join(output), True, f"Stopped at the {max_chars} character limit.")
+            before.clear()
+            if not emit(number, line, ":"):
+                return ReadResult("\n".join(output), True, f"Stopped at the {max_chars} character limit.")
+            matches += 1
+            after = context_lines
+        elif after:
+            if not emit(number, line, "-"):
+                return ReadResult("\n".join(output), True, f"Stopped at the {max_chars} character limit.")
+            after -= 1
+        else:
+            before.append((number, line))
+    return ReadResult("\n".join(output), False, f"{matches} matching lines.")
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import threading
+
+import google_auth_httplib2
+import httplib2
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+
+from api.cache import TTLCache
+from api.metrics import register_source, timer
+
+GOOGLE_CLIENT_CACHE_SIZE = int(os.environ.get("GOOGLE_CLIENT_CACHE_SIZE", 256))
+GOOGLE_CLIENT_TTL = float(os.environ.get("GOOGLE_CLIENT_TTL", 3600))
+
+SCOPES = {
+    ("sheets", "v4"): ["https://www.googleapis.com/auth/spreadsheets.readonly"],
+    ("drive", "v3"): ["https://www.googleapis.com/auth/drive.readonly"],
+}
+
+class GoogleClient:
+    """
+    A built API service and its service-account credentials, reused across tool calls.
+
+    The credentials refresh their access token on their own when it expires. The
+    service object is shared, but httplib2 connections are not thread-safe, so each
+    worker thread executes requests through its own authorized connection.
+    """
+
+    def __init__(self, service, credentials):
+        self.service = service
+        self.credentials = credentials
+        self._local = threading.local()
+
+    def http(self) -> google_auth_httplib2.AuthorizedHttp:
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def execute(self, request):
+        return request.execute(http=self.http())
+
+google_clients = TTLCache(maxsize=GOOGLE_CLIENT_CACHE_SIZE, ttl=GOOGLE_CLIENT_TTL, name="google_clients")
+register_source("google_clients", google_clients.stats)
+
+_build_lock = threading.Lock()
+
+def parse_settings(settings) -> dict:
+    """Returns the service account info from connector settings, raising ValueError when unusable."""
+    if not settings:
+        raise ValueError("Service account information not found in connector settings.")
+    if isinstance(settings, str):
+        try:
+            settings = json.loads(settings)
+        except json.JSONDecodeError:
+            raise ValueError("The provided settings string is not valid JSON.")
+    return settings
+
+def settings_fingerprint(settings) -> str:
+    canonical = json.dumps(parse_settings(settings), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def get_google_client(settings, api: str, version: str) -> GoogleClient:
+    info = parse_settings(settings)
+    key = (settings_fingerprint(info), api, version)
+    client = google_clients.get(key)
+    if client is not None:
+        return client
+
+    with _build_lock:
+        client = google_clients.get(key)
+        if client is None:
+            with timer(f"google_client.build_{api}_ms"):
+                credentials = service_account.Credentials.from_service_account_info(info, scopes=SCOPES[(api, version)])
+                # The discovery document ships with google-api-python-client; nothing is fetched.
+                service = build(api, version, credentials=credentials, static_discovery=True, cache_discovery=False)
+            client = GoogleClient(service, credentials)
+            google_clients.set(key, client)
+    return client
+
+def evict_google_clients(settings) -> None:
+    """Drops the clients built from a connector's settings, e.g. after it was updated or deleted."""
+    try:
+        fingerprint = settings_fingerprint(settings)
+    except (ValueError, TypeError):
+        return
+    for api, version in SCOPES:
+        google_clients.invalidate((fingerprint, api, version))
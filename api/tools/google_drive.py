@@ -1,55 +1,69 @@
-import io
-import json
+from contextlib import closing
+from typing import Optional
+
 from langchain.agents import tool
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 
+from api.tools.drive_cache import iter_drive_file
+from api.tools.drive_reader import grep_lines, read_bytes, read_lines
+from api.tools.google_client import get_google_client
+
 @tool("read_google_drive_file")
-def read_google_drive(settings: dict, file_id: str) -> str:
+def read_google_drive(
+    settings: dict,
+    file_id: str,
+    query: Optional[str] = None,
+    context_lines: int = 2,
+    start_line: Optional[int] = None,
+    num_lines: Optional[int] = None,
+    offset_bytes: Optional[int] = None,
+    length_bytes: Optional[int] = None,
+) -> str:
     """
     Reads the content of a specific file from Google Drive. 
     This is best for text-based files like .txt, .csv, .md, etc.
+    Large files are returned only up to a size limit; read them in windows or search them.
 
     Args:
         settings (dict): A dictionary containing service account credentials from Google Cloud.
         file_id (str): The unique ID of the Google Drive file to read.
+        query (str, optional): Return only the lines matching this case-insensitive regular expression (or plain text), with line numbers.
+        context_lines (int, optional): Lines of context to show around each matching line. Defaults to 2.
+        start_line (int, optional): First line to return (1-based).
+        num_lines (int, optional): Number of lines to return from start_line.
+        offset_bytes (int, optional): Byte offset to start reading from.
+        length_bytes (int, optional): Number of bytes to read from offset_bytes.
 
     Returns:
-        str: The content of the file as a string.
+        str: The requested content of the file as a string.
     """
     try:
-        creds_info = settings
-        if not creds_info:
-            return "Error: Service account information not found in connector settings."
+        client = get_google_client(settings, "drive", "v3")
+    except ValueError as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
 
-        if isinstance(creds_info, str):
+    try:
+        with closing(iter_drive_file(client, file_id)) as chunks:
             try:
-                creds_info = json.loads(creds_info)
-            except json.JSONDecodeError:
-                return "Error: The provided settings string is not valid JSON."
-
-        scopes = ['https://www.googleapis.com/auth/drive.readonly']
-        creds = service_account.Credentials.from_service_account_info(creds_info, scopes=scopes)
-
-        service = build('drive', 'v3', credentials=creds)
-
-        request = service.files().get_media(fileId=file_id)
-        
-        file_buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_buffer, request)
-        
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-
-        file_buffer.seek(0)
-        try:
-            content = file_buffer.read().decode('utf-8')
-            return f"Content from Google Drive file '{file_id}':\n{content}"
-        except UnicodeDecodeError:
-            return f"Error: Could not decode the file '{file_id}' using UTF-8. It may be a binary file or have a different text encoding."
+                if query:
+                    result = grep_lines(chunks, query, context_lines)
+                    header = f"Lines matching '{query}' in Google Drive file '{file_id}'"
+                elif offset_bytes is not None or length_bytes is not None:
+                    result = read_bytes(chunks, offset_bytes or 0, length_bytes)
+                    header = f"Content from Google Drive file '{file_id}'"
+                elif start_line is not None or num_lines is not None:
+                    result = read_lines(chunks, start_line or 1, num_lines)
+                    header = f"Content from Google Drive file '{file_id}'"
+                else:
+                    result = read_lines(chunks)
+                    if not result.truncated:
+                        return f"Content from Google Drive file '{file_id}':\n{result.text}"
+                    header = f"Content from Google Drive file '{file_id}' (truncated; use start_line/num_lines, offset_bytes/length_bytes or query to read the rest)"
+            except UnicodeDecodeError:
+                return f"Error: Could not decode the file '{file_id}' using UTF-8. It may be a binary file or have a different text encoding."
+        return f"{header}:\n{result.text}\n({result.note})"
 
     except HttpError as err:
         if err.resp.status == 403:
@@ -58,4 +72,4 @@ def read_google_drive(settings: dict, file_id: str) -> str:
             return f"Error: File not found. Please check the file_id '{file_id}'."
         return f"An API error occurred: {err}"
     except Exception as e:
-        return f"An unexpected error occurred: {e}"
\ No newline at end of file
+        return f"An unexpected error occurred: {e}"
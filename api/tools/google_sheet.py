@@ -1,8 +1,12 @@
-import json
 from langchain.agents import tool
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from pydantic import BaseModel, Field
+from typing import Any, List, Literal, Optional
+
+from api.tools.google_client import get_google_client, settings_fingerprint
+from api.tools.sheet_batch import coalesced_get
+from api.tools.sheet_cache import get_range_values, get_ranges_values, normalize_range
+from api.tools.sheet_query import QueryError, format_result, get_table, run_query
 
 @tool("read_google_sheet")
 def read_google_sheet(settings: dict, spreadsheet_id: str, range_name: str) -> str:
@@ -18,28 +22,14 @@ def read_google_sheet(settings: dict, spreadsheet_id: str, range_name: str) -> s
         str: The data from the specified range, formatted as a CSV string.
     """
     try:
-        creds_info = settings
-        if not creds_info:
-            return "Error: Service account information not found in connector settings."
-
-        if isinstance(creds_info, str):
-            try:
-                creds_info = json.loads(creds_info)
-            except json.JSONDecodeError:
-                return "Error: The provided settings string is not valid JSON."
-
-        scopes = ['https://www.googleapis.com/auth/spreadsheets.readonly']
-        creds = service_account.Credentials.from_service_account_info(creds_info, scopes=scopes)
-
-        service = build('sheets', 'v4', credentials=creds)
-
-        sheet = service.spreadsheets()
-        result = sheet.values().get(
-            spreadsheetId=spreadsheet_id,
-            range=range_name
-        ).execute()
-        
-        values = result.get('values', [])
+        client = get_google_client(settings, "sheets", "v4")
+    except ValueError as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+    try:
+        values = _read_range(client, settings, spreadsheet_id, range_name)
 
         if not values:
             return f"No data found in range '{range_name}' of spreadsheet '{spreadsheet_id}'."
@@ -48,10 +38,147 @@ def read_google_sheet(settings: dict, spreadsheet_id: str, range_name: str) -> s
         return f"Data from spreadsheet '{spreadsheet_id}', range '{range_name}':\n{output_string}"
 
     except HttpError as err:
-        if err.resp.status == 403:
-            return f"Error: Permission denied. Make sure the service account has been shared on the Google Sheet '{spreadsheet_id}'."
-        if err.resp.status == 404:
-            return f"Error: Spreadsheet not found. Please check the spreadsheet_id '{spreadsheet_id}'."
-        return f"An API error occurred: {err}"
+        return _http_error_message(err, spreadsheet_id)
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+@tool("read_google_sheet_ranges")
+def read_google_sheet_ranges(settings: dict, spreadsheet_id: str, ranges: List[str]) -> str:
+    """
+    Reads several ranges from one Google Sheet in a single request. Prefer this over
+    repeated read_google_sheet calls when more than one range of the same sheet is needed.
+
+    Args:
+        settings (dict): A dictionary containing service account credentials from Google Cloud.
+        spreadsheet_id (str): The unique ID of the Google Sheet to read from.
+        ranges (list[str]): The ranges to read in A1 notation (e.g., ['Sheet1!A1:B10', 'Totals!A:C']).
+
+    Returns:
+        str: The data of each range, labeled with the range and formatted as CSV.
+    """
+    ranges = list(dict.fromkeys(range_name.strip() for range_name in ranges if range_name.strip()))
+    if not ranges:
+        return "Error: No ranges were given."
+
+    try:
+        client = get_google_client(settings, "sheets", "v4")
+    except ValueError as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+    try:
+        results = get_ranges_values(
+            settings,
+            spreadsheet_id,
+            ranges,
+            lambda missing: coalesced_get(client, (settings_fingerprint(settings), spreadsheet_id), spreadsheet_id, missing)
+        )
+    except HttpError as err:
+        return _http_error_message(err, spreadsheet_id)
     except Exception as e:
-        return f"An unexpected error occurred: {e}"
\ No newline at end of file
+        return f"An unexpected error occurred: {e}"
+
+    sections = []
+    for range_name in ranges:
+        values = results[range_name]
+        if isinstance(values, HttpError):
+            body = f"Error: Could not read this range: {values.reason}"
+        elif not values:
+            body = "No data found."
+        else:
+            body = "\n".join([",".join(map(str, row)) for row in values])
+        sections.append(f"--- Range '{range_name}' ---\n{body}")
+    return f"Data from spreadsheet '{spreadsheet_id}':\n" + "\n".join(sections)
+
+class SheetFilter(BaseModel):
+    column: str = Field(description="Column name from the header row.")
+    op: Literal["==", "!=", ">", ">=", "<", "<=", "contains", "in"] = "=="
+    value: Any = Field(description="Value to compare with; a list for 'in'.")
+
+class SheetAggregate(BaseModel):
+    func: Literal["count", "sum", "mean", "min", "max"]
+    column: Optional[str] = Field(default=None, description="Column to aggregate; omit to count rows.")
+
+@tool("query_google_sheet")
+def query_google_sheet(
+    settings: dict,
+    spreadsheet_id: str,
+    range_name: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[SheetFilter]] = None,
+    group_by: Optional[List[str]] = None,
+    aggregates: Optional[List[SheetAggregate]] = None,
+    sort_by: Optional[str] = None,
+    descending: bool = False,
+    limit: Optional[int] = None,
+    limits: Optional[dict] = None,
+) -> str:
+    """
+    Answers a question about a table in a Google Sheet without reading all of it.
+    The first row of the range must hold the column names. Prefer this over
+    read_google_sheet for large ranges, lookups, totals and rankings.
+
+    Args:
+        settings (dict): A dictionary containing service account credentials from Google Cloud.
+        spreadsheet_id (str): The unique ID of the Google Sheet to read from.
+        range_name (str): The table range in A1 notation, header row included (e.g., 'Sales!A:F').
+        columns (list[str]): Columns to return; all columns when omitted. Ignored with group_by/aggregates.
+        filters (list): Conditions every returned row must meet, e.g. {"column": "Region", "op": "==", "value": "North"}.
+        group_by (list[str]): Columns to group rows by before aggregating.
+        aggregates (list): Aggregates per group (or over all rows), e.g. {"func": "sum", "column": "Sales"}.
+        sort_by (str): Result column to sort by, e.g. 'Sales' or 'sum(Sales)'.
+        descending (bool): Sort from largest to smallest.
+        limit (int): Maximum number of result rows.
+
+    Returns:
+        str: The matching rows as CSV with a header, followed by how many rows matched.
+    """
+    limits = limits or {}
+    try:
+        client = get_google_client(settings, "sheets", "v4")
+    except ValueError as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+    try:
+        values = _read_range(client, settings, spreadsheet_id, range_name)
+        table = get_table((settings_fingerprint(settings), spreadsheet_id, normalize_range(range_name)), values)
+        names, result, matched = run_query(
+            table,
+            columns=columns,
+            filters=filters,
+            group_by=group_by,
+            aggregates=aggregates,
+            sort_by=sort_by,
+            descending=descending,
+            limit=limit,
+            max_rows=limits.get("max_rows"),
+            max_columns=limits.get("max_columns"),
+        )
+        return f"Query result from spreadsheet '{spreadsheet_id}', range '{range_name}':\n{format_result(names, result, matched)}"
+
+    except QueryError as e:
+        return f"Error: {e}"
+    except HttpError as err:
+        return _http_error_message(err, spreadsheet_id)
+    except Exception as e:
+        return f"An unexpected error occurred: {e}"
+
+def _read_range(client, settings, spreadsheet_id: str, range_name: str) -> list:
+    # Concurrent reads of the same spreadsheet from other tool calls share one batchGet.
+    def fetch():
+        values = coalesced_get(client, (settings_fingerprint(settings), spreadsheet_id), spreadsheet_id, [range_name])[range_name]
+        if isinstance(values, Exception):
+            raise values
+        return values
+
+    return get_range_values(settings, spreadsheet_id, range_name, fetch)
+
+def _http_error_message(err: HttpError, spreadsheet_id: str) -> str:
+    if err.resp.status == 403:
+        return f"Error: Permission denied. Make sure the service account has been shared on the Google Sheet '{spreadsheet_id}'."
+    if err.resp.status == 404:
+        return f"Error: Spreadsheet not found. Please check the spreadsheet_id '{spreadsheet_id}'."
+    return f"An API error occurred: {err}"
\ No newline at end of file
@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from api.metrics import register_source, observe
+
+logger = logging.getLogger(__name__)
+
+# How long a read waits for concurrent reads to join its batch when another request
+# to the same spreadsheet is already in flight (0 sends every read on its own); a
+# read of an otherwise idle spreadsheet is sent at once.
+SHEETS_COALESCE_WINDOW = float(os.environ.get("SHEETS_COALESCE_WINDOW_MS", 5)) / 1000
+SHEETS_BATCH_MAX_RANGES = int(os.environ.get("SHEETS_BATCH_MAX_RANGES", 50))
+
+_stats = {"batch_requests": 0, "ranges_requested": 0, "coalesced_calls": 0, "fallback_requests": 0}
+
+register_source("sheet_batches", lambda: {**_stats, "window_ms": SHEETS_COALESCE_WINDOW * 1000})
+
+def batch_get(client, spreadsheet_id: str, ranges: list) -> dict:
+    """
+    Reads several ranges with one values.batchGet and returns {range: values}.
+
+    One bad range fails the whole batch request, so on a 400 each range is read
+    separately and failing ranges map to their HttpError.
+    """
+    _stats["batch_requests"] += 1
+    _stats["ranges_requested"] += len(ranges)
+    observe("sheets.batch_ranges", len(ranges))
+    try:
+        response = client.execute(
+            client.service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id, ranges=ranges)
+        )
+    except HttpError as err:
+        if err.resp.status != 400 or len(ranges) == 1:
+            raise
+        _stats["fallback_requests"] += 1
+        results = {}
+        for range_name in ranges:
+            try:
+                results[range_name] = client.execute(
+                    client.service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_name)
+                ).get("values", [])
+            except HttpError as range_err:
+                results[range_name] = range_err
+        return results
+
+    value_ranges = response.get("valueRanges", [])
+    if len(value_ranges) < len(ranges):
+        logger.warning(f"batchGet returned {len(value_ranges)} of {len(ranges)} ranges; the rest read as empty")
+    results = {range_name: [] for range_name in ranges}
+    results.update((range_name, value_range.get("values", [])) for range_name, value_range in zip(ranges, value_ranges))
+    return results
+
+class _Batch:
+    def __init__(self):
+        self.ranges = []
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+_pending: dict = {}
+# key -> requests currently being sent for that spreadsheet
+_in_flight: dict = {}
+_lock = threading.Lock()
+
+def coalesced_get(client, key, spreadsheet_id: str, ranges: list) -> dict:
+    """
+    Like batch_get, but reads of the same spreadsheet that arrive from other tool
+    threads while a request to it is in flight are merged into one batchGet.
+    """
+    if SHEETS_COALESCE_WINDOW <= 0:
+        return batch_get(client, spreadsheet_id, ranges)
+
+    with _lock:
+        batch = _pending.get(key)
+        leader = batch is None or len(batch.ranges) + len(ranges) > SHEETS_BATCH_MAX_RANGES
+        if leader:
+            batch = _Batch()
+            busy = _in_flight.get(key, 0) > 0
+            if busy:
+                # Other threads are reading this spreadsheet; give them the window to join.
+                _pending[key] = batch
+            else:
+                _in_flight[key] = 1
+        else:
+            _stats["coalesced_calls"] += 1
+        batch.ranges.extend(range_name for range_name in ranges if range_name not in batch.ranges)
+
+    if leader:
+        if busy:
+            time.sleep(SHEETS_COALESCE_WINDOW)
+            with _lock:
+                if _pending.get(key) is batch:
+                    del _pending[key]
+                _in_flight[key] = _in_flight.get(key, 0) + 1
+        try:
+            batch.results = batch_get(client, spreadsheet_id, batch.ranges)
+        except Exception as e:
+            batch.error = e
+        finally:
+            with _lock:
+                _in_flight[key] -= 1
+                if not _in_flight[key]:
+                    del _in_flight[key]
+            batch.done.set()
+    else:
+        batch.done.wait()
+
+    if batch.error is not None:
+        raise batch.error
+    return {range_name: batch.results.get(range_name, []) for range_name in ranges}
@@ -0,0 +1,133 @@
+import logging
+import os
+import re
+import time
+
+from googleapiclient.errors import HttpError
+
+from api.cache import TTLCache
+from api.metrics import register_source
+from api.tools.google_client import get_google_client, settings_fingerprint
+
+logger = logging.getLogger(__name__)
+
+SHEETS_CACHE_TTL = float(os.environ.get("SHEETS_CACHE_TTL", 60))
+SHEETS_CACHE_REVALIDATE = os.environ.get("SHEETS_CACHE_REVALIDATE", "false").lower() == "true"
+SHEETS_CACHE_MAX_AGE = float(os.environ.get("SHEETS_CACHE_MAX_AGE", 3600))
+SHEETS_CACHE_SIZE = int(os.environ.get("SHEETS_CACHE_SIZE", 1000))
+SHEETS_CACHE_MAX_BYTES = int(os.environ.get("SHEETS_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+class SheetRange:
+    def __init__(self, values: list, modified_time, fetched_at: float):
+        self.values = values
+        self.modified_time = modified_time
+        self.fetched_at = fetched_at
+        # The columnar SheetTable of values, once a query has built it (see api/tools/sheet_query.py)
+        self.table = None
+
+def _range_size(entry: SheetRange) -> int:
+    # Approximate: cell text plus per-cell and per-row list overhead.
+    size = sum(64 + sum(49 + len(str(cell)) for cell in row) for row in entry.values)
+    return size + (entry.table.nbytes if entry.table is not None else 0)
+
+# Entries stay fresh for SHEETS_CACHE_TTL; with revalidation they are kept up to
+# SHEETS_CACHE_MAX_AGE and reused after that while the file's modifiedTime is unchanged.
+sheet_ranges = TTLCache(
+    maxsize=SHEETS_CACHE_SIZE,
+    ttl=SHEETS_CACHE_MAX_AGE if SHEETS_CACHE_REVALIDATE else SHEETS_CACHE_TTL,
+    name="sheet_ranges",
+    maxweight=SHEETS_CACHE_MAX_BYTES,
+    weigher=_range_size,
+)
+# One modifiedTime lookup per spreadsheet serves every cached range of it for a TTL.
+_modified_times = TTLCache(maxsize=SHEETS_CACHE_SIZE, ttl=SHEETS_CACHE_TTL, name="sheet_modified_times")
+_stats = {"fetches": 0, "revalidations": 0, "not_modified": 0, "revalidation_errors": 0}
+
+register_source("sheet_cache", lambda: {**sheet_ranges.stats(), **_stats, "revalidate": SHEETS_CACHE_REVALIDATE})
+
+_UNKNOWN = object()
+_CELL_RE = re.compile(r"\$?([A-Za-z]{0,3})\$?(\d*)")
+
+def normalize_range(range_name: str) -> str:
+    """'sheet1'!$a$1:b10 and 'sheet1'!A1:B10 address the same cells."""
+    range_name = range_name.strip()
+    sheet, separator, cells = range_name.rpartition("!")
+    if not separator:
+        sheet, cells = "", range_name
+    if not all(_CELL_RE.fullmatch(part.strip()) for part in cells.split(":")):
+        # Not A1 notation (e.g. a named range); use it as given.
+        return range_name
+    cells = ":".join(
+        "".join(part.upper() for part in _CELL_RE.fullmatch(ref.strip()).groups())
+        for ref in cells.split(":")
+    )
+    return f"{sheet.strip()}!{cells}" if separator else cells
+
+def get_modified_time(settings, spreadsheet_id: str):
+    key = (settings_fingerprint(settings), spreadsheet_id)
+    modified_time = _modified_times.get(key)
+    if modified_time is None:
+        client = get_google_client(settings, "drive", "v3")
+        _stats["revalidations"] += 1
+        try:
+            modified_time = client.execute(
+                client.service.files().get(fileId=spreadsheet_id, fields="modifiedTime", supportsAllDrives=True)
+            ).get("modifiedTime")
+        except HttpError as e:
+            # The service account may lack Drive metadata access; fall back to refetching.
+            _stats["revalidation_errors"] += 1
+            logger.debug(f"Could not read modifiedTime of spreadsheet {spreadsheet_id}: {e}")
+            return None
+        _modified_times.set(key, modified_time)
+    return modified_time
+
+def get_ranges_values(settings, spreadsheet_id: str, ranges: list, fetch_many) -> dict:
+    """
+    Returns {range: values} for several ranges of one spreadsheet. Ranges that are
+    missing, expired, or changed since (with revalidation) are fetched together with
+    a single fetch_many(ranges) call, which may map a range to an exception instead
+    of values; exceptions are returned as they are and not cached.
+    """
+    fingerprint = settings_fingerprint(settings)
+    now = time.monotonic()
+    modified_time = _UNKNOWN
+    results = {}
+    missing = []
+    for range_name in ranges:
+        entry = sheet_ranges.get((fingerprint, spreadsheet_id, normalize_range(range_name)))
+        if entry is not None and now - entry.fetched_at < SHEETS_CACHE_TTL:
+            results[range_name] = entry.values
+            continue
+        if entry is not None and SHEETS_CACHE_REVALIDATE:
+            if modified_time is _UNKNOWN:
+                modified_time = get_modified_time(settings, spreadsheet_id)
+            if modified_time is not None and modified_time == entry.modified_time:
+                _stats["not_modified"] += 1
+                entry.fetched_at = now
+                results[range_name] = entry.values
+                continue
+        missing.append(range_name)
+
+    if missing:
+        if modified_time is _UNKNOWN:
+            modified_time = get_modified_time(settings, spreadsheet_id) if SHEETS_CACHE_REVALIDATE else None
+        _stats["fetches"] += 1
+        fetched = fetch_many(missing)
+        for range_name in missing:
+            values = fetched[range_name]
+            if not isinstance(values, Exception):
+                key = (fingerprint, spreadsheet_id, normalize_range(range_name))
+                sheet_ranges.set(key, SheetRange(values, modified_time, now))
+            results[range_name] = values
+    return results
+
+def get_range_values(settings, spreadsheet_id: str, range_name: str, fetch) -> list:
+    """Single-range form of get_ranges_values; fetch() returns the values of range_name."""
+    values = get_ranges_values(settings, spreadsheet_id, [range_name], lambda missing: {range_name: fetch()})[range_name]
+    if isinstance(values, Exception):
+        raise values
+    return values
+
+def clear() -> None:
+    sheet_ranges.clear()
+    _modified_times.clear()
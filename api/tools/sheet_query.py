@@ -0,0 +1,230 @@
+import os
+
+import numpy as np
+
+from api.metrics import register_source
+from api.tools.sheet_cache import sheet_ranges
+
+SHEETS_QUERY_MAX_ROWS = int(os.environ.get("SHEETS_QUERY_MAX_ROWS", 50))
+SHEETS_QUERY_MAX_COLUMNS = int(os.environ.get("SHEETS_QUERY_MAX_COLUMNS", 20))
+
+FILTER_OPS = ("==", "!=", ">", ">=", "<", "<=", "contains", "in")
+AGGREGATES = ("count", "sum", "mean", "min", "max")
+
+class QueryError(ValueError):
+    pass
+
+class SheetTable:
+    """
+    A sheet range held column by column: the first row names the columns, columns
+    whose non-empty cells are all numbers become float64 (NaN for empty cells),
+    and the others unicode arrays, so filters and aggregates run vectorized. A
+    column with any leading-zero number (an ID or code like "0042") stays text.
+    """
+
+    def __init__(self, values: list):
+        header = [str(name).strip() for name in values[0]] if values else []
+        rows = values[1:]
+        width = max([len(header)] + [len(row) for row in rows])
+        names = []
+        for i in range(width):
+            name = header[i] if i < len(header) and header[i] else f"column_{i + 1}"
+            names.append(name if name not in names else f"{name}_{i + 1}")
+        self.names = names
+        self.index = {name.lower(): i for i, name in enumerate(names)}
+        self.num_rows = len(rows)
+        self.columns = [self._column([row[i] if i < len(row) else "" for row in rows]) for i in range(width)]
+
+    @staticmethod
+    def _column(cells: list) -> np.ndarray:
+        text = np.array([str(cell).strip() for cell in cells], dtype=np.str_)
+        filled = text != ""
+        values = text[filled]
+        leading_zero = np.char.startswith(values, "0") & (np.char.str_len(values) > 1) & ~np.char.startswith(values, "0.")
+        if leading_zero.any():
+            return text
+        try:
+            numbers = np.full(len(text), np.nan)
+            numbers[filled] = np.char.replace(values, ",", "").astype(np.float64)
+            return numbers
+        except ValueError:
+            return text
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns)
+
+    def column(self, name: str) -> np.ndarray:
+        i = self.index.get(str(name).strip().lower())
+        if i is None:
+            raise QueryError(f"Unknown column '{name}'. Available columns: {', '.join(self.names)}.")
+        return self.columns[i]
+
+    def column_name(self, name: str) -> str:
+        self.column(name)
+        return self.names[self.index[str(name).strip().lower()]]
+
+def _as_dict(item) -> dict:
+    return item.model_dump() if hasattr(item, "model_dump") else dict(item)
+
+def _coerce(column: np.ndarray, value):
+    if column.dtype.kind == "f":
+        try:
+            return float(str(value).replace(",", ""))
+        except ValueError:
+            raise QueryError(f"'{value}' is not a number.")
+    return str(value)
+
+def _filter_mask(table: SheetTable, filters: list) -> np.ndarray:
+    mask = np.ones(table.num_rows, dtype=bool)
+    for spec in filters:
+        spec = _as_dict(spec)
+        column, op, value = table.column(spec.get("column")), spec.get("op", "=="), spec.get("value")
+        if op not in FILTER_OPS:
+            raise QueryError(f"Unknown filter operator '{op}'. Use one of: {', '.join(FILTER_OPS)}.")
+        if op == "contains":
+            mask &= np.char.find(np.char.lower(column.astype(np.str_)), str(value).lower()) >= 0
+        elif op == "in":
+            options = value if isinstance(value, list) else [value]
+            mask &= np.isin(column, [_coerce(column, option) for option in options])
+        else:
+            target = _coerce(column, value)
+            if column.dtype.kind != "f" and op not in ("==", "!="):
+                column, target = np.char.lower(column), target.lower()
+            mask &= {
+                "==": np.equal, "!=": np.not_equal, ">": np.greater,
+                ">=": np.greater_equal, "<": np.less, "<=": np.less_equal,
+            }[op](column, target)
+    return mask
+
+def _aggregate(values: np.ndarray, groups: np.ndarray, num_groups: int, func: str) -> np.ndarray:
+    if func == "count":
+        present = values != "" if values.dtype.kind != "f" else ~np.isnan(values)
+        return np.bincount(groups, weights=present.astype(np.float64), minlength=num_groups)
+    if values.dtype.kind != "f":
+        raise QueryError(f"'{func}' needs a numeric column.")
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    if func in ("sum", "mean"):
+        sums = np.bincount(groups, weights=filled, minlength=num_groups)
+        if func == "sum":
+            return sums
+        counts = np.bincount(groups, weights=present.astype(np.float64), minlength=num_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+    result = np.full(num_groups, np.inf if func == "min" else -np.inf)
+    (np.minimum if func == "min" else np.maximum).at(result, groups[present], values[present])
+    result[np.isinf(result)] = np.nan
+    return result
+
+def _sort_order(key: np.ndarray, descending: bool) -> np.ndarray:
+    # Stable in both directions, with empty cells last either way.
+    if key.dtype.kind == "f":
+        missing = np.isnan(key)
+        ranks = np.where(missing, 0.0, key)
+    else:
+        missing = key == ""
+        ranks = np.unique(key, return_inverse=True)[1]
+    return np.lexsort((-ranks if descending else ranks, missing))
+
+def run_query(
+    table: SheetTable,
+    columns: list | None = None,
+    filters: list | None = None,
+    group_by: list | None = None,
+    aggregates: list | None = None,
+    sort_by: str | None = None,
+    descending: bool = False,
+    limit: int | None = None,
+    max_rows: int | None = None,
+    max_columns: int | None = None,
+) -> tuple:
+    """Returns (column names, list of result columns, number of matching rows)."""
+    _stats["queries"] += 1
+    max_rows = SHEETS_QUERY_MAX_ROWS if max_rows is None else max_rows
+    max_columns = SHEETS_QUERY_MAX_COLUMNS if max_columns is None else max_columns
+
+    mask = _filter_mask(table, filters or [])
+    rows = np.flatnonzero(mask)
+
+    if group_by or aggregates:
+        group_by = group_by or []
+        aggregates = [_as_dict(spec) for spec in (aggregates or [{"column": None, "func": "count"}])]
+        codes = np.zeros(len(rows), dtype=np.int64)
+        keys = []
+        for name in group_by:
+            uniques, inverse = np.unique(table.column(name)[rows], return_inverse=True)
+            keys.append(uniques)
+            codes = codes * len(uniques) + inverse
+        if group_by:
+            group_codes, groups = np.unique(codes, return_inverse=True)
+        else:
+            # Aggregates over the whole selection: one result row even when no rows match.
+            group_codes, groups = np.zeros(1, dtype=np.int64), np.zeros(len(rows), dtype=np.int64)
+        num_groups = len(group_codes)
+        names, result = [], []
+        for name, uniques in reversed(list(zip(group_by, keys))):
+            result.insert(0, uniques[group_codes % len(uniques)])
+            names.insert(0, table.column_name(name))
+            group_codes = group_codes // len(uniques)
+        for spec in aggregates:
+            func = spec.get("func", "count")
+            if func not in AGGREGATES:
+                raise QueryError(f"Unknown aggregate '{func}'. Use one of: {', '.join(AGGREGATES)}.")
+            if spec.get("column"):
+                values = table.column(spec["column"])[rows]
+                names.append(f"{func}({table.column_name(spec['column'])})")
+            else:
+                values = np.zeros(len(rows))
+                names.append("count")
+            result.append(_aggregate(values, groups, num_groups, func))
+    else:
+        selected = [table.column_name(name) for name in columns] if columns else list(table.names)
+        names = selected
+        result = [table.column(name)[rows] for name in selected]
+
+    if sort_by:
+        lowered = [name.lower() for name in names]
+        if sort_by.strip().lower() not in lowered:
+            raise QueryError(f"Cannot sort by '{sort_by}'; the result has columns: {', '.join(names)}.")
+        order = _sort_order(result[lowered.index(sort_by.strip().lower())], descending)
+        result = [column[order] for column in result]
+
+    matched = len(result[0]) if result else 0
+    limit = max_rows if limit is None else max(0, min(limit, max_rows))
+    return names[:max_columns], [column[:limit] for column in result[:max_columns]], matched
+
+def _format_cell(value) -> str:
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return ""
+        return str(int(value)) if float(value).is_integer() else f"{value:.6g}"
+    return str(value)
+
+def format_result(names: list, columns: list, matched: int) -> str:
+    lines = [",".join(names)]
+    lines.extend(",".join(_format_cell(value) for value in row) for row in zip(*columns))
+    shown = len(columns[0]) if columns else 0
+    lines.append(f"({shown} of {matched} result rows shown)")
+    return "\n".join(lines)
+
+_stats = {"table_builds": 0, "table_hits": 0, "queries": 0}
+
+register_source("sheet_query", lambda: dict(_stats))
+
+def get_table(key, values: list) -> SheetTable:
+    """
+    Columnar table for a range's values. It is kept on the range's sheet cache
+    entry while that entry still holds these values, so it counts towards
+    SHEETS_CACHE_MAX_BYTES and is evicted with them.
+    """
+    entry = sheet_ranges.peek(key)
+    if entry is not None and entry.values is values and entry.table is not None:
+        _stats["table_hits"] += 1
+        return entry.table
+    table = SheetTable(values)
+    _stats["table_builds"] += 1
+    if entry is not None and entry.values is values:
+        entry.table = table
+        sheet_ranges.reweigh(key)
+    return table
@@ -1,10 +1,155 @@
-from langchain.agents import tool
+from langchain.tools import StructuredTool
 from langchain_community.tools import DuckDuckGoSearchRun
+import asyncio
+import logging
+import os
+import re
+import time
 
-search = DuckDuckGoSearchRun()
+import httpx
 
-@tool("search_web", return_direct=True)
-def search_web(query: str) -> str:
-    """Search the internet using DuckDuckGo."""
-    return search.run(query)
-    
\ No newline at end of file
+from api.cache import TTLCache
+from api.metrics import register_source, observe
+
+logger = logging.getLogger(__name__)
+
+WEB_SEARCH_TIMEOUT = float(os.environ.get("WEB_SEARCH_TIMEOUT", 10))
+WEB_SEARCH_CACHE_TTL = float(os.environ.get("WEB_SEARCH_CACHE_TTL", 900))
+WEB_SEARCH_CACHE_SIZE = int(os.environ.get("WEB_SEARCH_CACHE_SIZE", 1000))
+# Optional search server to query instead of DuckDuckGo, e.g. a local stand-in for benchmarks.
+WEB_SEARCH_URL = os.environ.get("WEB_SEARCH_URL")
+
+class DuckDuckGoBackend:
+    def __init__(self):
+        self.search = DuckDuckGoSearchRun()
+
+    async def search_text(self, query: str) -> str:
+        # duckduckgo_search is blocking; a timed-out call finishes in its thread and is discarded.
+        return await asyncio.to_thread(self.search.run, query)
+
+class HttpSearchBackend:
+    """
+    Queries GET {url}?q=<query>. A JSON response of the form
+    {"results": [{"title": ..., "body": ...}]} is flattened to text; any other
+    response body is used as it is.
+    """
+
+    def __init__(self, url: str, client: httpx.AsyncClient | None = None):
+        self.url = url
+        self.client = client or httpx.AsyncClient(timeout=WEB_SEARCH_TIMEOUT)
+        self._loop = None
+
+    async def search_text(self, query: str) -> str:
+        # The pooled client belongs to the event loop that first used it; a call from
+        # another loop (a sync search_web call) gets a client of its own.
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        if loop is self._loop:
+            response = await self.client.get(self.url, params={"q": query})
+        else:
+            async with httpx.AsyncClient(timeout=WEB_SEARCH_TIMEOUT) as client:
+                response = await client.get(self.url, params={"q": query})
+        response.raise_for_status()
+        if response.headers.get("content-type", "").startswith("application/json"):
+            results = response.json().get("results", [])
+            return " ".join(f"{result.get('title', '')}: {result.get('body', '')}" for result in results)
+        return response.text
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+_backend = None
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        _backend = HttpSearchBackend(WEB_SEARCH_URL) if WEB_SEARCH_URL else DuckDuckGoBackend()
+    return _backend
+
+def set_search_backend(backend) -> None:
+    """Replaces the search backend; anything with an async search_text(query) -> str works."""
+    global _backend
+    _backend = backend
+    search_results.clear()
+
+search_results = TTLCache(maxsize=WEB_SEARCH_CACHE_SIZE, ttl=WEB_SEARCH_CACHE_TTL, name="web_search")
+_in_flight: dict = {}
+_stats = {"searches": 0, "joined": 0, "timeouts": 0, "errors": 0}
+
+register_source("web_search", lambda: {**search_results.stats(), **_stats, "in_flight": len(_in_flight)})
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    return _WHITESPACE_RE.sub(" ", query).strip().lower()
+
+async def _search(key: str, query: str, timeout: float) -> str:
+    _stats["searches"] += 1
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(get_search_backend().search_text(query), timeout)
+        # Cached before leaving _in_flight, so a caller arriving in between finds one or the other.
+        search_results.set(key, result)
+        return result
+    finally:
+        observe("web_search.backend_ms", (time.perf_counter() - start) * 1000)
+        _in_flight.pop(key, None)
+
+async def asearch(query: str, timeout: float | None = None) -> str:
+    """
+    Searches the web, answering repeated queries from the cache. Concurrent
+    identical queries share one backend request, which is abandoned after the
+    timeout; failures are returned as text and not cached.
+    """
+    timeout = WEB_SEARCH_TIMEOUT if timeout is None else timeout
+    key = normalize_query(query)
+    cached = search_results.get(key)
+    if cached is not None:
+        return cached
+
+    task = _in_flight.get(key)
+    if task is not None and task.get_loop() is not asyncio.get_running_loop():
+        # Started by a sync call on another event loop; it cannot be awaited here.
+        task = None
+    if task is None:
+        task = asyncio.ensure_future(_search(key, query, timeout))
+        _in_flight[key] = task
+    else:
+        _stats["joined"] += 1
+    try:
+        # Shielded so that one cancelled caller does not cancel the search for the others.
+        return await asyncio.shield(task)
+    except asyncio.TimeoutError:
+        _stats["timeouts"] += 1
+        return f"Error: The web search for '{query}' did not respond within {timeout:g} seconds."
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.warning(f"Web search failed: {e}")
+        return f"Error: The web search for '{query}' failed: {e}"
+
+def clear() -> None:
+    search_results.clear()
+
+async def close() -> None:
+    """Closes the backend's HTTP connections; called on app shutdown."""
+    close_backend = getattr(_backend, "aclose", None)
+    if close_backend is not None:
+        await close_backend()
+
+async def _search_web(query: str) -> str:
+    return await asearch(query)
+
+def _search_web_sync(query: str) -> str:
+    # For invoke() from code without an event loop, e.g. scripts and sync tool runners.
+    return asyncio.run(asearch(query))
+
+search_web = StructuredTool.from_function(
+    func=_search_web_sync,
+    coroutine=_search_web,
+    name="search_web",
+    description="Search the internet using DuckDuckGo.",
+    return_direct=True,
+)
@@ -0,0 +1,118 @@
+import threading
+
+import numpy as np
+
+def normalize_rows(vectors) -> np.ndarray:
+    """Unit-length float32 rows (zero vectors stay zero); a single vector stays 1-D."""
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores along the last axis, best first, without a full sort."""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        best = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        best = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, best, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(best, order, axis=-1)
+
+class VectorIndex:
+    """
+    Exact cosine search over one contiguous, pre-normalized float32 matrix.
+
+    Rows are stored normalized once on insert, so a query is one matrix-vector
+    product and an argpartition; capacity grows geometrically, and a removed row
+    is filled with the last one so the live rows stay contiguous.
+    """
+
+    def __init__(self, dim: int, capacity: int = 0):
+        self.dim = dim
+        self.matrix = np.zeros((max(capacity, 16), dim), dtype=np.float32)
+        self.ids: list = []
+        self.rows: dict = {}
+        # The saved version (see api/ann_index.py) this index matches, if any
+        self.version = None
+        self.meta: dict = {}
+        # Changes logged against that saved version since it was written
+        self.changes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id) -> bool:
+        return item_id in self.rows
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.matrix[:len(self.ids)]
+
+    def _own_matrix(self, rows: int) -> None:
+        # Makes the matrix writable and at least rows long; a read-only matrix
+        # (one mapped from a saved index) is copied into memory first.
+        if rows <= len(self.matrix) and self.matrix.flags.writeable:
+            return
+        capacity = max(len(self.matrix), 16)
+        while capacity < rows:
+            capacity *= 2
+        grown = np.zeros((capacity, self.dim), dtype=np.float32)
+        grown[:len(self.matrix)] = self.matrix
+        self.matrix = grown
+
+    def add(self, ids: list, vectors) -> None:
+        """Adds or replaces the vectors of the given ids."""
+        vectors = normalize_rows(vectors).reshape(-1, self.dim)
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors.")
+        with self._lock:
+            rows = np.empty(len(ids), dtype=np.int64)
+            for i, item_id in enumerate(ids):
+                row = self.rows.get(item_id)
+                if row is None:
+                    row = len(self.ids)
+                    self.ids.append(item_id)
+                    self.rows[item_id] = row
+                rows[i] = row
+            self._own_matrix(len(self.ids))
+            self.matrix[rows] = vectors
+
+    def remove(self, ids: list) -> int:
+        removed = 0
+        with self._lock:
+            if any(item_id in self.rows for item_id in ids):
+                self._own_matrix(len(self.ids))
+            for item_id in ids:
+                row = self.rows.pop(item_id, None)
+                if row is None:
+                    continue
+                last = len(self.ids) - 1
+                if row != last:
+                    self.matrix[row] = self.matrix[last]
+                    self.ids[row] = self.ids[last]
+                    self.rows[self.ids[row]] = row
+                self.ids.pop()
+                removed += 1
+        return removed
+
+    def search(self, query, k: int = 5) -> list:
+        """[(id, cosine similarity)] of the k nearest vectors, best first."""
+        return self.search_batch(np.asarray(query).reshape(1, -1), k)[0]
+
+    def search_batch(self, queries, k: int = 5) -> list:
+        """search for several queries at once with one matrix-matrix product."""
+        queries = normalize_rows(queries).reshape(-1, self.dim)
+        with self._lock:
+            vectors = self.vectors
+            scores = queries @ vectors.T
+            best = top_k_indices(scores, k)
+            ids = list(self.ids)
+        return [
+            [(ids[i], float(score)) for i, score in zip(row, np.take_along_axis(row_scores, row, axis=-1))]
+            for row, row_scores in zip(best, scores)
+        ]
@@ -0,0 +1,79 @@
+"""
+Recall and latency of the IVF approximate index (api/ann_index.py) against
+exact VectorIndex search, for a range of nprobe values, plus the cost of
+saving the index and loading it back.
+
+    PYTHONPATH=. python benchmarks/ann_search.py --vectors 50000 --dim 1536 --k 5 --nprobe 8 16 32 64
+
+Vectors are drawn around --clusters random centers, which is closer to real
+chunk embeddings than uniform noise (on which no IVF index does well); queries
+are perturbed copies of stored vectors. Recall@k is the share of the exact top k
+that the approximate search also returns.
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from bson import ObjectId
+
+from api.ann_index import IVFIndex, load_index, save_index
+from api.vector_index import VectorIndex
+
+def clustered_vectors(rng, n: int, dim: int, clusters: int, spread: float) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    return centers[rng.integers(clusters, size=n)] + spread * rng.standard_normal((n, dim)).astype(np.float32)
+
+def recall(approximate: list, exact: list) -> float:
+    hits = sum(len({i for i, _ in a} & {i for i, _ in e}) for a, e in zip(approximate, exact))
+    return hits / sum(len(e) for e in exact)
+
+def measure(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--spread", type=float, default=1.0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    matrix = clustered_vectors(rng, args.vectors, args.dim, args.clusters, args.spread)
+    picks = rng.choice(args.vectors, args.queries, replace=False)
+    queries = matrix[picks] + args.spread * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    ids = [ObjectId() for _ in range(args.vectors)]
+
+    exact = VectorIndex(args.dim, capacity=args.vectors)
+    exact.add(ids, matrix)
+    start = time.perf_counter()
+    index = IVFIndex(args.dim, capacity=args.vectors, min_train=1)
+    index.add(ids, matrix)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    truth = exact.search_batch(queries, args.k)
+    exact_ms = measure(lambda: [exact.search(query, args.k) for query in queries], 1) / args.queries
+
+    print(f"{args.vectors} vectors x {args.dim} dims, k={args.k}, {len(index.centroids)} lists "
+          f"(trained and built in {build_ms:.0f} ms)")
+    print(f"  exact VectorIndex.search: {exact_ms:8.2f} ms/query  recall 1.000")
+    for nprobe in args.nprobe:
+        found = index.search_batch(queries, args.k, nprobe)
+        ivf_ms = measure(lambda: [index.search(query, args.k, nprobe) for query in queries], 1) / args.queries
+        print(f"  IVF nprobe={nprobe:<4}          {ivf_ms:8.2f} ms/query  recall {recall(found, truth):.3f}  "
+              f"({exact_ms / ivf_ms:5.1f}x)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        save_ms = measure(lambda: save_index(index, directory), 1)
+        load_ms = measure(lambda: load_index(directory), 1)
+    print(f"  save {save_ms:.0f} ms, load {load_ms:.0f} ms (versus retraining: {build_ms:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Event-loop lag under concurrent /ask-style streams, before and after the async data layer.
+
+Each simulated stream performs the reads an /ask request does before streaming
+(session, agent, agents listing, connectors) and then yields tokens. A ticker
+task measures how late the event loop wakes it up, which is the stall every
+other concurrent stream experiences.
+
+    PYTHONPATH=. python benchmarks/event_loop_lag.py --streams 50
+    PYTHONPATH=. python benchmarks/event_loop_lag.py --streams 50 --simulate-ms 5
+
+--simulate-ms replaces Mongo with a stand-in whose queries block for the given
+time, to model a remote replica set without needing one.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from api.db import sessions_db, agents_db, connectors_db, AsyncCollection
+
+class SlowCollection:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.name = "simulated"
+
+    def find_one(self, *args, **kwargs):
+        time.sleep(self.delay)
+        return None
+
+    def find(self, *args, **kwargs):
+        time.sleep(self.delay)
+        return []
+
+async def ticker(lags: list, stop: asyncio.Event, interval: float = 0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+
+async def sync_stream(collections, tokens: int):
+    sessions, agents, connectors = collections
+    sessions.find_one({"session_id": "benchmark"})
+    agents.find_one({"name": "benchmark"})
+    list(agents.find({"org": "benchmark"}))
+    list(connectors.find({"org": "benchmark"}))
+    for _ in range(tokens):
+        await asyncio.sleep(0)
+
+async def async_stream(collections, tokens: int):
+    sessions, agents, connectors = collections
+    await sessions.find_one({"session_id": "benchmark"})
+    await agents.find_one({"name": "benchmark"})
+    await agents.find({"org": "benchmark"}).to_list()
+    await connectors.find({"org": "benchmark"}).to_list()
+    for _ in range(tokens):
+        await asyncio.sleep(0)
+
+async def run(mode: str, collections, streams: int, tokens: int) -> dict:
+    if mode == "async":
+        collections = [AsyncCollection(c) for c in collections]
+        stream = async_stream
+    else:
+        stream = sync_stream
+
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(0.02)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(stream(collections, tokens) for _ in range(streams)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await tick
+    lags.sort()
+    return {
+        "mode": mode,
+        "wall_ms": elapsed * 1000,
+        "lag_p50_ms": statistics.median(lags) if lags else 0.0,
+        "lag_p99_ms": lags[int(len(lags) * 0.99) - 1] if lags else 0.0,
+        "lag_max_ms": lags[-1] if lags else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--simulate-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.simulate_ms:
+        slow = SlowCollection(args.simulate_ms / 1000)
+        collections = [slow, slow, slow]
+    else:
+        collections = [sessions_db, agents_db, connectors_db]
+
+    for mode in ("sync", "async"):
+        result = asyncio.run(run(mode, collections, args.streams, args.tokens))
+        print(
+            f"{result['mode']:>5}: wall {result['wall_ms']:8.1f} ms | "
+            f"loop lag p50 {result['lag_p50_ms']:6.2f} ms, p99 {result['lag_p99_ms']:7.2f} ms, "
+            f"max {result['lag_max_ms']:7.2f} ms"
+        )
+
+if __name__ == "__main__":
+    main()
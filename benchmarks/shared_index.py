@@ -0,0 +1,81 @@
+"""
+Memory and cold-start cost of several worker processes serving the same agent
+index: each loading a private copy of the saved vectors versus all of them
+mapping the saved file read-only (KNOWLEDGE_INDEX_MMAP).
+
+    PYTHONPATH=. python benchmarks/shared_index.py --workers 4 --vectors 50000 --dim 1536
+
+Each worker is a fresh process that loads the index, runs a few searches (which
+touch every page of the matrix) and reports its load time and memory from
+/proc/self/smaps_rollup (Linux only). PSS charges shared pages to every process
+mapping them in equal parts, so the PSS sum is the memory the workers really use.
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+
+import numpy as np
+from bson import ObjectId
+
+from api.ann_index import load_index, save_index
+from api.vector_index import VectorIndex
+
+def memory_kb() -> dict:
+    with open("/proc/self/smaps_rollup") as f:
+        # The first line is the address range header.
+        fields = dict(line.split(":", 1) for line in f.read().splitlines()[1:])
+    return {name: int(fields[name].split()[0]) for name in ("Rss", "Pss")}
+
+def worker(directory: str, mmap: bool, dim: int, ready, results) -> None:
+    start = time.perf_counter()
+    index = load_index(directory, mmap=mmap)
+    load_ms = (time.perf_counter() - start) * 1000
+    queries = np.random.default_rng(1).standard_normal((8, dim)).astype(np.float32)
+    for query in queries:
+        index.search(query, 5)
+    ready.wait()
+    results.put((load_ms, memory_kb()))
+    ready.wait()
+
+def run(directory: str, mmap: bool, workers: int, dim: int) -> list:
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(workers + 1)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(directory, mmap, dim, ready, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    # Every worker holds its index until all of them have measured, so PSS sees the sharing.
+    ready.wait()
+    reports = [results.get() for _ in processes]
+    ready.wait()
+    for process in processes:
+        process.join()
+    return reports
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    matrix = np.random.default_rng(0).standard_normal((args.vectors, args.dim)).astype(np.float32)
+    index = VectorIndex(args.dim, capacity=args.vectors)
+    index.add([ObjectId() for _ in range(args.vectors)], matrix)
+    del matrix
+    size_mb = args.vectors * args.dim * 4 / 2**20
+
+    with tempfile.TemporaryDirectory() as directory:
+        save_index(index, directory)
+        del index
+        print(f"{args.workers} workers, one agent with {args.vectors} x {args.dim} vectors ({size_mb:.0f} MiB)")
+        for name, mmap in (("private copy", False), ("shared mmap", True)):
+            reports = run(directory, mmap, args.workers, args.dim)
+            load_ms = sum(load for load, _ in reports) / len(reports)
+            rss = sum(memory["Rss"] for _, memory in reports) / 1024
+            pss = sum(memory["Pss"] for _, memory in reports) / 1024
+            print(f"  {name:>12}: load {load_ms:7.1f} ms/worker | RSS sum {rss:7.0f} MiB | PSS sum {pss:7.0f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Top-k retrieval over one agent's chunk vectors: the pairwise `similarity` loop
+versus VectorIndex (one matrix-vector product plus argpartition), for single
+and batched queries.
+
+    PYTHONPATH=. python benchmarks/vector_search.py --vectors 20000 --dim 1536 --k 5
+
+Vectors are random; nothing is read from Mongo or OpenAI. The pairwise baseline
+starts from Python lists of floats, the form `get_embeddings` returns.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from api.embed import similarity
+from api.vector_index import VectorIndex
+
+def pairwise_top_k(vectors: list, query: list, k: int) -> list:
+    scores = [similarity(query, vector) for vector in vectors]
+    return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+
+def measure(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((args.vectors, args.dim)).astype(np.float32)
+    queries = rng.standard_normal((args.batch, args.dim)).astype(np.float32)
+    vectors = matrix.tolist()
+    query = queries[0].tolist()
+
+    index = VectorIndex(args.dim, capacity=args.vectors)
+    start = time.perf_counter()
+    index.add(list(range(args.vectors)), matrix)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    expected = pairwise_top_k(vectors, query, args.k)
+    assert [item_id for item_id, _ in index.search(queries[0], args.k)] == expected
+
+    pairwise_ms = measure(lambda: pairwise_top_k(vectors, query, args.k), max(1, args.repeat // 10))
+    single_ms = measure(lambda: index.search(queries[0], args.k), args.repeat)
+    batch_ms = measure(lambda: index.search_batch(queries, args.k), args.repeat) / args.batch
+
+    print(f"{args.vectors} vectors x {args.dim} dims, k={args.k} (index built in {build_ms:.1f} ms)")
+    print(f"  pairwise similarity loop: {pairwise_ms:10.2f} ms/query")
+    print(f"  VectorIndex.search:       {single_ms:10.2f} ms/query  ({pairwise_ms / single_ms:7.1f}x)")
+    print(f"  VectorIndex.search_batch: {batch_ms:10.2f} ms/query  ({pairwise_ms / batch_ms:7.1f}x, batches of {args.batch})")
+
+if __name__ == "__main__":
+    main()
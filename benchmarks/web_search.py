@@ -0,0 +1,98 @@
+"""
+Web search tool calls against a local stand-in search server: the old blocking
+path (one thread per call, every call hits the server) versus the cached,
+single-flight async path.
+
+    PYTHONPATH=. python benchmarks/web_search.py --calls 200 --distinct 20 --latency-ms 300
+
+Calls are issued concurrently, cycling through --distinct queries, so many of
+them repeat a query that is already cached or in flight. The server counts the
+requests it actually receives.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from api.tools import web
+
+class StandInSearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency: float):
+        super().__init__(("127.0.0.1", 0), SearchHandler)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/search"
+
+class SearchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).get("q", [""])[0]
+        body = json.dumps({"results": [{"title": f"Result {i}", "body": f"About {query}"} for i in range(5)]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def blocking_search(url: str, query: str) -> str:
+    with urllib.request.urlopen(f"{url}?{urllib.parse.urlencode({'q': query})}") as response:
+        return response.read().decode()
+
+async def run_blocking(url: str, queries: list, workers: int) -> None:
+    # The previous tool: a synchronous search per call, run on a bounded tool thread pool.
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        await asyncio.gather(*(loop.run_in_executor(pool, blocking_search, url, query) for query in queries))
+
+async def run_async(url: str, queries: list) -> None:
+    web.set_search_backend(web.HttpSearchBackend(url))
+    await asyncio.gather(*(web.asearch(query) for query in queries))
+
+async def run_async_warm(url: str, queries: list) -> None:
+    # Same calls again with the cache from the previous run still populated.
+    await asyncio.gather(*(web.asearch(query) for query in queries))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--workers", type=int, default=16, help="tool threads for the blocking path")
+    args = parser.parse_args()
+
+    server = StandInSearchServer(args.latency_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    queries = [f"Query number {i % args.distinct}" for i in range(args.calls)]
+
+    for name, run in (
+        ("blocking", lambda: run_blocking(server.url, queries, args.workers)),
+        ("async", lambda: run_async(server.url, queries)),
+        ("async warm", lambda: run_async_warm(server.url, queries)),
+    ):
+        server.requests = 0
+        start = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: wall {elapsed * 1000:8.1f} ms | server requests {server.requests:5d} for {args.calls} calls")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
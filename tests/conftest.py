@@ -0,0 +1,22 @@
+import pytest
+
+from api.auth import user_cache
+from api.agent import agent_bundles
+from api.response_cache import response_cache
+from api import semantic_cache
+from api.tools import web
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Test fixtures write to the database directly, so drop anything cached between tests."""
+    user_cache.clear()
+    agent_bundles.clear()
+    response_cache.clear()
+    semantic_cache.clear()
+    web.clear()
+    yield
+    user_cache.clear()
+    agent_bundles.clear()
+    response_cache.clear()
+    semantic_cache.clear()
+    web.clear()
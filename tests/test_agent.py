@@ -2,6 +2,7 @@ import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, AsyncMock
 from bson import ObjectId
+import json
 import uuid
 
 # Assuming your app and dbs are accessible for testing
@@ -140,6 +141,40 @@ def test_ask_permission_denied_for_other_user_session(test_user_token):
     
     assert resp.status_code == 403
 
+def test_ask_ndjson_stream_sends_agent_first(test_user_token, test_user):
+    """Tests that the ndjson stream announces the agent in-band before the answer tokens."""
+    resp = client.post(
+        "/ask",
+        headers=auth_header(test_user_token),
+        json={"query": "Hello in events", "stream_format": "ndjson"}
+    )
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in resp.text.splitlines()]
+    assert events[0]["type"] == "agent"
+    assert events[0]["agent_name"] == "Mocked Agent"
+    assert events[0]["session_id"] == resp.headers["X-Session-Id"]
+    assert "".join(e["content"] for e in events if e["type"] == "token") == "Mocked Response"
+    assert events[-1]["type"] == "done"
+
+    session_doc = sessions_db.find_one({"session_id": resp.headers["X-Session-Id"]})
+    assert session_doc["chat_history"][0]["assistant"] == "Mocked Response"
+
+def test_ask_ndjson_stream_reports_errors_in_band(test_user_token):
+    """Tests that permission errors arrive as an error event once headers are already sent."""
+    session_id = str(uuid.uuid4())
+    sessions_db.insert_one({"session_id": session_id, "user_id": str(ObjectId()), "chat_history": []})
+
+    resp = client.post(
+        "/ask",
+        headers=auth_header(test_user_token),
+        json={"query": "Trying to access", "session_id": session_id, "stream_format": "ndjson"}
+    )
+
+    events = [json.loads(line) for line in resp.text.splitlines()]
+    assert events == [{"type": "error", "status": 403, "detail": "Permission denied for this session."}]
+
 def test_regenerate_message_success(test_user_token, test_user):
     """Tests that regeneration correctly replaces the last message in the history."""
     session_id = str(uuid.uuid4())
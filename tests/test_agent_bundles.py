@@ -0,0 +1,116 @@
+import pytest
+from fastapi.testclient import TestClient
+from bson import ObjectId
+from langchain_core.messages import AIMessageChunk
+
+from api.main import app, pwd_context
+from api.auth import users_db, orgs_db
+from api.agent import agents_db, connectors_db, get_agent_components, agent_bundles
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def setup_and_teardown_db():
+    users_db.delete_many({})
+    orgs_db.delete_many({})
+    agents_db.delete_many({})
+    connectors_db.delete_many({})
+    yield
+    users_db.delete_many({})
+    orgs_db.delete_many({})
+    agents_db.delete_many({})
+    connectors_db.delete_many({})
+
+@pytest.fixture
+def org_admin_token():
+    org_id = orgs_db.insert_one({"name": "BundleTestCorp"}).inserted_id
+    users_db.insert_one({
+        "username": "bundle_admin",
+        "password": pwd_context.hash("bundlepass"),
+        "permission": "orgadmin",
+        "status": "active",
+        "organization": org_id
+    })
+    resp = client.post("/signin", data={"username": "bundle_admin", "password": "bundlepass"})
+    assert resp.status_code == 200
+    return resp.json()["access_token"], org_id
+
+def auth_header(token):
+    return {"Authorization": f"Bearer {token}"}
+
+class CountingLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def astream(self, messages):
+        self.calls += 1
+        yield AIMessageChunk(content=f"Answer {self.calls}")
+
+async def collect(llm, messages) -> str:
+    return "".join([chunk.content async for chunk in llm.astream(messages)])
+
+def insert_agent(org_id, connector_ids=None, updated_at="2024-01-01T00:00:00", **fields):
+    return str(agents_db.insert_one({
+        **fields,
+        "name": "Bundle Agent",
+        "org": org_id,
+        "model": "gpt-4",
+        "description": "Answers from the bundle sheet.",
+        "tools": [],
+        "connector_ids": connector_ids or [],
+        "updated_at": updated_at,
+    }).inserted_id)
+
+@pytest.mark.asyncio
+async def test_bundle_is_reused_for_same_agent_version(org_admin_token):
+    _, org_id = org_admin_token
+    agent_id = insert_agent(org_id)
+
+    first_llm, _, _, _ = await get_agent_components("hi", org_id, agent_id=agent_id)
+    second_llm, _, _, _ = await get_agent_components("hi again", org_id, agent_id=agent_id)
+
+    assert first_llm is second_llm
+    assert agent_bundles.stats()["hits"] >= 1
+
+@pytest.mark.asyncio
+async def test_bundle_is_rebuilt_when_agent_changes(org_admin_token):
+    _, org_id = org_admin_token
+    agent_id = insert_agent(org_id)
+
+    first_llm, _, _, _ = await get_agent_components("hi", org_id, agent_id=agent_id)
+    agents_db.update_one({"_id": ObjectId(agent_id)}, {"$set": {"updated_at": "2024-02-01T00:00:00"}})
+    second_llm, _, _, _ = await get_agent_components("hi", org_id, agent_id=agent_id)
+
+    assert first_llm is not second_llm
+
+@pytest.mark.asyncio
+async def test_connector_update_invalidates_bundle(org_admin_token):
+    token, org_id = org_admin_token
+    connector_id = connectors_db.insert_one({
+        "name": "Bundle Sheet", "org": org_id, "connector_type": "google_sheet", "settings": {"id": "old"}
+    }).inserted_id
+    agent_id = insert_agent(org_id, connector_ids=[connector_id])
+
+    first_llm, _, _, _ = await get_agent_components("hi", org_id, agent_id=agent_id)
+
+    resp = client.put(f"/connectors/{connector_id}", headers=auth_header(token), json={"settings": {"id": "new"}})
+    assert resp.status_code == 200
+
+    second_llm, _, _, _ = await get_agent_components("hi", org_id, agent_id=agent_id)
+    assert first_llm is not second_llm
+    assert second_llm.tools[0].func.keywords["settings"]["id"] == "new"
+
+@pytest.mark.asyncio
+async def test_regenerate_skips_the_response_cache(org_admin_token, monkeypatch):
+    _, org_id = org_admin_token
+    model = CountingLLM()
+    monkeypatch.setattr("api.agent.get_chat_model", lambda *args, **kwargs: model)
+    agent_id = insert_agent(org_id, temperature=0)
+
+    llm, messages, _, _ = await get_agent_components("When do you open?", org_id, agent_id=agent_id)
+    assert await collect(llm, messages) == "Answer 1"
+    assert await collect(llm, messages) == "Answer 1"
+
+    llm, messages, _, _ = await get_agent_components("When do you open?", org_id, agent_id=agent_id, use_cache=False)
+    assert await collect(llm, messages) == "Answer 2"
+    assert model.calls == 2
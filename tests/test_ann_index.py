@@ -0,0 +1,249 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from bson import ObjectId
+
+from api.ann_index import CHANGE_LOG, IVFIndex, current_version, load_index, log_changes, new_index, save_index
+from api.vector_index import VectorIndex
+
+def clustered_vectors(n: int, dim: int = 32, clusters: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    return (centers[rng.integers(clusters, size=n)] + 0.3 * rng.standard_normal((n, dim))).astype(np.float32)
+
+def recall(approximate: list, exact: list) -> float:
+    hits = sum(len({i for i, _ in a} & {i for i, _ in e}) for a, e in zip(approximate, exact))
+    return hits / sum(len(e) for e in exact)
+
+def test_untrained_index_searches_exactly():
+    vectors = clustered_vectors(100)
+    index = IVFIndex(32, min_train=1000)
+    exact = VectorIndex(32)
+    for target in (index, exact):
+        target.add(list(range(100)), vectors)
+
+    assert not index.trained
+    assert index.search(vectors[3], k=5) == exact.search(vectors[3], k=5)
+
+def test_trained_index_recall_against_exact_search():
+    vectors = clustered_vectors(4000)
+    queries = vectors[:50] + 0.3 * np.random.default_rng(1).standard_normal((50, 32)).astype(np.float32)
+    index = IVFIndex(32, min_train=1000, nprobe=8)
+    exact = VectorIndex(32)
+    for target in (index, exact):
+        target.add(list(range(4000)), vectors)
+
+    assert index.trained and len(index.centroids) == int(np.sqrt(4000))
+    assert recall(index.search_batch(queries, k=10), exact.search_batch(queries, k=10)) > 0.9
+    assert recall(index.search_batch(queries, k=10, nprobe=len(index.centroids)), exact.search_batch(queries, k=10)) == 1.0
+
+def test_inserts_and_deletes_after_training_keep_groups_consistent():
+    vectors = clustered_vectors(1500)
+    index = IVFIndex(32, min_train=1000)
+    index.add(list(range(1000)), vectors[:1000])
+    index.add(list(range(1000, 1500)), vectors[1000:])
+    assert index.trained_count == 1000
+
+    assert index.remove([5, 1499, 700, "missing"]) == 3
+    index.add([1400], vectors[0])
+
+    grouped = sorted(row for bucket in index._buckets for row in bucket)
+    assert grouped == list(range(len(index)))
+    for bucket, rows in enumerate(index._buckets):
+        assert all(index.lists[row] == bucket for row in rows)
+    everything = index.search(vectors[0], k=len(index), nprobe=len(index.centroids))
+    assert {item_id for item_id, _ in everything} == set(range(1500)) - {5, 1499, 700}
+    assert index.search(vectors[1200], k=1, nprobe=len(index.centroids))[0][0] == 1200
+
+def test_saved_index_loads_back_and_replaces_the_previous_version(tmp_path):
+    vectors = clustered_vectors(1200)
+    ids = [ObjectId() for _ in range(1200)]
+    index = IVFIndex(32, min_train=1000)
+    index.add(ids, vectors)
+    first = save_index(index, str(tmp_path), {"watermark": {"count": 1200}})
+
+    loaded = load_index(str(tmp_path))
+
+    assert isinstance(loaded, IVFIndex) and loaded.trained
+    assert loaded.ids == ids
+    np.testing.assert_array_equal(loaded.centroids, index.centroids)
+    assert loaded.search(vectors[10], k=5) == index.search(vectors[10], k=5)
+
+    loaded.remove(ids[:10])
+    second = save_index(loaded, str(tmp_path))
+    assert current_version(str(tmp_path)) == second and not os.path.exists(first)
+    assert len(load_index(str(tmp_path))) == 1190
+
+def test_concurrent_saves_leave_only_the_current_version(tmp_path):
+    index = new_index("flat", 8)
+    index.add([ObjectId() for _ in range(4)], np.eye(4, 8))
+    # Left behind by a save that died before replacing CURRENT.
+    os.makedirs(tmp_path / "v-orphan")
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: save_index(index, str(tmp_path)), range(16)))
+
+    versions = [name for name in os.listdir(tmp_path) if name.startswith("v-")]
+    assert versions == [os.path.basename(current_version(str(tmp_path)))]
+    assert len(load_index(str(tmp_path))) == 4
+
+def test_flat_index_round_trip_and_missing_index(tmp_path):
+    assert load_index(str(tmp_path / "none")) is None
+    index = new_index("flat", 8)
+    index.add([ObjectId(), ObjectId()], np.eye(2, 8))
+    save_index(index, str(tmp_path))
+
+    loaded = load_index(str(tmp_path))
+    assert type(loaded) is VectorIndex and loaded.ids == index.ids
+
+def test_mapped_index_keeps_changes_next_to_the_shared_vectors(tmp_path):
+    vectors = clustered_vectors(1200)
+    ids = [ObjectId() for _ in range(1200)]
+    index = IVFIndex(32, min_train=1000)
+    index.add(ids, vectors)
+    save_index(index, str(tmp_path))
+
+    mapped = load_index(str(tmp_path), mmap=True)
+    assert isinstance(mapped.matrix, np.memmap) and not mapped.matrix.flags.writeable
+    assert mapped.search(vectors[10], k=5) == index.search(vectors[10], k=5)
+
+    added = ObjectId()
+    assert mapped.remove(ids[:1]) == 1
+    mapped.add([added, ids[1]], vectors[:2])
+    assert isinstance(mapped.matrix, np.memmap)
+    assert len(mapped) == 1200 and ids[0] not in mapped and added in mapped
+    assert mapped.search(vectors[0], k=1, nprobe=len(index.centroids))[0][0] == added
+    assert ids[0] not in [item_id for item_id, _ in mapped.search(vectors[0], k=50)]
+
+    materialized = mapped.materialize()
+    assert isinstance(materialized, IVFIndex) and sorted(materialized.ids) == sorted(mapped.ids)
+    assert load_index(str(tmp_path), mmap=True).ids == ids
+
+def test_logged_changes_are_replayed_on_load(tmp_path):
+    vectors = clustered_vectors(20, dim=8)
+    ids = [ObjectId() for _ in range(20)]
+    index = new_index("flat", 8)
+    index.add(ids[:18], vectors[:18])
+    version = save_index(index, str(tmp_path), {"watermark": {"count": 18}})
+
+    mapped = load_index(str(tmp_path), mmap=True)
+    mapped.remove(ids[:3])
+    mapped.add(ids[18:], vectors[18:])
+    assert log_changes(mapped, str(tmp_path), removed_ids=ids[:3])
+    assert log_changes(mapped, str(tmp_path), ids[18:], vectors[18:], meta={"watermark": {"count": 17}})
+    # A record cut short by a crash is ignored.
+    with open(os.path.join(version, CHANGE_LOG), "ab") as f:
+        f.write(b"a\x05\x00")
+
+    for loaded in (load_index(str(tmp_path)), load_index(str(tmp_path), mmap=True)):
+        assert sorted(loaded.ids) == sorted(ids[3:])
+        assert loaded.changes == 5 and loaded.meta["watermark"] == {"count": 17}
+        assert loaded.search(vectors[19], k=1)[0][0] == ids[19]
+    assert current_version(str(tmp_path)) == version
+
+    save_index(load_index(str(tmp_path)), str(tmp_path))
+    assert not log_changes(mapped, str(tmp_path), removed_ids=ids[3:4])
+
+def test_knowledge_index_is_saved_topped_up_and_pruned(tmp_path, monkeypatch):
+    from api import embed
+    monkeypatch.setattr(embed, "KNOWLEDGE_INDEX_DIR", str(tmp_path))
+    user_id, agent_id = ObjectId(), ObjectId()
+    first = embed.save_embedding([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], user_id, agent_id)
+    try:
+        assert len(embed.get_knowledge_index(user_id, agent_id)) == 2
+        embed.invalidate_knowledge_index(user_id, agent_id)
+        embed.save_embedding([[0.0, 0.0, 1.0]], user_id, agent_id)
+
+        # Loaded from disk plus the chunk inserted while it was not cached.
+        assert embed.search_embeddings(user_id, agent_id, [0.0, 0.1, 1.0], k=1)[0][1] > 0.99
+        assert load_index(embed.knowledge_index_dir(user_id, agent_id)).ids == embed.get_knowledge_index(user_id, agent_id).ids
+
+        assert embed.delete_knowledge_source(user_id, agent_id, first) == 2
+        assert len(embed.search_embeddings(user_id, agent_id, [1.0, 0.0, 0.0], k=10)) == 1
+        assert len(load_index(embed.knowledge_index_dir(user_id, agent_id))) == 1
+    finally:
+        embed.knowledge_db.embeddings.delete_many({"user_id": user_id})
+
+def test_saved_index_catches_up_with_out_of_order_changes(tmp_path, monkeypatch):
+    from api import embed
+    monkeypatch.setattr(embed, "KNOWLEDGE_INDEX_DIR", str(tmp_path))
+    user_id, agent_id = ObjectId(), ObjectId()
+    first = embed.save_embedding([[1.0, 0.0, 0.0]], user_id, agent_id)
+    try:
+        assert len(embed.get_knowledge_index(user_id, agent_id)) == 1
+        embed.invalidate_knowledge_index(user_id, agent_id)
+
+        # One chunk deleted and one stored elsewhere with an older id: the count is unchanged.
+        embed.knowledge_db.embeddings.delete_many({"source_id": first})
+        documents = embed.chunk_documents([[0.0, 1.0, 0.0]], user_id, agent_id)
+        documents[0]["_id"] = ObjectId.from_datetime(datetime(2000, 1, 1))
+        embed.knowledge_db.embeddings.insert_many(documents)
+
+        index = embed.get_knowledge_index(user_id, agent_id)
+        assert index.ids == [documents[0]["_id"]]
+        assert load_index(embed.knowledge_index_dir(user_id, agent_id)).ids == index.ids
+    finally:
+        embed.knowledge_db.embeddings.delete_many({"user_id": user_id})
+
+def test_delete_without_a_loaded_index_discards_the_saved_one(tmp_path, monkeypatch):
+    from api import embed
+    monkeypatch.setattr(embed, "KNOWLEDGE_INDEX_DIR", str(tmp_path))
+    user_id, agent_id = ObjectId(), ObjectId()
+    first = embed.save_embedding([[1.0, 0.0, 0.0]], user_id, agent_id)
+    embed.save_embedding([[0.0, 1.0, 0.0]], user_id, agent_id)
+    try:
+        assert len(embed.get_knowledge_index(user_id, agent_id)) == 2
+        embed.invalidate_knowledge_index(user_id, agent_id)
+
+        assert embed.delete_knowledge_source(user_id, agent_id, first) == 1
+
+        assert load_index(embed.knowledge_index_dir(user_id, agent_id)) is None
+        assert len(embed.search_embeddings(user_id, agent_id, [1.0, 0.0, 0.0], k=10)) == 1
+    finally:
+        embed.knowledge_db.embeddings.delete_many({"user_id": user_id})
+
+def test_inserts_are_logged_until_the_index_is_compacted(tmp_path, monkeypatch):
+    from api import embed
+    monkeypatch.setattr(embed, "KNOWLEDGE_INDEX_DIR", str(tmp_path))
+    user_id, agent_id = ObjectId(), ObjectId()
+    embed.save_embedding(np.eye(8, 4).tolist(), user_id, agent_id)
+    try:
+        version = embed.get_knowledge_index(user_id, agent_id).version
+        embed.save_embedding([[1.0, 1.0, 0.0, 0.0]], user_id, agent_id)
+
+        index = embed.get_knowledge_index(user_id, agent_id)
+        assert index.version == version and index.changes == 1 and len(index) == 9
+        embed.invalidate_knowledge_index(user_id, agent_id)
+        reloaded = embed.get_knowledge_index(user_id, agent_id)
+        assert reloaded.version == version and sorted(reloaded.ids) == sorted(index.ids)
+
+        embed.save_embedding(np.ones((2, 4)).tolist(), user_id, agent_id)
+        compacted = embed.get_knowledge_index(user_id, agent_id)
+        assert compacted.version != version and compacted.changes == 0 and len(compacted) == 11
+    finally:
+        embed.knowledge_db.embeddings.delete_many({"user_id": user_id})
+
+def test_workers_map_the_newest_saved_version(tmp_path, monkeypatch):
+    from api import embed
+    monkeypatch.setattr(embed, "KNOWLEDGE_INDEX_DIR", str(tmp_path))
+    user_id, agent_id = ObjectId(), ObjectId()
+    embed.save_embedding([[1.0, 0.0, 0.0]], user_id, agent_id)
+    try:
+        index = embed.get_knowledge_index(user_id, agent_id)
+        assert isinstance(index.matrix, np.memmap)
+
+        # Another worker stores a chunk and saves the next version.
+        documents = embed.chunk_documents([[0.0, 1.0, 0.0]], user_id, agent_id)
+        embed.knowledge_db.embeddings.insert_many(documents)
+        other = load_index(embed.knowledge_index_dir(user_id, agent_id))
+        other.add([documents[0]["_id"]], np.array([[0.0, 1.0, 0.0]]))
+        watermark = embed._watermark({"user_id": user_id, "agent_id": agent_id})
+        save_index(other, embed.knowledge_index_dir(user_id, agent_id), {"watermark": watermark})
+
+        current = embed.get_knowledge_index(user_id, agent_id)
+        assert current is not index and current.version == other.version
+        assert isinstance(current.matrix, np.memmap) and len(current) == 2
+    finally:
+        embed.knowledge_db.embeddings.delete_many({"user_id": user_id})
@@ -134,12 +134,18 @@ async def test_agent_logic_with_connector(org_admin_token):
         agent_id=agent_id
     )
 
-    assert "tools" in llm.model_kwargs
-    configured_tools = llm.model_kwargs["tools"]
-    assert len(configured_tools) == 1
+    configured_tools = llm.tools
+    assert [t.name for t in configured_tools] == [
+        "read_google_sheet_logic_test_sheet",
+        "read_google_sheet_ranges_logic_test_sheet",
+        "query_google_sheet_logic_test_sheet",
+    ]
     
     configured_tool = configured_tools[0]
-    assert configured_tool.name == "read_google_sheet_logic_test_sheet"
     assert isinstance(configured_tool.func, partial)
     assert configured_tool.func.keywords["settings"]["credentials"] == "fake_creds_for_logic_test"
 
+    tool_schema = llm.llm.model_kwargs["tools"][0]["function"]
+    assert tool_schema["name"] == "read_google_sheet_logic_test_sheet"
+    assert set(tool_schema["parameters"]["properties"]) == {"spreadsheet_id", "range_name"}
+
@@ -0,0 +1,42 @@
+import pytest
+
+from api.auth import users_db, orgs_db
+from api.agent import sessions_db, agents_db, connectors_db
+from api.embed import knowledge_db
+from api.db import client, pool_stats, async_sessions_db
+from api.indexes import ensure_indexes, explain_query_shapes
+
+def test_collections_share_one_client():
+    """Tests that every module uses the collections of the shared client."""
+    for collection in [users_db, orgs_db, sessions_db, agents_db, connectors_db, knowledge_db]:
+        assert collection.database.client is client
+
+def test_pool_stats_track_checkouts():
+    """Tests that pool statistics reflect connections used by queries."""
+    before = pool_stats.stats()["checkouts"]
+    users_db.find_one({"username": "pool_stats_probe"})
+    stats = pool_stats.stats()
+    assert stats["checkouts"] > before
+    assert stats["open_connections"] >= 1
+    assert stats["in_use"] == 0
+
+@pytest.mark.asyncio
+async def test_async_collection_reads_and_writes():
+    """Tests that the async wrappers round-trip documents through the shared pool."""
+    sessions_db.delete_many({"session_id": "async_db_probe"})
+    await async_sessions_db.insert_one({"session_id": "async_db_probe", "user_id": "u1"})
+
+    session = await async_sessions_db.find_one({"session_id": "async_db_probe"})
+    assert session["user_id"] == "u1"
+
+    sessions = await async_sessions_db.find({"user_id": "u1"}).to_list()
+    assert any(s["session_id"] == "async_db_probe" for s in sessions)
+
+    sessions_db.delete_many({"session_id": "async_db_probe"})
+
+def test_registered_indexes_cover_hot_queries():
+    """Tests that no registered query shape falls back to a collection scan."""
+    ensure_indexes()
+    report = explain_query_shapes()
+    scans = [entry for entry in report if entry["collection_scan"]]
+    assert scans == []
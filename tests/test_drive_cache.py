@@ -0,0 +1,224 @@
+import pytest
+import hashlib
+import mmap
+import os
+
+import httplib2
+
+from api.tools import drive_cache
+from api.tools.drive_cache import DriveFileCache, content_key, iter_drive_file, open_cached_file
+
+class FakeMediaHttp:
+    """Serves ranged GETs of one file the way Drive's media endpoint does."""
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.requests = 0
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        self.requests += 1
+        start, end = (int(n) for n in headers["range"].split("=")[1].split("-"))
+        chunk = self.content[start:end + 1]
+        response = httplib2.Response({
+            "status": 206,
+            "content-range": f"bytes {start}-{start + len(chunk) - 1}/{len(self.content)}",
+        })
+        return response, chunk
+
+class FakeRequest:
+    def __init__(self, result=None, http=None):
+        self.result = result
+        self.uri = "https://www.googleapis.com/drive/v3/files/file-1?alt=media"
+        self.headers = {}
+        self.http = http
+
+    def execute(self, http=None):
+        return self.result
+
+class FakeFiles:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def get(self, fileId, fields, supportsAllDrives):
+        self.drive.metadata_calls += 1
+        return FakeRequest(self.drive.metadata)
+
+    def get_media(self, fileId, supportsAllDrives):
+        self.drive.downloads += 1
+        return FakeRequest()
+
+class FakeDriveClient:
+    def __init__(self, content: bytes, modified_time: str = "2026-01-01T00:00:00.000Z"):
+        self.media = FakeMediaHttp(content)
+        self.metadata_calls = 0
+        self.downloads = 0
+        self.set_content(content, modified_time)
+        self.service = self
+
+    def set_content(self, content: bytes, modified_time: str):
+        self.media.content = content
+        self.metadata = {
+            "id": "file-1",
+            "md5Checksum": hashlib.md5(content).hexdigest(),
+            "modifiedTime": modified_time,
+            "size": str(len(content)),
+        }
+
+    def files(self):
+        return FakeFiles(self)
+
+    def http(self):
+        return self.media
+
+    def execute(self, request):
+        return request.execute()
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = DriveFileCache(str(tmp_path), max_bytes=1024)
+    monkeypatch.setattr(drive_cache, "drive_cache", cache)
+    return cache
+
+def test_content_key_prefers_md5_and_falls_back_to_modified_time():
+    assert content_key("a", {"md5Checksum": "abc", "modifiedTime": "t1"}) == "md5-abc"
+    assert content_key("a", {"md5Checksum": "abc"}) == content_key("b", {"md5Checksum": "abc"})
+    assert content_key("a", {"modifiedTime": "t1"}) != content_key("a", {"modifiedTime": "t2"})
+    assert content_key("a", {"modifiedTime": "t1"}) != content_key("b", {"modifiedTime": "t1"})
+
+def read_file(client, chunk_size=None) -> bytes:
+    return b"".join(iter_drive_file(client, "file-1", chunk_size))
+
+def test_repeat_reads_only_fetch_metadata(cache):
+    client = FakeDriveClient(b"name,total\nwidgets,3\n")
+
+    assert read_file(client) == b"name,total\nwidgets,3\n"
+    assert read_file(client) == b"name,total\nwidgets,3\n"
+    assert client.downloads == 1
+    assert client.metadata_calls == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["files"] == 1
+
+def test_changed_file_is_downloaded_again(cache):
+    client = FakeDriveClient(b"version one")
+    read_file(client)
+
+    client.set_content(b"version two", "2026-02-01T00:00:00.000Z")
+
+    assert read_file(client) == b"version two"
+    assert client.downloads == 2
+
+def test_download_is_streamed_in_chunks(cache):
+    client = FakeDriveClient(b"0123456789" * 10)
+
+    chunks = list(iter_drive_file(client, "file-1", 32))
+
+    assert [len(chunk) for chunk in chunks] == [32, 32, 32, 4]
+    assert client.media.requests == 4
+    assert [len(chunk) for chunk in iter_drive_file(client, "file-1", 32)] == [32, 32, 32, 4]
+
+def test_download_stopped_early_is_finished_into_the_cache(cache):
+    client = FakeDriveClient(b"0123456789" * 10)
+
+    chunks = iter_drive_file(client, "file-1", 32)
+    next(chunks)
+    chunks.close()
+
+    # The next read waits for the background download instead of starting another.
+    assert read_file(client) == b"0123456789" * 10
+    assert client.downloads == 1
+    assert client.media.requests == 4
+    assert cache.stats()["hits"] == 1
+
+def test_download_larger_than_the_cache_is_not_finished(cache):
+    client = FakeDriveClient(b"x" * 2048)
+
+    chunks = iter_drive_file(client, "file-1", 32)
+    next(chunks)
+    chunks.close()
+
+    assert os.listdir(cache.directory) == []
+    assert client.media.requests == 1
+
+def test_truncated_tool_read_of_a_large_file_caches_it(cache, monkeypatch):
+    from api.tools import drive_reader, google_drive
+    cache.max_bytes = 1024 * 1024
+    content = b"".join(f"{i},row\n".encode() for i in range(20000))
+    client = FakeDriveClient(content)
+    monkeypatch.setattr(google_drive, "get_google_client", lambda settings, api, version: client)
+    monkeypatch.setattr(drive_reader, "DRIVE_READ_MAX_CHARS", 100)
+    monkeypatch.setattr(drive_cache, "DRIVE_DOWNLOAD_CHUNK_SIZE", 4096)
+
+    assert "truncated" in google_drive.read_google_drive.func({}, "file-1").lower()
+    google_drive.read_google_drive.func({}, "file-1", start_line=19999, num_lines=1)
+
+    assert client.downloads == 1
+    assert client.media.requests == -(-len(content) // 4096)
+    assert cache.stats()["hits"] == 1
+    assert os.path.getsize(cache.path(content_key("file-1", client.metadata))) == len(content)
+
+def test_least_recently_used_files_are_evicted(cache):
+    write = lambda data: (lambda f: f.write(data))
+    cache.put("a", write(b"a" * 400))
+    cache.put("b", write(b"b" * 400))
+    cache.get("a")
+    cache.put("c", write(b"c" * 400))
+
+    assert cache.get("b") is None
+    assert not os.path.exists(cache.path("b"))
+    assert cache.get("a") is not None
+    assert cache.total_bytes == 800
+    assert cache.evictions == 1
+
+def test_workers_share_hits_and_one_byte_budget(cache):
+    other_worker = DriveFileCache(cache.directory, max_bytes=1024)
+    write = lambda data: (lambda f: f.write(data))
+    other_worker.put("a", write(b"a" * 400))
+    cache.put("b", write(b"b" * 400))
+
+    assert cache.get("a") == cache.path("a")
+    other_worker.put("c", write(b"c" * 400))
+
+    assert sorted(os.listdir(cache.directory)) == ["a", "c"]
+    assert cache.total_bytes == other_worker.total_bytes == 800
+
+def test_failed_download_leaves_nothing_behind(cache):
+    def write(f):
+        f.write(b"partial")
+        raise OSError("connection reset")
+
+    with pytest.raises(OSError):
+        cache.put("a", write)
+
+    assert os.listdir(cache.directory) == []
+    assert cache.get("a") is None
+
+def test_existing_files_are_picked_up_on_restart(cache):
+    cache.put("a", lambda f: f.write(b"cached"))
+
+    restarted = DriveFileCache(cache.directory, max_bytes=1024)
+
+    assert restarted.get("a") == cache.path("a")
+    assert restarted.total_bytes == 6
+
+def test_large_files_are_memory_mapped(tmp_path, monkeypatch):
+    small, large = tmp_path / "small", tmp_path / "large"
+    small.write_bytes(b"x" * 10)
+    large.write_bytes("é".encode("utf-8") * 100)
+    monkeypatch.setattr(drive_cache, "DRIVE_CACHE_MMAP_THRESHOLD", 100)
+
+    with open_cached_file(str(small)) as data:
+        assert isinstance(data, bytes)
+    with open_cached_file(str(large)) as data:
+        assert isinstance(data, mmap.mmap)
+        assert str(data, "utf-8") == "é" * 100
+
+def test_read_google_drive_tool_modes(cache, monkeypatch):
+    from api.tools import google_drive
+    client = FakeDriveClient(b"id,status\n1,ok\n2,failed\n3,ok\n")
+    monkeypatch.setattr(google_drive, "get_google_client", lambda settings, api, version: client)
+    read = google_drive.read_google_drive.func
+
+    assert read({}, "file-1") == "Content from Google Drive file 'file-1':\nid,status\n1,ok\n2,failed\n3,ok"
+    assert read({}, "file-1", query="failed", context_lines=0).endswith("3: 2,failed\n(1 matching lines.)")
+    assert "\n2,failed\n(Showing lines 3-3; more lines follow.)" in read({}, "file-1", start_line=3, num_lines=1)
+    assert client.downloads == 1
@@ -0,0 +1,83 @@
+import pytest
+
+from api.tools.drive_reader import grep_lines, iter_lines, read_bytes, read_lines
+
+def chunked(data: bytes, size: int) -> list:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+LOG = "".join(f"line {i}{' ERROR disk full' if i in (5, 6, 20) else ''}\n" for i in range(1, 31)).encode("utf-8")
+
+def test_characters_split_across_chunks_are_decoded():
+    text = "naïve café – 日本語\r\nsecond line"
+    lines = list(iter_lines(chunked(text.encode("utf-8"), 1)))
+
+    assert lines == ["naïve café – 日本語", "second line"]
+
+def test_very_long_lines_are_split():
+    assert list(iter_lines([b"x" * 25], max_line=10)) == ["x" * 10, "x" * 10, "x" * 5]
+
+def test_invalid_utf8_raises():
+    with pytest.raises(UnicodeDecodeError):
+        list(iter_lines([b"\xff\xfe binary"]))
+
+def test_line_window():
+    result = read_lines(chunked(LOG, 7), start_line=3, num_lines=2)
+
+    assert result.text == "line 3\nline 4"
+    assert result.truncated
+    assert result.note == "Showing lines 3-4; more lines follow."
+
+def test_line_window_past_end():
+    assert read_lines(chunked(LOG, 7), start_line=29, num_lines=5).text == "line 29\nline 30"
+    assert read_lines(chunked(LOG, 7), start_line=40).note == "The file has fewer than 40 lines."
+
+def test_line_read_stops_at_character_cap():
+    consumed = []
+
+    def chunks():
+        for chunk in chunked(LOG, 8):
+            consumed.append(chunk)
+            yield chunk
+
+    result = read_lines(chunks(), max_chars=20)
+
+    assert result.text == "line 1\nline 2"
+    assert result.truncated
+    assert len(consumed) < len(chunked(LOG, 8))
+
+def test_byte_window_drops_partial_characters():
+    data = "aé日b".encode("utf-8")
+
+    assert read_bytes(chunked(data, 2), offset=2, length=4).text == "日"
+    assert read_bytes(chunked(data, 2), offset=0, length=4).text == "aé"
+
+def test_byte_window_reports_remaining_bytes():
+    result = read_bytes(chunked(b"0123456789", 3), offset=2, length=5)
+
+    assert result.text == "23456"
+    assert result.note == "Showing bytes 2-6; more bytes follow."
+    assert read_bytes(chunked(b"0123456789", 3), offset=7).note == "Showing bytes 7-9 (end of file)."
+
+def test_grep_with_context():
+    result = grep_lines(chunked(LOG, 5), "error", context_lines=1)
+
+    assert result.text.split("\n") == [
+        "4- line 4",
+        "5: line 5 ERROR disk full",
+        "6: line 6 ERROR disk full",
+        "7- line 7",
+        "--",
+        "19- line 19",
+        "20: line 20 ERROR disk full",
+        "21- line 21",
+    ]
+    assert result.note == "3 matching lines."
+
+def test_grep_invalid_regex_is_plain_text():
+    assert grep_lines([b"cost (usd)\nother\n"], "(usd").text == "1: cost (usd)"
+
+def test_grep_stops_at_match_limit():
+    result = grep_lines(chunked(LOG, 5), "line", max_matches=2)
+
+    assert result.text == "1: line 1\n2: line 2"
+    assert result.note == "Stopped after 2 matches."
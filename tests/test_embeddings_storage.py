@@ -0,0 +1,74 @@
+import numpy as np
+from bson import BSON, ObjectId
+
+from api.embed import chunk_documents, knowledge_db, save_embedding, pack_vector, split_chunks, unpack_vector, get_embeddings, get_embedding_matrix, _iter_vectors
+
+def test_vectors_round_trip_as_packed_float32():
+    vector = [0.25, -1.5, 3.0]
+
+    packed = pack_vector(vector)
+    unpacked = unpack_vector(packed)
+
+    assert len(packed) == 12
+    assert unpacked.dtype == np.float32
+    assert unpacked.tolist() == vector
+
+def test_packed_vector_is_over_three_times_smaller_in_bson():
+    vector = np.random.default_rng(0).standard_normal(1536).tolist()
+
+    as_doubles = len(BSON.encode({"embeddings": vector}))
+    as_binary = len(BSON.encode({"vector": pack_vector(vector)}))
+
+    # Each array element carries a type byte and its index as a key besides the 8-byte double.
+    assert as_doubles / as_binary > 3
+
+def test_chunks_keep_their_text_offsets():
+    text = "First paragraph about invoices.\n\nSecond paragraph about refunds.\n\nThird paragraph."
+
+    chunks = split_chunks(text, chunk_size=40, overlap=0)
+
+    assert len(chunks) == 3
+    for chunk in chunks:
+        assert text[chunk["start"]:chunk["end"]] == chunk["text"]
+
+def test_chunk_documents_one_per_vector():
+    user_id, agent_id = ObjectId(), ObjectId()
+    chunks = [{"text": "a", "start": 0, "end": 1}, {"text": "b", "start": 2, "end": 3}]
+
+    documents = chunk_documents([[1.0, 0.0], [0.0, 1.0]], user_id, agent_id, chunks)
+
+    assert [document["chunk"] for document in documents] == [0, 1]
+    assert len({document["source_id"] for document in documents}) == 1
+    assert documents[1]["text"] == "b" and documents[1]["dim"] == 2
+    assert unpack_vector(documents[1]["vector"]).tolist() == [0.0, 1.0]
+
+def test_nothing_to_store_returns_no_source():
+    assert save_embedding([], ObjectId(), ObjectId()) is None
+
+def test_legacy_documents_are_still_readable():
+    legacy = {"_id": ObjectId(), "embeddings": [[1.0, 2.0], [3.0, 4.0]]}
+    chunk = {"_id": ObjectId(), "vector": pack_vector([5.0, 6.0])}
+
+    ids, vectors = zip(*_iter_vectors([legacy, chunk]))
+
+    assert ids == ((legacy["_id"], 0), (legacy["_id"], 1), chunk["_id"])
+    assert [vector.tolist() for vector in vectors] == [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]
+
+def test_migration_rewrites_legacy_documents():
+    from api.migrate_embeddings import migrate
+    user_id, agent_id = ObjectId(), ObjectId()
+    legacy_id = knowledge_db.embeddings.insert_one({
+        "user_id": user_id, "agent_id": agent_id, "embeddings": [[1.0, 0.0], [0.0, 1.0]],
+    }).inserted_id
+    try:
+        documents, chunks = migrate()
+
+        assert documents >= 1 and chunks >= 2
+        assert knowledge_db.embeddings.find_one({"_id": legacy_id}) is None
+        migrated = list(knowledge_db.embeddings.find({"source_id": legacy_id}).sort("chunk", 1))
+        assert [document["chunk"] for document in migrated] == [0, 1]
+        assert get_embeddings(user_id, agent_id) == [[1.0, 0.0], [0.0, 1.0]]
+        assert get_embedding_matrix(user_id, agent_id).tolist() == [[1.0, 0.0], [0.0, 1.0]]
+        assert migrate() == (0, 0)
+    finally:
+        knowledge_db.embeddings.delete_many({"user_id": user_id})
@@ -0,0 +1,59 @@
+import pytest
+import json
+import rsa
+
+from api.tools.google_client import get_google_client, evict_google_clients, google_clients, parse_settings
+
+def service_account_info(email: str = "reader@test-project.iam.gserviceaccount.com") -> dict:
+    _, private_key = rsa.newkeys(1024)
+    return {
+        "type": "service_account",
+        "project_id": "test-project",
+        "private_key_id": "key-id",
+        "private_key": private_key.save_pkcs1().decode(),
+        "client_email": email,
+        "client_id": "1",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+
+@pytest.fixture(scope="module")
+def settings():
+    return service_account_info()
+
+@pytest.fixture(autouse=True)
+def clear_clients():
+    google_clients.clear()
+    yield
+    google_clients.clear()
+
+def test_client_is_built_once_per_settings_and_api(settings):
+    sheets = get_google_client(settings, "sheets", "v4")
+
+    assert get_google_client(dict(settings), "sheets", "v4") is sheets
+    assert get_google_client(json.dumps(settings), "sheets", "v4") is sheets
+    assert get_google_client(settings, "drive", "v3") is not sheets
+    assert sheets.credentials.scopes == ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+
+def test_each_thread_gets_its_own_connection(settings):
+    import threading
+    client = get_google_client(settings, "sheets", "v4")
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(client.http()))
+    thread.start()
+    thread.join()
+
+    assert client.http() is client.http()
+    assert connections[0] is not client.http()
+
+def test_evicting_settings_rebuilds_clients(settings):
+    sheets = get_google_client(settings, "sheets", "v4")
+    evict_google_clients(settings)
+
+    assert get_google_client(settings, "sheets", "v4") is not sheets
+
+def test_invalid_settings_are_rejected():
+    with pytest.raises(ValueError):
+        parse_settings("")
+    with pytest.raises(ValueError):
+        parse_settings("{not json")
+    evict_google_clients("{not json")
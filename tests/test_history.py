@@ -0,0 +1,62 @@
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+
+from api.history import build_history_messages, count_tokens, entry_tokens
+
+def make_history(turns: int, words: int = 50) -> list:
+    return [
+        {"user": f"question {i} " + "word " * words, "assistant": f"answer {i} " + "word " * words, "agent_id": None, "agent_name": "Generalist"}
+        for i in range(turns)
+    ]
+
+def test_short_history_is_replayed_verbatim():
+    history = make_history(3)
+    messages = build_history_messages(history, token_budget=10000)
+
+    assert [type(m) for m in messages] == [HumanMessage, AIMessage] * 3
+    assert messages[0].content == history[0]["user"]
+    assert messages[-1].content == history[-1]["assistant"]
+
+def test_history_is_trimmed_to_token_budget_keeping_newest_turns():
+    history = make_history(20)
+    budget = sum(entry_tokens(entry) for entry in history[-3:])
+    messages = build_history_messages(history, token_budget=budget)
+
+    assert len(messages) == 6
+    assert messages[0].content == history[17]["user"]
+    assert messages[-1].content == history[19]["assistant"]
+
+def test_turns_not_yet_summarized_are_capped_only_by_the_budget():
+    history = make_history(12)
+    messages = build_history_messages(history, summary={"text": "Turns 0 and 1.", "turns": 2}, token_budget=10000)
+
+    assert len(messages) == 1 + 2 * 10
+    assert messages[1].content == history[2]["user"]
+
+def test_newest_turn_is_kept_even_when_over_budget():
+    history = make_history(2, words=500)
+    messages = build_history_messages(history, token_budget=10)
+
+    assert len(messages) == 2
+    assert messages[0].content == history[1]["user"]
+
+def test_summary_replaces_covered_turns():
+    history = make_history(10)
+    summary = {"text": "The user asked about questions 0 to 7.", "turns": 8}
+    messages = build_history_messages(history, summary=summary, token_budget=10000)
+
+    assert isinstance(messages[0], SystemMessage)
+    assert summary["text"] in messages[0].content
+    assert [m.content for m in messages[1:]] == [history[8]["user"], history[8]["assistant"], history[9]["user"], history[9]["assistant"]]
+
+def test_stale_summary_is_ignored_after_history_was_truncated():
+    history = make_history(3)
+    summary = {"text": "Covers turns that no longer exist.", "turns": 8}
+    messages = build_history_messages(history, summary=summary, token_budget=10000)
+
+    assert not any(isinstance(m, SystemMessage) for m in messages)
+    assert len(messages) == 6
+
+def test_stored_token_counts_are_used():
+    entry = {"user": "hello", "assistant": "world", "tokens": 1234}
+    assert entry_tokens(entry) == 1234
+    assert entry_tokens({"user": "hello", "assistant": "world"}) == count_tokens("hello") + count_tokens("world")
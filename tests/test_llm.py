@@ -0,0 +1,19 @@
+from api.llm import get_chat_model, get_openai_clients, pool_stats
+
+def test_chat_models_are_cached_per_configuration():
+    """Tests that identical model configurations reuse one ChatOpenAI instance."""
+    first = get_chat_model("gpt-4o-mini", temperature=0)
+    second = get_chat_model("gpt-4o-mini", temperature=0)
+    other = get_chat_model("gpt-4o-mini", temperature=0.7)
+
+    assert first is second
+    assert first is not other
+
+def test_chat_models_share_pooled_http_clients():
+    """Tests that every model, cached or not, talks through the shared OpenAI clients."""
+    sync_client, async_client = get_openai_clients(max_retries=3)
+    with_tools = get_chat_model("gpt-4", temperature=0.2, streaming=True, max_retries=3, tools=[])
+
+    assert with_tools.client is sync_client.chat.completions
+    assert with_tools.async_client is async_client.chat.completions
+    assert "in_flight" in pool_stats()["async"]
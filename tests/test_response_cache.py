@@ -0,0 +1,104 @@
+import pytest
+import asyncio
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import AIMessageChunk
+
+from api.response_cache import CachedResponseModel, invalidate_agent_responses, normalize_question, response_cache
+
+class CountingLLM:
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self.fail = fail
+
+    async def astream(self, messages):
+        self.calls += 1
+        for word in ["Our ", "office ", "opens ", "at ", "9."]:
+            await asyncio.sleep(0.01)
+            if self.fail:
+                raise RuntimeError("upstream failed")
+            yield AIMessageChunk(content=word)
+
+def prompt(question: str, history: list | None = None) -> list:
+    return [SystemMessage(content="FAQ agent"), *(history or []), HumanMessage(content=question)]
+
+async def collect(model, messages) -> str:
+    return "".join([chunk.content async for chunk in model.astream(messages)])
+
+def test_normalize_question():
+    assert normalize_question("  When does the office   OPEN? ") == "when does the office open"
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_questions_share_one_generation():
+    llm = CountingLLM()
+    model = CachedResponseModel(llm, "agent-1", "v1")
+
+    answers = await asyncio.gather(*(collect(model, prompt("When do you open?")) for _ in range(5)))
+
+    assert answers == ["Our office opens at 9."] * 5
+    assert llm.calls == 1
+
+@pytest.mark.asyncio
+async def test_repeated_question_is_served_from_cache():
+    llm = CountingLLM()
+    model = CachedResponseModel(llm, "agent-2", "v1")
+
+    await collect(model, prompt("When do you open?"))
+    hits = response_cache.hits
+    assert await collect(model, prompt("when do you open")) == "Our office opens at 9."
+
+    assert llm.calls == 1
+    assert response_cache.hits == hits + 1
+
+@pytest.mark.asyncio
+async def test_different_history_version_or_invalidation_misses():
+    llm = CountingLLM()
+    model = CachedResponseModel(llm, "agent-3", "v1")
+    await collect(model, prompt("When do you open?"))
+
+    await collect(model, prompt("When do you open?", [HumanMessage(content="Hi"), AIMessage(content="Hello")]))
+    await collect(CachedResponseModel(llm, "agent-3", "v2"), prompt("When do you open?"))
+    invalidate_agent_responses("agent-3")
+    await collect(model, prompt("When do you open?"))
+
+    assert llm.calls == 4
+
+@pytest.mark.asyncio
+async def test_failed_generation_reaches_every_waiter_and_is_not_cached():
+    llm = CountingLLM(fail=True)
+    model = CachedResponseModel(llm, "agent-4", "v1")
+
+    results = await asyncio.gather(*(collect(model, prompt("When do you open?")) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert llm.calls == 1
+    assert len(response_cache) == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_generation_releases_every_waiter():
+    from api.response_cache import _in_flight
+    model = CachedResponseModel(CountingLLM(), "agent-5", "v1")
+    waiters = [asyncio.create_task(collect(model, prompt("When do you open?"))) for _ in range(3)]
+    await asyncio.sleep(0.015)
+
+    next(iter(_in_flight.values())).task.cancel()
+    results = await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), timeout=1)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(response_cache) == 0
+
+@pytest.mark.asyncio
+async def test_answer_started_before_invalidation_is_not_cached_and_generations_are_pruned(monkeypatch):
+    from api import response_cache as module
+    llm = CountingLLM()
+    model = CachedResponseModel(llm, "agent-6", "v1")
+    answer = asyncio.create_task(collect(model, prompt("When do you open?")))
+    await asyncio.sleep(0.015)
+    invalidate_agent_responses("agent-6")
+    await answer
+
+    await collect(model, prompt("When do you open?"))
+    assert llm.calls == 2
+
+    monkeypatch.setattr(module, "RESPONSE_CACHE_TTL", 0)
+    invalidate_agent_responses("agent-7")
+    assert "agent-6" not in module._generations
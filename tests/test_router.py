@@ -0,0 +1,103 @@
+import pytest
+import numpy as np
+from bson import ObjectId
+
+import api.embed
+import api.router
+from api.router import route_agent, get_org_matrix, invalidate_org, lexical_scores, top_k
+
+VECTORS = {
+    "Billing: Answers invoice and payment questions": [1.0, 0.0, 0.0],
+    "Support: Troubleshoots product issues": [0.0, 1.0, 0.0],
+    "How do I pay my invoice?": [0.9, 0.1, 0.0],
+    "What is the weather on Mars?": [0.0, 0.0, 1.0],
+}
+
+@pytest.fixture(autouse=True)
+def fake_embeddings(monkeypatch):
+    """Replaces the OpenAI embedding calls with fixed vectors and counts them."""
+    calls = {"texts": 0}
+
+    async def fake_aembed_texts(texts):
+        calls["texts"] += len(texts)
+        return api.embed.normalize([VECTORS[t] for t in texts])
+
+    async def fake_aembed_query(text):
+        return api.embed.normalize(VECTORS[text])
+
+    monkeypatch.setattr(api.embed, "aembed_texts", fake_aembed_texts)
+    monkeypatch.setattr(api.embed, "aembed_query", fake_aembed_query)
+    monkeypatch.setattr(api.router, "ROUTER_MODE", "embedding")
+    monkeypatch.setattr(api.router, "ROUTER_FALLBACK", "generalist")
+    return calls
+
+@pytest.fixture
+def agents():
+    return [
+        {"_id": ObjectId(), "name": "Billing", "description": "Answers invoice and payment questions", "updated_at": "1"},
+        {"_id": ObjectId(), "name": "Support", "description": "Troubleshoots product issues", "updated_at": "1"},
+    ]
+
+@pytest.mark.asyncio
+async def test_routes_to_most_similar_agent(agents):
+    org_id = ObjectId()
+    agent = await route_agent("How do I pay my invoice?", org_id, agents)
+    assert agent["name"] == "Billing"
+
+@pytest.mark.asyncio
+async def test_low_confidence_falls_back_to_generalist(agents):
+    org_id = ObjectId()
+    agent = await route_agent("What is the weather on Mars?", org_id, agents)
+    assert agent is None
+
+@pytest.mark.asyncio
+async def test_matrix_is_reused_until_agents_change(agents, fake_embeddings):
+    org_id = ObjectId()
+    first = await get_org_matrix(org_id, agents)
+    assert await get_org_matrix(org_id, agents) is first
+    assert fake_embeddings["texts"] == 2
+    assert first.matrix.dtype == np.float32
+
+    agents[1]["updated_at"] = "2"
+    rebuilt = await get_org_matrix(org_id, agents)
+    assert rebuilt is not first
+    assert fake_embeddings["texts"] == 3
+
+    invalidate_org(org_id)
+    assert await get_org_matrix(org_id, agents) is not rebuilt
+    assert fake_embeddings["texts"] == 3
+
+def test_lexical_scores_rank_matching_agent_first():
+    """Tests that the BM25 prefilter ranks the agent sharing the question's terms highest."""
+    agents = [
+        {"_id": ObjectId(), "name": f"Agent {i}", "description": f"Handles topic number {i}"}
+        for i in range(20)
+    ]
+    agents.append({"_id": ObjectId(), "name": "Payroll", "description": "Salary, payslips and payroll deductions"})
+
+    scores = lexical_scores("Why is my payslip deduction wrong?", agents)
+    shortlist = top_k(agents, scores, 3)
+    assert shortlist[0]["name"] == "Payroll"
+    assert len(shortlist) == 3
+
+@pytest.mark.asyncio
+async def test_llm_router_only_sees_shortlist(monkeypatch):
+    """Tests that large organizations only send the top-k agents to the LLM router."""
+    monkeypatch.setattr(api.router, "ROUTER_MODE", "llm")
+    monkeypatch.setattr(api.router, "ROUTER_SHORTLIST_K", 4)
+    seen = {}
+
+    async def fake_route_with_llm(question, agents):
+        seen["agents"] = agents
+        return agents[0]
+
+    monkeypatch.setattr(api.router, "route_with_llm", fake_route_with_llm)
+    agents = [
+        {"_id": ObjectId(), "name": f"Agent {i}", "description": f"Handles topic number {i}"}
+        for i in range(50)
+    ]
+    agents.append({"_id": ObjectId(), "name": "Travel", "description": "Books flights and hotels"})
+
+    agent = await route_agent("Book me a flight to Berlin", ObjectId(), agents)
+    assert len(seen["agents"]) == 4
+    assert agent["name"] == "Travel"
@@ -0,0 +1,117 @@
+import pytest
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import AIMessageChunk
+
+import api.embed
+import api.semantic_cache
+from api.semantic_cache import SemanticCacheModel, AnswerStore, purge_agent_answers
+
+VECTORS = {
+    "When do you open?": [1.0, 0.0, 0.0],
+    "What time does the office open?": [0.97, 0.2, 0.0],
+    "How do I reset my password?": [0.0, 1.0, 0.0],
+}
+
+@pytest.fixture(autouse=True)
+def fake_embeddings(monkeypatch):
+    async def fake_aembed_query(text):
+        return api.embed.normalize(VECTORS[text])
+    monkeypatch.setattr(api.embed, "aembed_query", fake_aembed_query)
+
+class CountingLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def astream(self, messages):
+        self.calls += 1
+        yield AIMessageChunk(content=f"answer {self.calls}")
+
+def prompt(question: str, history: list | None = None) -> list:
+    return [SystemMessage(content="FAQ agent"), *(history or []), HumanMessage(content=question)]
+
+async def collect(model, messages) -> str:
+    return "".join([chunk.content async for chunk in model.astream(messages)])
+
+@pytest.mark.asyncio
+async def test_paraphrase_is_answered_from_cache():
+    llm = CountingLLM()
+    model = SemanticCacheModel(llm, "org-1", "agent-1", "v1")
+
+    assert await collect(model, prompt("When do you open?")) == "answer 1"
+    assert await collect(model, prompt("What time does the office open?")) == "answer 1"
+    assert await collect(model, prompt("How do I reset my password?")) == "answer 2"
+    assert llm.calls == 2
+
+@pytest.mark.asyncio
+async def test_answers_are_isolated_per_org_and_version():
+    llm = CountingLLM()
+    await collect(SemanticCacheModel(llm, "org-1", "agent-2", "v1"), prompt("When do you open?"))
+
+    await collect(SemanticCacheModel(llm, "org-2", "agent-2", "v1"), prompt("When do you open?"))
+    await collect(SemanticCacheModel(llm, "org-1", "agent-2", "v2"), prompt("When do you open?"))
+    assert llm.calls == 3
+
+@pytest.mark.asyncio
+async def test_follow_up_questions_and_purged_agents_bypass_cache():
+    llm = CountingLLM()
+    model = SemanticCacheModel(llm, "org-1", "agent-3", "v1")
+    await collect(model, prompt("When do you open?"))
+
+    await collect(model, prompt("When do you open?", [HumanMessage(content="Hi"), AIMessage(content="Hello")]))
+    purge_agent_answers("agent-3")
+    await collect(model, prompt("When do you open?"))
+    assert llm.calls == 3
+
+def test_full_store_replaces_least_recently_used_answer():
+    store = AnswerStore("v1", capacity=2, dim=2)
+    first, second, third = api.embed.normalize([[1, 0], [0, 1], [1, 1]])
+    store.add(first, "first", ttl=60)
+    store.add(second, "second", ttl=60)
+    assert store.search(first, 0.9)[0] == "first"
+
+    store.add(third, "third", ttl=60)
+
+    assert store.search(second, 0.99)[0] is None
+    assert store.search(first, 0.99)[0] == "first"
+    assert store.evictions == 1
+
+def test_agent_limit_drops_least_recently_used_store(monkeypatch):
+    monkeypatch.setattr(api.semantic_cache, "SEMANTIC_CACHE_MAX_AGENTS", 2)
+    api.semantic_cache.clear()
+    get_store = api.semantic_cache._get_store
+    busy = get_store(("org", "busy"), "v1", 2, create=True)
+    get_store(("org", "idle"), "v1", 2, create=True)
+    assert get_store(("org", "busy"), "v1", 2, create=False) is busy
+
+    get_store(("org", "new"), "v1", 2, create=True)
+
+    assert get_store(("org", "idle"), "v1", 2, create=False) is None
+    assert get_store(("org", "busy"), "v1", 2, create=False) is busy
+    api.semantic_cache.clear()
+
+@pytest.mark.asyncio
+async def test_regenerate_skips_the_semantic_cache():
+    from api.agent import without_answer_caches
+    from api.response_cache import CachedResponseModel
+    llm = CountingLLM()
+    model = CachedResponseModel(SemanticCacheModel(llm, "org-1", "agent-5", "v1"), "agent-5", "v1")
+    await collect(model, prompt("When do you open?"))
+
+    assert await collect(without_answer_caches(model), prompt("When do you open?")) == "answer 2"
+    assert llm.calls == 2
+
+@pytest.mark.asyncio
+async def test_answer_finished_after_a_purge_is_not_stored():
+    class PurgedWhileStreamingLLM(CountingLLM):
+        async def astream(self, messages):
+            self.calls += 1
+            if self.calls == 1:
+                purge_agent_answers("agent-6")
+            yield AIMessageChunk(content=f"answer {self.calls}")
+
+    llm = PurgedWhileStreamingLLM()
+    model = SemanticCacheModel(llm, "org-1", "agent-6", "v1")
+    assert await collect(model, prompt("When do you open?")) == "answer 1"
+
+    assert await collect(model, prompt("When do you open?")) == "answer 2"
+    assert await collect(model, prompt("When do you open?")) == "answer 2"
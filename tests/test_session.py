@@ -168,12 +168,12 @@ def test_list_sessions_for_user(authenticated_user_token):
     assert "user1-session2" in session_ids
 
 
-@patch('api.main.ChatOpenAI')
-def test_get_specific_session(MockChatOpenAI, authenticated_user_token):
+@patch('api.main.get_chat_model')
+def test_get_specific_session(mock_get_chat_model, authenticated_user_token):
     """
     Tests retrieving a single, specific session by its ID.
     """
-    mock_instance = MockChatOpenAI.return_value
+    mock_instance = mock_get_chat_model.return_value
     mock_instance.invoke.return_value.content = "Mocked Session Title"
 
     token, user_id = authenticated_user_token
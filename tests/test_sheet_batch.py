@@ -0,0 +1,109 @@
+import pytest
+import threading
+import time
+import httplib2
+from googleapiclient.errors import HttpError
+
+import api.tools.google_sheet as google_sheet
+from api.tools import sheet_cache
+from api.tools.sheet_batch import batch_get, coalesced_get
+
+class FakeSheetsClient:
+    """Stands in for GoogleClient: answers values.get/batchGet from a dict of ranges."""
+
+    def __init__(self, data: dict, latency: float = 0.0):
+        self.data = data
+        self.latency = latency
+        self.requests = []
+        self.service = self
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range):
+        return ("get", [range])
+
+    def batchGet(self, spreadsheetId, ranges):
+        return ("batchGet", list(ranges))
+
+    def execute(self, request):
+        kind, ranges = request
+        self.requests.append(request)
+        time.sleep(self.latency)
+        bad = [r for r in ranges if r not in self.data]
+        if bad:
+            raise HttpError(httplib2.Response({"status": 400}), b'{"error": {"message": "Unable to parse range"}}')
+        if kind == "get":
+            return {"values": self.data[ranges[0]]}
+        return {"valueRanges": [{"range": r, "values": self.data[r]} for r in ranges]}
+
+DATA = {"A1:B1": [["a", "1"]], "A2:B2": [["b", "2"]], "A3:B3": [["c", "3"]], "A4:B4": [["d", "4"]]}
+
+@pytest.fixture(autouse=True)
+def clear_sheet_cache():
+    sheet_cache.clear()
+    yield
+    sheet_cache.clear()
+
+def test_batch_get_reads_all_ranges_in_one_request():
+    client = FakeSheetsClient(DATA)
+    results = batch_get(client, "sheet-1", ["A1:B1", "A2:B2"])
+
+    assert results == {"A1:B1": [["a", "1"]], "A2:B2": [["b", "2"]]}
+    assert client.requests == [("batchGet", ["A1:B1", "A2:B2"])]
+
+def test_bad_range_only_fails_itself():
+    client = FakeSheetsClient(DATA)
+    results = batch_get(client, "sheet-1", ["A1:B1", "Nope!!"])
+
+    assert results["A1:B1"] == [["a", "1"]]
+    assert isinstance(results["Nope!!"], HttpError)
+
+def test_concurrent_reads_of_one_spreadsheet_coalesce():
+    client = FakeSheetsClient(DATA, latency=0.05)
+    results = {}
+
+    def read(range_name):
+        results[range_name] = coalesced_get(client, ("settings", "sheet-1"), "sheet-1", [range_name])[range_name]
+
+    threads = [threading.Thread(target=read, args=(r,)) for r in DATA]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The first read goes out at once; the others arrive while it is in flight and share one request.
+    assert results == DATA
+    assert len(client.requests) == 2
+    assert len(client.requests[0][1]) == 1
+    assert sorted(client.requests[0][1] + client.requests[1][1]) == sorted(DATA)
+
+def test_read_of_idle_spreadsheet_does_not_wait(monkeypatch):
+    from api.tools import sheet_batch
+    monkeypatch.setattr(sheet_batch, "SHEETS_COALESCE_WINDOW", 1.0)
+    client = FakeSheetsClient(DATA)
+
+    start = time.monotonic()
+    assert coalesced_get(client, ("settings", "sheet-1"), "sheet-1", ["A1:B1"]) == {"A1:B1": [["a", "1"]]}
+    assert time.monotonic() - start < 0.5
+
+def test_ranges_missing_from_batch_response_read_as_empty():
+    client = FakeSheetsClient(DATA)
+    client.execute = lambda request: {"valueRanges": [{"values": [["a", "1"]]}]}
+
+    assert batch_get(client, "sheet-1", ["A1:B1", "A2:B2"]) == {"A1:B1": [["a", "1"]], "A2:B2": []}
+
+def test_ranges_tool_labels_each_range_and_uses_cache(monkeypatch):
+    client = FakeSheetsClient(DATA)
+    monkeypatch.setattr(google_sheet, "get_google_client", lambda settings, api, version: client)
+    settings = {"client_email": "reader@example.com"}
+
+    output = google_sheet.read_google_sheet_ranges.func(settings, "sheet-1", ["A1:B1", "A2:B2", "A1:B1"])
+    assert output == "Data from spreadsheet 'sheet-1':\n--- Range 'A1:B1' ---\na,1\n--- Range 'A2:B2' ---\nb,2"
+
+    google_sheet.read_google_sheet_ranges.func(settings, "sheet-1", ["A2:B2", "A3:B3"])
+    assert client.requests[-1] == ("batchGet", ["A3:B3"])
+    assert len(client.requests) == 2
@@ -0,0 +1,71 @@
+import pytest
+
+from api.cache import TTLCache
+from api.tools import sheet_cache
+from api.tools.sheet_cache import get_range_values, normalize_range
+
+SETTINGS = {"client_email": "reader@example.com", "private_key": "unused"}
+
+@pytest.fixture(autouse=True)
+def clear_sheet_cache():
+    sheet_cache.clear()
+    yield
+    sheet_cache.clear()
+
+class Fetcher:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return [["name", "total"], ["a", str(self.calls)]]
+
+def test_normalize_range():
+    assert normalize_range(" Sheet1!$a$1:b10 ") == "Sheet1!A1:B10"
+    assert normalize_range("'My Sheet'!a:c") == "'My Sheet'!A:C"
+    assert normalize_range("b2") == "B2"
+    assert normalize_range("MonthlyTotals") == "MonthlyTotals"
+
+def test_equivalent_ranges_share_one_fetch():
+    fetch = Fetcher()
+    first = get_range_values(SETTINGS, "sheet-1", "Sheet1!A1:B2", fetch)
+    second = get_range_values(SETTINGS, "sheet-1", "sheet1!$A$1:$B$2".replace("sheet1", "Sheet1"), fetch)
+
+    assert first == second
+    assert fetch.calls == 1
+
+def test_expired_range_is_refetched(monkeypatch):
+    fetch = Fetcher()
+    monkeypatch.setattr(sheet_cache, "SHEETS_CACHE_TTL", 0)
+
+    get_range_values(SETTINGS, "sheet-1", "A1:B2", fetch)
+    get_range_values(SETTINGS, "sheet-1", "A1:B2", fetch)
+
+    assert fetch.calls == 2
+
+def test_unchanged_spreadsheet_is_revalidated_without_refetch(monkeypatch):
+    fetch = Fetcher()
+    modified = {"time": "2024-01-01T00:00:00Z"}
+    monkeypatch.setattr(sheet_cache, "SHEETS_CACHE_TTL", 0)
+    monkeypatch.setattr(sheet_cache, "SHEETS_CACHE_REVALIDATE", True)
+    monkeypatch.setattr(sheet_cache, "sheet_ranges", TTLCache(maxsize=10, ttl=60, name="test_sheet_ranges"))
+    monkeypatch.setattr(sheet_cache, "get_modified_time", lambda settings, spreadsheet_id: modified["time"])
+
+    get_range_values(SETTINGS, "sheet-1", "A1:B2", fetch)
+    get_range_values(SETTINGS, "sheet-1", "A1:B2", fetch)
+    assert fetch.calls == 1
+
+    modified["time"] = "2024-01-02T00:00:00Z"
+    assert get_range_values(SETTINGS, "sheet-1", "A1:B2", fetch)[1][1] == "2"
+    assert fetch.calls == 2
+
+def test_cache_is_bounded_by_weight():
+    cache = TTLCache(maxsize=100, ttl=60, maxweight=10, weigher=len)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    cache.set("c", "12345")
+
+    assert cache.get("a") is None
+    assert cache.get("c") == "12345"
+    assert cache.weight == 10
+    assert cache.stats()["evictions"] == 1
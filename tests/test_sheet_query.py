@@ -0,0 +1,116 @@
+import pytest
+from functools import partial
+
+import api.tools.google_sheet as google_sheet
+from api.tools import sheet_cache, sheet_query
+from api.tools.sheet_query import SheetTable, QueryError, run_query, format_result
+
+VALUES = [
+    ["Region", "Product", "Sales"],
+    ["North", "A", "1,200"],
+    ["South", "B", "300"],
+    ["North", "B", ""],
+    ["East", "A", "50"],
+]
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    sheet_cache.clear()
+    yield
+    sheet_cache.clear()
+
+def test_numeric_columns_are_stored_as_floats():
+    table = SheetTable(VALUES)
+    assert table.column("sales").dtype.kind == "f"
+    assert table.column("Region").dtype.kind == "U"
+    assert table.num_rows == 4
+
+def test_filter_project_sort_and_limit():
+    names, columns, matched = run_query(
+        SheetTable(VALUES),
+        columns=["Region", "Sales"],
+        filters=[{"column": "Sales", "op": ">=", "value": 50}],
+        sort_by="sales",
+        limit=2,
+    )
+    assert format_result(names, columns, matched) == "Region,Sales\nEast,50\nSouth,300\n(2 of 3 result rows shown)"
+
+def test_group_by_aggregates():
+    names, columns, matched = run_query(
+        SheetTable(VALUES),
+        group_by=["Region"],
+        aggregates=[{"func": "sum", "column": "Sales"}, {"func": "count"}],
+        sort_by="sum(Sales)",
+        descending=True,
+    )
+    assert format_result(names, columns, matched).splitlines() == [
+        "Region,sum(Sales),count", "North,1200,2", "South,300,1", "East,50,1", "(3 of 3 result rows shown)",
+    ]
+
+def test_descending_sort_keeps_empty_cells_last_and_ties_in_order():
+    values = [["Name", "Score", "Team"], ["a", "2", "x"], ["b", "", "y"], ["c", "5", ""], ["d", "2", "x"]]
+
+    names, columns, _ = run_query(SheetTable(values), columns=["Name", "Score"], sort_by="Score", descending=True)
+    assert list(columns[0]) == ["c", "a", "d", "b"]
+    names, columns, _ = run_query(SheetTable(values), columns=["Name", "Team"], sort_by="Team", descending=True)
+    assert list(columns[0]) == ["b", "a", "d", "c"]
+
+def test_aggregates_without_matching_rows_return_one_row():
+    names, columns, matched = run_query(
+        SheetTable(VALUES),
+        filters=[{"column": "Region", "op": "==", "value": "West"}],
+        aggregates=[{"func": "count"}, {"func": "sum", "column": "Sales"}],
+    )
+    assert format_result(names, columns, matched).splitlines() == ["count,sum(Sales)", "0,0", "(1 of 1 result rows shown)"]
+
+def test_columns_with_leading_zeros_stay_text():
+    table = SheetTable([["Id", "Price"], ["0042", "0.5"], ["117", "10"]])
+    assert list(table.column("Id")) == ["0042", "117"]
+    assert table.column("Price").dtype.kind == "f"
+
+def test_caps_limit_rows_and_columns():
+    names, columns, matched = run_query(SheetTable(VALUES), max_rows=1, max_columns=2, limit=10)
+    assert names == ["Region", "Product"]
+    assert len(columns[0]) == 1
+    assert matched == 4
+
+def test_bad_queries_explain_themselves():
+    with pytest.raises(QueryError, match="Available columns"):
+        run_query(SheetTable(VALUES), columns=["Revenue"])
+    with pytest.raises(QueryError, match="numeric"):
+        run_query(SheetTable(VALUES), aggregates=[{"func": "sum", "column": "Region"}])
+
+def test_query_tool_reuses_the_columnar_table(monkeypatch):
+    reads = []
+
+    def fake_read_range(client, settings, spreadsheet_id, range_name):
+        reads.append(range_name)
+        return sheet_cache.get_range_values(settings, spreadsheet_id, range_name, lambda: VALUES)
+
+    monkeypatch.setattr(google_sheet, "get_google_client", lambda settings, api, version: object())
+    monkeypatch.setattr(google_sheet, "_read_range", fake_read_range)
+    query = partial(google_sheet.query_google_sheet.func, settings={"client_email": "x"}, limits={"max_rows": 1})
+
+    first = query(spreadsheet_id="s", range_name="A:C", filters=[google_sheet.SheetFilter(column="Region", value="North")])
+    query(spreadsheet_id="s", range_name="A:C", aggregates=[{"func": "max", "column": "Sales"}])
+
+    assert first.splitlines()[1:] == ["Region,Product,Sales", "North,A,1200", "(1 of 2 result rows shown)"]
+    assert sheet_query._stats["table_hits"] >= 1
+    assert len(reads) == 2
+
+def test_tables_are_weighed_and_evicted_with_their_range():
+    settings = {"client_email": "x"}
+    values = sheet_cache.get_range_values(settings, "s", "A:C", lambda: VALUES)
+    key = (sheet_cache.settings_fingerprint(settings), "s", sheet_cache.normalize_range("A:C"))
+    weight = sheet_cache.sheet_ranges.weight
+    queries = sheet_query._stats["queries"]
+
+    table = sheet_query.get_table(key, values)
+    run_query(table, columns=["Region"])
+
+    assert sheet_query.get_table(key, values) is table
+    assert sheet_cache.sheet_ranges.weight == weight + table.nbytes
+    assert sheet_query._stats["queries"] == queries + 1
+    sheet_cache.sheet_ranges.invalidate(key)
+    assert sheet_cache.sheet_ranges.weight == 0
+    assert sheet_query.get_table(key, values) is not table
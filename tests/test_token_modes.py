@@ -0,0 +1,85 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api.auth
+from api.main import app, pwd_context
+from api.auth import users_db, revocations_db, verify_token
+from api.revocation import BloomFilter
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def cleanup_db():
+    users_db.delete_many({})
+    revocations_db.delete_many({})
+    yield
+    users_db.delete_many({})
+    revocations_db.delete_many({})
+
+@pytest.fixture
+def stateless_mode(monkeypatch):
+    monkeypatch.setattr(api.auth, "TOKEN_MODE", "stateless")
+
+def auth_header(token):
+    """Helper function to create authorization headers."""
+    return {"Authorization": f"Bearer {token}"}
+
+def create_user(username, password):
+    users_db.insert_one({
+        "username": username,
+        "password": pwd_context.hash(password),
+        "permission": "orguser",
+        "status": "active",
+        "email": ""
+    })
+    resp = client.post("/signin", data={"username": username, "password": password})
+    assert resp.status_code == 200
+    return resp.json()["access_token"]
+
+def test_bloom_filter_has_no_false_negatives():
+    """Tests that every added item is reported as present."""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [f"user-{i}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 500
+
+def test_stateless_mode_skips_user_lookup(stateless_mode):
+    """Tests that claims embedded in the token are trusted without reading users_db."""
+    token = create_user("stateless_user", "statelesspass")
+    users_db.update_one({"username": "stateless_user"}, {"$set": {"permission": "sysadmin"}})
+
+    user = verify_token(token)
+    assert user["username"] == "stateless_user"
+    assert user["permission"] == "orguser"
+
+def test_stateless_mode_rejects_deleted_user(stateless_mode):
+    """Tests that deleting a user revokes tokens that were issued before."""
+    token = create_user("revoked_user", "revokedpass")
+
+    resp = client.delete("/users/revoked_user", headers=auth_header(token))
+    assert resp.status_code == 200
+
+    with pytest.raises(Exception) as exc:
+        verify_token(token)
+    assert exc.value.status_code == 401
+
+def test_revocation_during_refresh_is_kept():
+    """Tests that a user revoked while the filter is being rebuilt stays in the new filter."""
+    from api.revocation import RevocationList
+
+    class RacingCollection:
+        def insert_one(self, document):
+            pass
+
+        def distinct(self, field, query):
+            revocations.revoke("late-user")
+            return ["early-user"]
+
+    revocations = RevocationList(RacingCollection(), retention_seconds=3600)
+    revocations.refresh()
+
+    assert "late-user" in revocations._filter
+    assert "early-user" in revocations._filter
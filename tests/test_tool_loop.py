@@ -0,0 +1,69 @@
+import pytest
+import time
+from langchain.tools import StructuredTool
+from langchain_core.messages import AIMessageChunk, ToolMessage
+
+from api.tool_loop import ToolLoop, execute_tool_calls
+
+def slow_tool(name: str, seconds: float) -> StructuredTool:
+    def run(value: str) -> str:
+        time.sleep(seconds)
+        return f"{name}:{value}"
+    return StructuredTool.from_function(func=run, name=name, description=f"Slow tool {name}")
+
+class ScriptedLLM:
+    """Streams a tool-call turn first, then a text answer; records what it was sent."""
+
+    def __init__(self, tool_calls: list):
+        self.tool_calls = tool_calls
+        self.calls = []
+
+    async def astream(self, messages):
+        self.calls.append(list(messages))
+        if len(self.calls) == 1:
+            yield AIMessageChunk(content="", additional_kwargs={"tool_calls": [
+                {"index": i, "id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": '{"value": "x"}'}}
+                for i, name in enumerate(self.tool_calls)
+            ]})
+        else:
+            yield AIMessageChunk(content="Done")
+            yield AIMessageChunk(content=".")
+
+@pytest.mark.asyncio
+async def test_tool_calls_of_one_turn_run_concurrently():
+    tools = {name: slow_tool(name, 0.3) for name in ("a", "b", "c")}
+    calls = [{"name": name, "args": {"value": name}, "id": name} for name in tools]
+
+    start = time.perf_counter()
+    results = await execute_tool_calls(tools, calls)
+    elapsed = time.perf_counter() - start
+
+    assert [result.content for result in results] == ["a:a", "b:b", "c:c"]
+    assert elapsed < 0.6
+
+@pytest.mark.asyncio
+async def test_slow_tool_times_out_without_failing_the_turn():
+    tools = {"fast": slow_tool("fast", 0), "slow": slow_tool("slow", 1)}
+    calls = [{"name": "fast", "args": {"value": "1"}, "id": "1"}, {"name": "slow", "args": {"value": "2"}, "id": "2"}]
+
+    results = await execute_tool_calls(tools, calls, timeout=0.2)
+
+    assert results[0].content == "fast:1"
+    assert "did not respond" in results[1].content
+
+@pytest.mark.asyncio
+async def test_unknown_tool_is_reported_to_the_model():
+    results = await execute_tool_calls({}, [{"name": "missing", "args": {}, "id": "1"}])
+    assert "Unknown tool" in results[0].content
+
+@pytest.mark.asyncio
+async def test_tool_loop_feeds_results_back_and_streams_answer():
+    llm = ScriptedLLM(["a", "b"])
+    loop = ToolLoop(llm, [slow_tool("a", 0), slow_tool("b", 0)])
+
+    answer = "".join([chunk.content async for chunk in loop.astream(["question"])])
+
+    assert answer == "Done."
+    second_turn = llm.calls[1]
+    assert second_turn[1].additional_kwargs["tool_calls"][0]["function"]["name"] == "a"
+    assert [m.content for m in second_turn if isinstance(m, ToolMessage)] == ["a:x", "b:x"]
@@ -0,0 +1,82 @@
+import pytest
+import time
+from fastapi.testclient import TestClient
+
+from api.main import app, pwd_context
+from api.auth import users_db, user_cache, verify_token
+from api.cache import TTLCache
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def cleanup_db():
+    users_db.delete_many({})
+    yield
+    users_db.delete_many({})
+
+def auth_header(token):
+    """Helper function to create authorization headers."""
+    return {"Authorization": f"Bearer {token}"}
+
+def create_user(username, password, permission="orguser"):
+    users_db.insert_one({
+        "username": username,
+        "password": pwd_context.hash(password),
+        "permission": permission,
+        "status": "active"
+    })
+    resp = client.post("/signin", data={"username": username, "password": password})
+    assert resp.status_code == 200
+    return resp.json()["access_token"]
+
+def test_ttl_cache_expires_and_counts():
+    """Tests that entries expire after their TTL and lookups are counted."""
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_ttl_cache_evicts_least_recently_used():
+    """Tests that the cache stays within maxsize by dropping the oldest entry."""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+def test_verify_token_uses_cache():
+    """Tests that repeated token verification only hits Mongo once."""
+    token = create_user("cached_user", "cachepass")
+
+    verify_token(token)
+    verify_token(token)
+
+    stats = user_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+def test_delete_user_evicts_cache():
+    """Tests that a deleted user can no longer authenticate with a previously cached token."""
+    token = create_user("soon_deleted", "deletepass")
+    assert client.get("/users/soon_deleted", headers=auth_header(token)).status_code == 200
+
+    resp = client.delete("/users/soon_deleted", headers=auth_header(token))
+    assert resp.status_code == 200
+
+    assert client.get("/users/soon_deleted", headers=auth_header(token)).status_code == 401
+
+def test_metrics_requires_sysadmin():
+    """Tests that cache metrics are only exposed to sysadmins."""
+    user_token = create_user("metrics_user", "userpass")
+    assert client.get("/metrics", headers=auth_header(user_token)).status_code == 403
+
+    sys_token = create_user("metrics_admin", "syspass", permission="sysadmin")
+    resp = client.get("/metrics", headers=auth_header(sys_token))
+    assert resp.status_code == 200
+    assert "user_cache" in resp.json()
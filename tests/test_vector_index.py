@@ -0,0 +1,74 @@
+import pytest
+import numpy as np
+from bson import ObjectId
+
+from api.vector_index import VectorIndex, normalize_rows, top_k_indices
+
+def random_vectors(n: int, dim: int = 32, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int) -> list:
+    scores = normalize_rows(vectors) @ normalize_rows(query)
+    return list(np.argsort(-scores, kind="stable")[:k])
+
+def test_top_k_indices_are_sorted_best_first():
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+
+    assert list(top_k_indices(scores, 3)) == [1, 3, 2]
+    assert list(top_k_indices(scores, 10)) == [1, 3, 2, 4, 0]
+    assert top_k_indices(np.array([[0.2, 0.8], [0.6, 0.4]]), 1).tolist() == [[1], [0]]
+
+def test_search_matches_exact_cosine_ranking():
+    vectors = random_vectors(500)
+    index = VectorIndex(32)
+    index.add(list(range(500)), vectors)
+    query = random_vectors(1, seed=1)[0]
+
+    results = index.search(query, k=10)
+
+    assert [item_id for item_id, _ in results] == exact_top_k(vectors, query, 10)
+    assert results[0][1] == pytest.approx(float(normalize_rows(vectors[results[0][0]]) @ normalize_rows(query)), abs=1e-5)
+    assert index.vectors.dtype == np.float32 and index.vectors.flags["C_CONTIGUOUS"]
+
+def test_batch_search_matches_single_searches():
+    vectors = random_vectors(200)
+    index = VectorIndex(32)
+    index.add(list(range(200)), vectors)
+    queries = random_vectors(5, seed=2)
+
+    batch = index.search_batch(queries, k=4)
+    for results, query in zip(batch, queries):
+        single = index.search(query, k=4)
+        assert [item_id for item_id, _ in results] == [item_id for item_id, _ in single]
+        assert [score for _, score in results] == pytest.approx([score for _, score in single], abs=1e-5)
+
+def test_removed_vectors_are_not_returned():
+    vectors = random_vectors(50)
+    index = VectorIndex(32, capacity=4)
+    index.add([f"chunk-{i}" for i in range(50)], vectors)
+
+    best = index.search(vectors[7], k=1)[0][0]
+    assert best == "chunk-7"
+    assert index.remove(["chunk-7", "missing"]) == 1
+
+    assert len(index) == 49
+    assert "chunk-7" not in [item_id for item_id, _ in index.search(vectors[7], k=49)]
+    assert index.search(vectors[49], k=1)[0][0] == "chunk-49"
+
+def test_empty_index_returns_nothing():
+    assert VectorIndex(8).search(np.ones(8), k=3) == []
+
+def test_search_embeddings_reads_every_document_of_the_agent():
+    from api.embed import knowledge_db, save_embedding, search_embeddings
+    user_id, agent_id = ObjectId(), ObjectId()
+    save_embedding([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], user_id, agent_id)
+    save_embedding([[0.0, 0.0, 1.0]], user_id, agent_id)
+    try:
+        results = search_embeddings(user_id, agent_id, [0.1, 0.0, 0.9], k=2)
+        assert len(results) == 2
+        assert results[0][1] > 0.99
+
+        save_embedding([[0.0, 0.1, 1.0]], user_id, agent_id)
+        assert len(search_embeddings(user_id, agent_id, [0.0, 0.0, 1.0], k=10)) == 4
+    finally:
+        knowledge_db.embeddings.delete_many({"user_id": user_id})
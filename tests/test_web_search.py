@@ -0,0 +1,92 @@
+import pytest
+import asyncio
+
+from api.tool_loop import execute_tool_calls
+from api.tools import web
+from api.tools.web import asearch, normalize_query, search_web, set_search_backend
+
+class FakeBackend:
+    def __init__(self, delay: float = 0.05, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.queries = []
+
+    async def search_text(self, query: str) -> str:
+        self.queries.append(query)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("backend unavailable")
+        return f"results for {query}"
+
+@pytest.fixture
+def backend():
+    backend = FakeBackend()
+    set_search_backend(backend)
+    yield backend
+    set_search_backend(None)
+
+def test_normalize_query():
+    assert normalize_query("  Weather   in\tParis ") == "weather in paris"
+
+@pytest.mark.asyncio
+async def test_repeated_queries_are_cached(backend):
+    assert await asearch("Weather in Paris") == "results for Weather in Paris"
+    assert await asearch("weather  in paris") == "results for Weather in Paris"
+    assert backend.queries == ["Weather in Paris"]
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_queries_share_one_search(backend):
+    results = await asyncio.gather(*(asearch("python release") for _ in range(10)), asearch("other"))
+
+    assert set(results[:10]) == {"results for python release"}
+    assert sorted(backend.queries) == ["other", "python release"]
+
+@pytest.mark.asyncio
+async def test_search_times_out_and_is_not_cached(backend):
+    backend.delay = 1
+
+    assert "did not respond within 0.1 seconds" in await asearch("slow", timeout=0.1)
+
+    backend.delay = 0
+    assert await asearch("slow") == "results for slow"
+    assert len(backend.queries) == 2
+
+@pytest.mark.asyncio
+async def test_failures_are_returned_as_text(backend):
+    backend.fail = True
+
+    assert await asearch("broken") == "Error: The web search for 'broken' failed: backend unavailable"
+    assert web.search_results.get("broken") is None
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_search(backend):
+    first = asyncio.ensure_future(asearch("shared"))
+    second = asyncio.ensure_future(asearch("shared"))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "results for shared"
+
+@pytest.mark.asyncio
+async def test_tool_loop_awaits_async_tool(backend):
+    results = await execute_tool_calls({"search_web": search_web}, [{"name": "search_web", "args": {"query": "q"}, "id": "1"}])
+
+    assert results[0].content == "results for q"
+
+def test_sync_invoke_runs_the_search(backend):
+    assert search_web.invoke({"query": "sync query"}) == "results for sync query"
+    assert web.search_results.get("sync query") == "results for sync query"
+
+@pytest.mark.asyncio
+async def test_result_is_cached_before_search_leaves_in_flight(backend, monkeypatch):
+    seen = []
+
+    class RecordingDict(dict):
+        def pop(self, key, *default):
+            seen.append(web.search_results.get(key))
+            return super().pop(key, *default)
+
+    monkeypatch.setattr(web, "_in_flight", RecordingDict())
+    await asearch("handoff")
+
+    assert seen == ["results for handoff"]